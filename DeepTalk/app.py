@@ -1,11 +1,25 @@
 # app.py
 import os
-import uuid
+import logging
+import json
+import threading
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, session
+from flask import Flask, render_template, request, redirect, url_for, session, g
 from flask_sock import Sock
 from itsdangerous import URLSafeSerializer
-from db import get_cursor
+from db import get_cursor, pool_stats
+from matchmaking import MatchEngine
+from cache import TTLCache, InvalidationListener, publish_invalidation
+import conversation_summary
+import chat
+import xp
+import metrics
+import events
+from cards import catalog as card_catalog
+from signaling import create_backend
+from reaper import Reaper
+from match_tick import MatchTicker, MatchListener
+from write_behind import WriteBehind
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -13,24 +27,113 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "dev-secret")
 sock = Sock(app)
+# Latenz pro Route, Queries pro Request und Zeit pro SQL-Statement unter /metrics
+metrics.init_app(app)
 
 serializer = URLSafeSerializer(app.secret_key, salt="user")
 
-# In-Memory Signaling-Rooms (MVP)
-signal_rooms = {}
+# Signaling-Backend: memory (ein Prozess) oder postgres (LISTEN/NOTIFY, mehrere Worker)
+signaling = create_backend()
+
+# Offene Chat-WebSockets dieses Prozesses: connection_id -> {ws: ChatPeer}.
+# Zugestellt wird über das Signaling-Backend, mit SIGNAL_BACKEND=postgres
+# also auch an Sockets anderer Worker.
+chat_rooms = {}
+chat_rooms_lock = threading.Lock()
+
+# Warteschlange als FIFO-Buckets (lang, style, mood), persistiert in match_queue
+match_engine = MatchEngine()
+
+# Schließt verwaiste Sessions / alte Queue-Einträge (REAPER_INTERVAL=0 schaltet ab)
+reaper = Reaper(match_engine)
+
+# Batch-Pairing der ganzen Queue alle paar hundert Millisekunden
+match_ticker = MatchTicker(match_engine)
+# Tick-Matches aller Prozesse (NOTIFY) an die eigene Engine, weckt wartende Sockets
+match_listener = MatchListener(match_engine)
+
+# read_at / last_activity aus Chat-Ansicht und Polling: gesammelt, im Batch geschrieben
+write_behind = WriteBehind()
+
+def start_background():
+    """Start the reaper, match tick, listener and write-behind threads of a serving process.
+
+    Importing ``app`` starts nothing, so tests, benchmarks and the reloader
+    parent stay thread-free; ``__main__`` and ``async_server`` call this.
+    """
+    reaper.start()
+    match_ticker.start()
+    match_listener.start()
+    cache_listener.start()
+    write_behind.start()
+
+def load_user_profile(user_id):
+    with get_cursor() as cur:
+        cur.execute("""
+            SELECT id, nickname, bio, profile_completed, display_name, xp, level
+            FROM app_user WHERE id = %s
+        """, (user_id,))
+        return cur.fetchone()
+
+# Profil-Cache für inject_user, index() und profile(); invalidiert bei Schreibzugriffen
+user_cache = TTLCache(load_user_profile,
+                      maxsize=int(os.getenv("USER_CACHE_SIZE", "10000")),
+                      ttl=float(os.getenv("USER_CACHE_TTL", "60")))
+# Invalidierungen anderer Prozesse (NOTIFY), sonst sähen sie Änderungen erst nach der TTL
+cache_listener = InvalidationListener({"user": user_cache})
+
+def get_user_profile(user_id):
+    """Cached app_user row, loaded at most once per request."""
+    profiles = g.setdefault("user_profiles", {})
+    if user_id not in profiles:
+        profiles[user_id] = user_cache.get(user_id)
+    return profiles[user_id]
+
+def invalidate_user_profile(*user_ids):
+    user_ids = [str(user_id) for user_id in user_ids]
+    user_cache.invalidate(*user_ids)
+    if user_ids:
+        with get_cursor(commit=True) as cur:
+            publish_invalidation(cur, "user", *user_ids)
+    profiles = g.get("user_profiles")
+    if profiles:
+        for user_id in user_ids:
+            profiles.pop(user_id, None)
+
+metrics.add_collector("db_pool", pool_stats)
+metrics.add_collector("user_cache", user_cache.stats)
+metrics.add_collector("card_catalog", card_catalog.stats)
+metrics.add_collector("reaper", reaper.stats)
+metrics.add_collector("match_tick", match_ticker.stats)
+metrics.add_collector("events", events.stats)
+metrics.add_collector("write_behind", write_behind.stats)
+metrics.add_collector("match_engine", match_engine.stats)
 
 @app.context_processor
 def inject_user():
     """Inject current user data into all templates"""
     user_id = session.get("uid")
     if user_id:
-        with get_cursor() as cur:
-            cur.execute("SELECT xp, level FROM app_user WHERE id = %s", (user_id,))
-            user_data = cur.fetchone()
-            if user_data:
-                return {"current_user": user_data}
+        user_data = get_user_profile(user_id)
+        if user_data:
+            return {"current_user": user_data}
     return {"current_user": {"xp": 0, "level": 1}}
 
+# Offene Session eines Users (abgebrochene schließt der Reaper)
+# Offene Session mit frischem Heartbeat; verlassene Sessions zählen nach
+# SESSION_ACTIVE_WINDOW nicht mehr, auch wenn der Reaper sie noch nicht beendet hat
+SESSION_HEARTBEAT = 60          # Sekunden zwischen Heartbeats der Session-Seite
+SESSION_ACTIVE_WINDOW = int(os.getenv("SESSION_ACTIVE_WINDOW", "300"))
+ACTIVE_SESSION_SQL = """
+    SELECT cs.id, cs.ice_room_key
+    FROM conversation_session cs
+    JOIN session_participant sp ON cs.id = sp.session_id
+    WHERE sp.user_id = %s AND cs.ended_at IS NULL
+    AND cs.last_activity > now() - %s * interval '1 second'
+    ORDER BY cs.created_at DESC
+    LIMIT 1
+"""
+
 @app.route("/")
 def index():
     user_id = session.get("uid")
@@ -41,30 +144,21 @@ def index():
             row = cur.fetchone()
             session["uid"] = str(row["id"])
         user_id = session["uid"]
-        print(f"👤 New user created: {user_id[:8]}")
+        events.log("user_created", user_id=user_id)
     
-    # Check if user has a recent active session (within last 5 minutes)
+    # Check if user has an open session
     with get_cursor() as cur:
-        cur.execute("""
-            SELECT cs.id, cs.ice_room_key 
-            FROM conversation_session cs
-            JOIN session_participant sp ON cs.id = sp.session_id
-            WHERE sp.user_id = %s AND cs.status != 'ended'
-            AND cs.created_at > now() - interval '5 minutes'
-            ORDER BY cs.created_at DESC
-            LIMIT 1
-        """, (user_id,))
+        cur.execute(ACTIVE_SESSION_SQL, (user_id, SESSION_ACTIVE_WINDOW))
         active_session = cur.fetchone()
         
         # Check if user is in queue
         cur.execute("SELECT user_id FROM match_queue WHERE user_id = %s", (user_id,))
         in_queue = cur.fetchone()
         
-        # Check profile completion and get user data
-        cur.execute("SELECT profile_completed, xp, level FROM app_user WHERE id = %s", (user_id,))
-        profile_result = cur.fetchone()
-        profile_completed = profile_result['profile_completed'] if profile_result else False
-        current_user = profile_result if profile_result else {'xp': 0, 'level': 1, 'profile_completed': False}
+    # Check profile completion and get user data
+    profile_result = get_user_profile(user_id)
+    profile_completed = profile_result['profile_completed'] if profile_result else False
+    current_user = profile_result if profile_result else {'xp': 0, 'level': 1, 'profile_completed': False}
     
     return render_template("index.html", 
                          active_session=active_session, 
@@ -83,22 +177,10 @@ def enqueue():
     style = request.form.get("style", "deep")
     lang = request.form.get("lang", "de")
     
-    with get_cursor(commit=True) as cur:
-        cur.execute("""
-            INSERT INTO match_queue(user_id, mood, style, lang)
-            VALUES (%s, %s, %s, %s)
-            ON CONFLICT (user_id) DO UPDATE SET 
-                mood=EXCLUDED.mood, 
-                style=EXCLUDED.style, 
-                lang=EXCLUDED.lang, 
-                enqueued_at=now()
-        """, (user_id, mood, style, lang))
-        
-        # Check how many are waiting
-        cur.execute("SELECT COUNT(*) as count FROM match_queue")
-        total_waiting = cur.fetchone()['count']
-        
-    print(f"📝 User {user_id[:8]} joined queue. Total waiting: {total_waiting}")
+    assigned = match_engine.enqueue(user_id, mood, style, lang)
+    if not assigned:
+        events.log("queue_joined", user_id=user_id, mood=mood, style=style, lang=lang,
+                   waiting=match_engine.total_waiting())
     return redirect(url_for("match"))
 
 @app.get("/match")
@@ -107,78 +189,70 @@ def match():
     if not user_id:
         return redirect(url_for("index"))
     
-    with get_cursor(commit=True) as cur:
-        # First, check if user already has a RECENT active session (within last 5 minutes)
-        cur.execute("""
-            SELECT cs.id, cs.ice_room_key 
-            FROM conversation_session cs
-            JOIN session_participant sp ON cs.id = sp.session_id
-            WHERE sp.user_id = %s AND cs.status != 'ended'
-            AND cs.created_at > now() - interval '5 minutes'
-            ORDER BY cs.created_at DESC
-            LIMIT 1
-        """, (user_id,))
-        existing_session = cur.fetchone()
-        
+    match_engine.ensure_restored()
+
+    # Paarung passiert beim Enqueue, hier nur die Zuweisung lesen
+    assigned = match_engine.assignment(user_id)
+    if assigned:
+        return redirect(url_for("session_view", sid=assigned["id"]))
+
+    # Atomarer Claim direkt auf match_queue (Wartende anderer Worker-Prozesse)
+    queued, assigned = match_engine.claim(user_id)
+    if assigned:
+        return redirect(url_for("session_view", sid=assigned["id"]))
+
+    if not queued:
+        # Von einem anderen Prozess gematcht? Sonst zurück zur Startseite
+        with get_cursor() as cur:
+            cur.execute(ACTIVE_SESSION_SQL, (user_id, SESSION_ACTIVE_WINDOW))
+            existing_session = cur.fetchone()
         if existing_session:
-            print(f"🔄 User {user_id[:8]} rejoining recent session {existing_session['id']}")
-            return redirect(url_for("session_view", sid=existing_session['id']))
-        
-        # Check if current user is in queue
-        cur.execute("SELECT user_id FROM match_queue WHERE user_id = %s", (user_id,))
-        current_user_in_queue = cur.fetchone()
-        
-        if not current_user_in_queue:
-            # User is not in queue and has no active session, redirect to homepage
-            return redirect(url_for("index"))
-        
-        # Look for another user in queue (not ourselves)
-        cur.execute("""
-            SELECT user_id FROM match_queue
-            WHERE user_id <> %s
-            ORDER BY enqueued_at ASC
-            LIMIT 1
-        """, (user_id,))
-        cand = cur.fetchone()
-        
-        if not cand:
-            # No other user waiting, show waiting screen
-            cur.execute("SELECT COUNT(*) as total FROM match_queue")
-            total_waiting = cur.fetchone()['total']
-            return render_template("match.html", waiting=True, queue_position=1, total_waiting=total_waiting)
-        
-        other_id = cand["user_id"]
-        
-        # Create session
-        room_key = uuid.uuid4().hex
-        cur.execute("""
-            INSERT INTO conversation_session (status, lang, style, ice_room_key, started_at)
-            VALUES ('initiated', 'de', 'deep', %s, now())
-            RETURNING id
-        """, (room_key,))
-        srow = cur.fetchone()
-        sid = srow["id"]
-        
-        # Add participants
-        cur.execute("INSERT INTO session_participant (session_id, user_id, joined_at) VALUES (%s, %s, now())", (sid, user_id))
-        cur.execute("INSERT INTO session_participant (session_id, user_id, joined_at) VALUES (%s, %s, now())", (sid, other_id))
-        
-        # Remove both users from queue
-        cur.execute("DELETE FROM match_queue WHERE user_id IN (%s,%s)", (user_id, other_id))
-        
-        print(f"🎯 Match created! Users {user_id[:8]} and {other_id[:8]} -> Session {sid}")
-    
-    return redirect(url_for("session_view", sid=sid))
+            return redirect(url_for("session_view", sid=existing_session["id"]))
+        return redirect(url_for("index"))
+
+    return render_template("match.html", waiting=True, **queue_status(user_id))
+
+def queue_status(user_id):
+    """Position im eigenen Bucket und Wartende; O(log n) aus der MatchEngine."""
+    # Wartet der User nur in match_queue eines anderen Workers, kennt ihn dieser Prozess nicht
+    position, bucket_waiting = match_engine.queue_position(user_id) or (1, 1)
+    return {"queue_position": position, "bucket_waiting": bucket_waiting,
+            "total_waiting": max(match_engine.total_waiting(), bucket_waiting)}
+
+# Deck wurde beim Match gespeichert, Karten kommen aus dem Cache
+SESSION_DECK_SQL = """
+    SELECT cs.ice_room_key,
+           ARRAY(SELECT card_id FROM session_card_usage
+                 WHERE session_id = cs.id ORDER BY position) AS deck
+    FROM conversation_session cs
+    WHERE cs.id = %s
+"""
 
 @app.get("/session/<uuid:sid>")
 def session_view(sid):
-    # Conversation Cards fürs UI ziehen
     with get_cursor() as cur:
-        cur.execute("SELECT id, topic, depth, prompt FROM conversation_card ORDER BY depth DESC, id ASC LIMIT 10")
-        cards = cur.fetchall()
-        cur.execute("SELECT ice_room_key FROM conversation_session WHERE id=%s", (str(sid),))
+        cur.execute(SESSION_DECK_SQL, (str(sid),))
         row = cur.fetchone()
-    return render_template("session.html", sid=str(sid), room_key=row["ice_room_key"], cards=cards, stun=os.getenv("STUN_URL","stun:stun.l.google.com:19302"))
+    cards = card_catalog.get_many(row["deck"]) if row["deck"] else card_catalog.default_deck()
+    return render_template("session.html", sid=str(sid), room_key=row["ice_room_key"], cards=cards, stun=os.getenv("STUN_URL","stun:stun.l.google.com:19302"),
+                           heartbeat=SESSION_HEARTBEAT)
+
+@app.post("/session/<uuid:sid>/heartbeat")
+def session_heartbeat(sid):
+    """Keep an open session alive for the reaper and the active-session redirect."""
+    user_id = session.get("uid")
+    if not user_id:
+        return {"error": "Not authenticated"}, 401
+    with get_cursor(commit=True) as cur:
+        # Höchstens ein Schreibzugriff pro halbem Intervall, auch bei mehreren Tabs
+        cur.execute("""
+            UPDATE conversation_session SET last_activity = now()
+            WHERE id = %(sid)s AND ended_at IS NULL
+            AND last_activity < now() - %(min_gap)s * interval '1 second'
+            AND EXISTS (SELECT 1 FROM session_participant
+                        WHERE session_id = %(sid)s AND user_id = %(user_id)s)
+        """, {"sid": str(sid), "user_id": user_id, "min_gap": SESSION_HEARTBEAT // 2})
+    return {"ok": True}
 
 @app.post("/session/<uuid:sid>/end")
 def end_session(sid):
@@ -195,42 +269,21 @@ def end_session(sid):
         if not cur.fetchone():
             return {"error": "Access denied"}, 403
 
-        # Get session start time
-        cur.execute("SELECT started_at, ended_at FROM conversation_session WHERE id = %s", (str(sid),))
-        session_row = cur.fetchone()
-        started_at = session_row["started_at"]
-        ended_at = session_row["ended_at"]
-
         # End the session if not already ended
-        if not ended_at:
-            cur.execute("""
-                UPDATE conversation_session 
-                SET status = 'aborted', ended_at = now()
-                WHERE id = %s
-            """, (str(sid),))
-            cur.execute("SELECT ended_at FROM conversation_session WHERE id = %s", (str(sid),))
-            ended_at = cur.fetchone()["ended_at"]
-
-        # XP-Berechnung: 1 XP pro Minute (mind. 1 XP)
-        if started_at and ended_at:
-            duration_min = max(1, int((ended_at - started_at).total_seconds() // 60))
-        else:
-            duration_min = 1
-
-        # Hole aktuellen XP/Level
-        cur.execute("SELECT xp, level FROM app_user WHERE id = %s", (user_id,))
-        user_row = cur.fetchone()
-        xp = user_row["xp"] or 0
-        level = user_row["level"] or 1
-
-        new_xp = xp + duration_min
-        # Level-Up alle 30 XP
-        new_level = level + (new_xp // 30 - xp // 30)
+        cur.execute("""
+            UPDATE conversation_session 
+            SET status = 'aborted', ended_at = now()
+            WHERE id = %s AND ended_at IS NULL
+        """, (str(sid),))
 
-        cur.execute("UPDATE app_user SET xp = %s, level = %s WHERE id = %s", (new_xp, new_level, user_id))
+        # XP-Berechnung: 1 XP pro Minute (mind. 1 XP), Level-Up alle 30 XP
+        award = xp.award_session_xp(cur, sid, [user_id])[user_id]
 
-        print(f"🔚 Session {str(sid)[:8]} ended by user {user_id[:8]}, +{duration_min} XP, Level {new_level}")
-    return {"success": True, "xp_gained": duration_min, "level": new_level}
+        events.log("session_ended", session_id=str(sid), user_id=user_id,
+                   xp_gained=award["xp_gained"], level=award["level"])
+    invalidate_user_profile(user_id)
+    match_engine.release_session(sid)
+    return {"success": True, "xp_gained": award["xp_gained"], "level": award["level"]}
 
 @app.get("/session/<uuid:sid>/messages")
 def get_chat_messages_ajax(sid):
@@ -273,12 +326,7 @@ def profile():
     if not user_id:
         return redirect(url_for("index"))
     
-    with get_cursor() as cur:
-        cur.execute("""
-            SELECT id, nickname, bio, profile_completed, display_name
-            FROM app_user WHERE id = %s
-        """, (user_id,))
-        user = cur.fetchone()
+    user = get_user_profile(user_id)
     
     return render_template("profile.html", user=user)
 
@@ -300,9 +348,28 @@ def update_profile():
             SET nickname = %s, bio = %s, profile_completed = TRUE
             WHERE id = %s
         """, (nickname, bio, user_id))
+    invalidate_user_profile(user_id)
     
     return redirect(url_for("profile"))
 
+CONNECTIONS_SQL = """
+    SELECT 
+        cs.connection_id,
+        cs.connected_at,
+        cs.last_activity,
+        other_user.nickname,
+        other_user.bio,
+        cs.other_user_id,
+        cs.last_message,
+        cs.last_message_at,
+        cs.last_sender_id = cs.user_id as last_message_from_me,
+        cs.unread_count
+    FROM conversation_summary cs
+    JOIN app_user other_user ON other_user.id = cs.other_user_id
+    WHERE cs.user_id = %s
+    ORDER BY cs.last_activity DESC
+"""
+
 @app.get("/connections")
 def connections():
     user_id = session.get("uid")
@@ -311,44 +378,8 @@ def connections():
     
     with get_cursor() as cur:
         # Get all connections for this user with latest message info
-        cur.execute("""
-            SELECT 
-                uc.id as connection_id,
-                uc.connected_at,
-                uc.session_id,
-                uc.last_activity,
-                uc.chat_active,
-                other_user.nickname,
-                other_user.bio,
-                other_user.id as other_user_id,
-                latest_msg.message as last_message,
-                latest_msg.sent_at as last_message_at,
-                latest_msg.sender_id = %s as last_message_from_me,
-                unread_count.count as unread_count
-            FROM user_connection uc
-            JOIN app_user other_user ON (
-                CASE 
-                    WHEN uc.user1_id = %s THEN uc.user2_id = other_user.id
-                    ELSE uc.user1_id = other_user.id
-                END
-            )
-            LEFT JOIN LATERAL (
-                SELECT message, sent_at, sender_id 
-                FROM chat_message 
-                WHERE connection_id = uc.id 
-                ORDER BY sent_at DESC 
-                LIMIT 1
-            ) latest_msg ON true
-            LEFT JOIN LATERAL (
-                SELECT COUNT(*) as count
-                FROM chat_message 
-                WHERE connection_id = uc.id 
-                AND sender_id != %s 
-                AND read_at IS NULL
-            ) unread_count ON true
-            WHERE uc.user1_id = %s OR uc.user2_id = %s
-            ORDER BY COALESCE(uc.last_activity, uc.connected_at) DESC
-        """, (user_id, user_id, user_id, user_id, user_id))
+        # (conversation_summary wird bei Senden/Lesen mitgepflegt)
+        cur.execute(CONNECTIONS_SQL, (user_id,))
         connections_list = cur.fetchall()
     
     return render_template("connections.html", connections=connections_list)
@@ -359,7 +390,7 @@ def chat_view(connection_id):
     if not user_id:
         return redirect(url_for("index"))
     
-    with get_cursor(commit=True) as cur:
+    with get_cursor() as cur:
         # Verify user is part of this connection
         cur.execute("""
             SELECT 
@@ -381,50 +412,99 @@ def chat_view(connection_id):
         if not connection:
             return redirect(url_for("connections"))
         
-        # Get chat messages
-        cur.execute("""
-            SELECT 
-                cm.id,
-                cm.message,
-                cm.sent_at,
-                cm.sender_id,
-                sender.nickname as sender_nickname,
-                cm.sender_id = %s as is_me
-            FROM chat_message cm
-            JOIN app_user sender ON cm.sender_id = sender.id
-            WHERE cm.connection_id = %s
-            ORDER BY cm.sent_at ASC
-        """, (user_id, connection_id))
-        messages = cur.fetchall()
-        
-        # Mark messages as read
-        cur.execute("""
-            UPDATE chat_message 
-            SET read_at = now() 
-            WHERE connection_id = %s 
-            AND sender_id != %s 
-            AND read_at IS NULL
-        """, (connection_id, user_id))
+        # Nur die neueste Seite, ältere lädt /chat/<id>/history nach
+        messages, has_more = chat.load_page(cur, connection_id, user_id)
         
-        # Update last activity
-        cur.execute("""
-            UPDATE user_connection 
-            SET last_activity = now() 
-            WHERE id = %s
-        """, (connection_id,))
+    # Gelesen-Markierung und last_activity schreibt write_behind gesammelt nach
+    if has_more or any(not msg['is_me'] for msg in messages):
+        write_behind.mark_read(connection_id, user_id, max(msg['id'] for msg in messages))
+    write_behind.touch(connection_id)
     
     return render_template("chat.html", 
                          connection=connection, 
                          messages=messages,
+                         has_more=has_more,
                          connection_id=connection_id)
 
+@app.get("/chat/<int:connection_id>/history")
+def get_chat_history(connection_id):
+    """Older messages before ``before_id``, one page per call."""
+    user_id = session.get("uid")
+    if not user_id:
+        return {"error": "Not authenticated"}, 401
+    
+    before_id = request.args.get("before_id", type=int)
+    page_size = min(request.args.get("limit", chat.CHAT_PAGE_SIZE, type=int), chat.CHAT_PAGE_SIZE * 4)
+    
+    with get_cursor() as cur:
+        cur.execute(chat.MEMBERSHIP_SQL, (connection_id, user_id, user_id))
+        if not cur.fetchone():
+            return {"error": "Access denied"}, 403
+        messages, has_more = chat.load_page(cur, connection_id, user_id, before_id, max(page_size, 1))
+    
+    return {
+        "html": render_template("chat_messages.html", messages=messages) if messages else "",
+        "count": len(messages),
+        "oldest_id": messages[0]["id"] if messages else before_id,
+        "has_more": has_more,
+    }
+
+# Neue Nachrichten ab einem Cursor (Range-Scan auf idx_chat_message_connection).
+# ids und sent_at (Transaktionsbeginn) werden vergeben, bevor committet ist; eine
+# Nachricht kann also sichtbar werden, nachdem spätere schon ausgeliefert wurden.
+# Gelesen wird deshalb ab sent_at des Cursors minus CHAT_POLL_OVERLAP; was der
+# Client schon anzeigt (have: seine letzten ids), fällt heraus, ein Poll ohne
+# Neues bleibt leer. Ohne have: nur nach dem Cursor in (sent_at, id) oder id > Cursor.
+CHAT_POLL_OVERLAP = int(os.getenv("CHAT_POLL_OVERLAP", "10"))   # Sekunden
+CHAT_POLL_HAVE_MAX = 100        # ids in have, mehr wird abgeschnitten
+CHAT_MESSAGES_SINCE_SQL = """
+    WITH cursor AS MATERIALIZED (
+        SELECT sent_at FROM chat_message WHERE id = %(after_id)s
+    )
+    SELECT 
+        cm.id,
+        cm.message,
+        cm.sent_at,
+        cm.sender_id,
+        sender.nickname as sender_nickname,
+        cm.sender_id = %(user_id)s as is_me,
+        ((cm.sent_at, cm.id) > ((SELECT sent_at FROM cursor), %(after_id)s)) IS NOT FALSE AS advances
+    FROM chat_message cm
+    JOIN app_user sender ON cm.sender_id = sender.id
+    WHERE cm.connection_id = %(connection_id)s
+    AND cm.sent_at >= COALESCE(
+        (SELECT sent_at FROM cursor) - %(overlap)s * interval '1 second',
+        %(since)s::timestamptz,
+        '-infinity'
+    )
+    AND cm.id <> ALL(%(have)s::bigint[])
+    AND (%(have_given)s
+         OR ((cm.sent_at, cm.id) > ((SELECT sent_at FROM cursor), %(after_id)s)) IS NOT FALSE
+         OR cm.id > %(after_id)s)
+    ORDER BY cm.sent_at ASC, cm.id ASC
+"""
+
 @app.get("/chat/<int:connection_id>/messages")
 def get_chat_messages(connection_id):
     user_id = session.get("uid")
     if not user_id:
         return {"error": "Not authenticated"}, 401
     
-    with get_cursor(commit=True) as cur:
+    # Cursor: zuletzt angezeigte Nachricht (after_id) bzw. Zeitpunkt (since)
+    after_id = request.args.get("after_id", 0, type=int)
+    since = request.args.get("since")
+    if since is not None:
+        try:
+            since = datetime.fromisoformat(since)
+        except ValueError:
+            return {"error": "since must be an ISO 8601 timestamp"}, 400
+    have = request.args.get("have")
+    try:
+        have_ids = [int(i) for i in have.split(",") if i][-CHAT_POLL_HAVE_MAX:] if have else []
+    except ValueError:
+        return {"error": "have must be a comma separated list of message ids"}, 400
+    
+    with get_cursor() as cur:
         # Verify user is part of this connection
         cur.execute("""
             SELECT id FROM user_connection 
@@ -434,60 +514,134 @@ def get_chat_messages(connection_id):
         if not cur.fetchone():
             return {"error": "Access denied"}, 403
         
-        # Get latest messages
-        cur.execute("""
-            SELECT 
-                cm.id,
-                cm.message,
-                cm.sent_at,
-                cm.sender_id,
-                sender.nickname as sender_nickname,
-                cm.sender_id = %s as is_me
-            FROM chat_message cm
-            JOIN app_user sender ON cm.sender_id = sender.id
-            WHERE cm.connection_id = %s
-            ORDER BY cm.sent_at ASC
-        """, (user_id, connection_id))
+        # Get new messages
+        cur.execute(CHAT_MESSAGES_SINCE_SQL, {"user_id": user_id, "connection_id": connection_id,
+                                              "after_id": after_id, "since": since,
+                                              "overlap": CHAT_POLL_OVERLAP,
+                                              "have": have_ids + [after_id], "have_given": have is not None})
         messages = cur.fetchall()
         
-        # Mark messages as read
-        cur.execute("""
-            UPDATE chat_message 
-            SET read_at = now() 
-            WHERE connection_id = %s 
-            AND sender_id != %s 
-            AND read_at IS NULL
-        """, (connection_id, user_id))
+        if not messages:
+            # Nichts Neues: keine Schreibzugriffe, kein HTML
+            return {"messages": [], "html": "", "last_id": after_id}
         
-        # Generate HTML for messages
-        messages_html = ""
-        for msg in messages:
-            align = "text-align: right;" if msg['is_me'] else ""
-            bg_color = "var(--acc)" if msg['is_me'] else "#2a2f3d"
-            text_color = "#0b1220" if msg['is_me'] else "var(--txt)"
-            radius = "border-bottom-right-radius: 4px;" if msg['is_me'] else "border-bottom-left-radius: 4px;"
-            
-            messages_html += f"""
-            <div style="margin-bottom: 1rem; {align}">
-                <div style="display: inline-block; max-width: 70%; padding: 0.5rem 1rem; border-radius: 12px; 
-                           background: {bg_color}; color: {text_color}; {radius}">
-                    <p style="margin: 0;">{msg['message']}</p>
-                    <small style="opacity: 0.8; font-size: 0.8rem;">
-                        {msg['sent_at'].strftime('%H:%M')}
-                    </small>
-                </div>
-            </div>
-            """
+    # Mark messages as read (gesammelt über write_behind)
+    if any(not msg['is_me'] for msg in messages):
+        write_behind.mark_read(connection_id, user_id, max(msg['id'] for msg in messages))
+    
+    messages_html = render_template("chat_messages.html", messages=messages)
+    # Cursor ist die letzte Nachricht in (sent_at, id)-Reihenfolge, nicht die größte id;
+    # nachgereichte ältere Nachrichten setzen ihn nicht zurück
+    advancing = [msg['id'] for msg in messages if msg['advances']]
+    return {"messages": [{k: v for k, v in msg.items() if k != 'advances'} for msg in messages],
+            "html": messages_html, "last_id": advancing[-1] if advancing else after_id}
+
+@app.post("/chat/<int:connection_id>/messages")
+def send_messages(connection_id):
+    """Store an ordered batch of messages, e.g. an offline backlog.
+
+    Body: ``{"messages": [{"client_key": "...", "message": "..."}, ...]}``.
+    A ``client_key`` that was already stored is not inserted again, so a
+    client can resend the whole batch after a network error.
+    """
+    user_id = session.get("uid")
+    if not user_id:
+        return {"error": "Not authenticated"}, 401
+    
+    data = request.get_json(silent=True) or {}
+    items = data.get("messages")
+    if not isinstance(items, list) or not items:
+        return {"error": "messages must be a non-empty list"}, 400
+    if len(items) > chat.CHAT_BATCH_MAX:
+        return {"error": f"at most {chat.CHAT_BATCH_MAX} messages per batch"}, 400
+    
+    batch = []
+    for item in items:
+        if not isinstance(item, dict):
+            return {"error": "each message must be an object"}, 400
+        client_key = str(item.get("client_key") or "").strip()
+        message = str(item.get("message") or "").strip()
+        if not client_key or len(client_key) > chat.CLIENT_KEY_MAX_LENGTH:
+            return {"error": f"client_key must be 1-{chat.CLIENT_KEY_MAX_LENGTH} characters"}, 400
+        if not message:
+            return {"error": "message must not be empty"}, 400
+        batch.append((client_key, message[:chat.MESSAGE_MAX_LENGTH]))
+    
+    with get_cursor(commit=True) as cur:
+        # Mitgliedschaft einmal pro Batch prüfen
+        cur.execute(chat.MEMBERSHIP_SQL, (connection_id, user_id, user_id))
+        if not cur.fetchone():
+            return {"error": "Access denied"}, 403
         
-        if not messages:
-            messages_html = """
-            <div style="text-align: center; color: var(--muted); margin-top: 2rem;">
-                <p>🎉 Ihr seid jetzt verbunden!</p>
-                <p>Startet euer Gespräch mit einer Nachricht...</p>
-            </div>
-            """
+        rows = chat.store_messages(cur, connection_id, user_id, batch,
+                                   read=recipient_online(connection_id, user_id))
+    
+    created = [row for row in rows if row["created"]]
+    broadcast_chat_message(connection_id, *created)
     
-    return {"messages": [dict(msg) for msg in messages], "html": messages_html}
+    return {
+        "messages": [{"client_key": row["client_key"], "id": row["id"], "created": row["created"]}
+                     for row in rows],
+        "created": len(created),
+        "duplicates": len(rows) - len(created),
+    }
+
+class ChatPeer:
+    """Signaling room member for one chat socket; renders messages for its user."""
+
+    def __init__(self, ws, user_id):
+        self.ws = ws
+        self.user_id = user_id
+
+    def send(self, data):
+        messages = [dict(msg, sent_at=datetime.fromisoformat(msg["sent_at"]),
+                         is_me=msg["sender_id"] == self.user_id)
+                    for msg in json.loads(data)["messages"]]
+        template = app.jinja_env.get_template("chat_messages.html")
+        self.ws.send(json.dumps({"type": "message", "id": messages[-1]["id"],
+                                 "html": template.render(messages=messages)}))
+
+def chat_signal_room(connection_id):
+    return f"chat:{connection_id}"
+
+def chat_payload(*msgs):
+    """Signaling payload for committed messages (rendered per receiving peer)."""
+    return json.dumps({"messages": [{"id": msg["id"], "message": msg["message"],
+                                     "sent_at": msg["sent_at"].isoformat(),
+                                     "sender_id": str(msg["sender_id"])} for msg in msgs]})
+
+def chat_peers(connection_id):
+    with chat_rooms_lock:
+        return dict(chat_rooms.get(connection_id, {}))
+
+def join_chat_room(connection_id, ws, user_id):
+    peer = ChatPeer(ws, user_id)
+    with chat_rooms_lock:
+        chat_rooms.setdefault(connection_id, {})[ws] = peer
+    signaling.join(chat_signal_room(connection_id), peer)
+
+def leave_chat_room(connection_id, ws):
+    with chat_rooms_lock:
+        room = chat_rooms.get(connection_id, {})
+        peer = room.pop(ws, None)
+        if not room:
+            chat_rooms.pop(connection_id, None)
+    if peer is not None:
+        signaling.leave(chat_signal_room(connection_id), peer)
+
+def recipient_online(connection_id, user_id):
+    # Empfänger hat den Chat in diesem Prozess offen -> Nachricht gilt sofort als gelesen
+    return any(peer.user_id != user_id for peer in chat_peers(connection_id).values())
+
+def store_chat_message(cur, connection_id, user_id, message):
+    """Insert a chat message and touch the connection's last_activity."""
+    return chat.store_message(cur, connection_id, user_id, message,
+                              read=recipient_online(connection_id, user_id))
+
+def broadcast_chat_message(connection_id, *msgs):
+    """Push committed messages to all open chat sockets of the connection, in every worker."""
+    if msgs:
+        signaling.publish(chat_signal_room(connection_id), None, chat_payload(*msgs))
 
 @app.post("/chat/<int:connection_id>/send")
 def send_message(connection_id):
@@ -509,18 +663,8 @@ def send_message(connection_id):
         if not cur.fetchone():
             return redirect(url_for("connections"))
         
-        # Insert message
-        cur.execute("""
-            INSERT INTO chat_message (connection_id, sender_id, message)
-            VALUES (%s, %s, %s)
-        """, (connection_id, user_id, message))
-        
-        # Update last activity
-        cur.execute("""
-            UPDATE user_connection 
-            SET last_activity = now() 
-            WHERE id = %s
-        """, (connection_id,))
+        msg = store_chat_message(cur, connection_id, user_id, message)
+    broadcast_chat_message(connection_id, msg)
     
     return redirect(url_for("chat_view", connection_id=connection_id))
 
@@ -528,6 +672,7 @@ def send_message(connection_id):
 def reveal(sid):
     user_id = session.get("uid")
     vote = request.form.get("vote","no")
+    awarded = []
     
     with get_cursor(commit=True) as cur:
         # Record the vote
@@ -572,8 +717,7 @@ def reveal(sid):
                     
                     connection_result = cur.fetchone()
                     connection_id = connection_result['id']
-                    
-                    print(f"💫 Connection created! Users {user1_id[:8]} ↔ {user2_id[:8]} → Chat {connection_id}")
+                    conversation_summary.create(cur, connection_id)
                     
                     # Mark session as ended
                     cur.execute("""
@@ -582,34 +726,24 @@ def reveal(sid):
                         WHERE id = %s
                     """, (str(sid),))
 
-                    # XP/Level für beide User berechnen (wie in end_session)
-                    cur.execute("SELECT started_at, ended_at FROM conversation_session WHERE id = %s", (str(sid),))
-                    session_row = cur.fetchone()
-                    started_at = session_row["started_at"]
-                    ended_at = session_row["ended_at"]
-                    if started_at and ended_at:
-                        duration_min = max(1, int((ended_at - started_at).total_seconds() // 60))
-                    else:
-                        duration_min = 1
-                    for participant_id in participants:
-                        cur.execute("SELECT xp, level FROM app_user WHERE id = %s", (participant_id,))
-                        user_row = cur.fetchone()
-                        xp = user_row["xp"] or 0
-                        level = user_row["level"] or 1
-                        new_xp = xp + duration_min
-                        new_level = level + (new_xp // 30 - xp // 30)
-                        cur.execute("UPDATE app_user SET xp = %s, level = %s WHERE id = %s", (new_xp, new_level, participant_id))
-                        print(f"⭐ User {participant_id[:8]}: +{duration_min} XP, Level {new_level}")
+                    # XP/Level für beide User in einem Statement (wie in end_session)
+                    awards = xp.award_session_xp(cur, sid, participants)
+                    awarded = participants
 
                     # Store connection info temporarily in a global dict (simple solution)
                     if not hasattr(app, 'pending_connections'):
                         app.pending_connections = {}
                     for participant_id in participants:
                         app.pending_connections[participant_id] = connection_id
-                    print(f"🔄 Stored connection {connection_id} for users {participants}")
+                    events.log("connection_created", session_id=str(sid), connection_id=connection_id,
+                               user_ids=participants,
+                               awards=[dict(award, user_id=uid) for uid, award in awards.items()])
                     
                 except Exception as e:
-                    print(f"Error creating connection: {e}")
+                    events.log("connection_failed", level=logging.ERROR, session_id=str(sid),
+                               user_ids=participants, error=str(e))
+    invalidate_user_profile(*awarded)
+    match_engine.release_session(sid)
     
     # Redirect based on vote result
     if vote == "yes" and yescnt == 2:
@@ -619,7 +753,6 @@ def reveal(sid):
             if connection_id:
                 # Clean up the pending connection
                 app.pending_connections.pop(user_id, None)
-                print(f"🚀 Redirecting user {user_id[:8]} to chat {connection_id}")
                 return redirect(url_for("chat_view", connection_id=connection_id))
         
         # Fallback to connections page
@@ -627,29 +760,82 @@ def reveal(sid):
     else:
         return redirect(url_for("index"))
 
+# --------- WebSocket Match-Benachrichtigung ---------
+MATCH_WS_RECHECK = 20  # Sekunden zwischen DB-Checks (Match durch anderen Worker)
+
+@sock.route("/ws/match")
+def match_updates(ws):
+    user_id = session.get("uid")
+    if not user_id:
+        ws.close()
+        return
+    match_engine.ensure_restored()
+    while ws.connected:
+        assigned = match_engine.wait_for_assignment(user_id, MATCH_WS_RECHECK)
+        if not assigned:
+            queued, assigned = match_engine.claim(user_id)
+            if not assigned and not queued:
+                # Nicht mehr in der Queue: /match entscheidet über Session oder Startseite
+                ws.send(json.dumps({"type": "left_queue", "url": url_for("match")}))
+                break
+            if not assigned:
+                # Warteposition aktualisieren, solange nichts passiert
+                ws.send(json.dumps({"type": "position", **queue_status(user_id)}))
+        if assigned:
+            ws.send(json.dumps({
+                "type": "matched",
+                "session_id": assigned["id"],
+                "room_key": assigned["ice_room_key"],
+                "url": url_for("session_view", sid=assigned["id"]),
+            }))
+            break
+    ws.close()
+
+# --------- WebSocket Chat ---------
+@sock.route("/ws/chat/<int:connection_id>")
+def chat_socket(ws, connection_id):
+    user_id = session.get("uid")
+    if not user_id:
+        ws.close()
+        return
+    
+    with get_cursor() as cur:
+        cur.execute(chat.MEMBERSHIP_SQL, (connection_id, user_id, user_id))
+        if not cur.fetchone():
+            ws.close()
+            return
+    
+    join_chat_room(connection_id, ws, user_id)
+    try:
+        while True:
+            data = ws.receive()
+            if data is None:
+                break
+            try:
+                message = str(json.loads(data).get("message", "")).strip()
+            except (ValueError, AttributeError):
+                continue
+            if not message:
+                continue
+            with get_cursor(commit=True) as cur:
+                msg = store_chat_message(cur, connection_id, user_id, message[:500])
+            broadcast_chat_message(connection_id, msg)
+    finally:
+        leave_chat_room(connection_id, ws)
+
 # --------- WebSocket Signaling (MVP) ---------
 @sock.route("/ws/signal/<room>")
 def signal(ws, room):
-    if room not in signal_rooms:
-        signal_rooms[room] = []
-    clients = signal_rooms[room]
-    clients.append(ws)
+    signaling.join(room, ws)
     try:
         while True:
             data = ws.receive()
             if data is None:
                 break
-            # an alle anderen im Raum weiterleiten
-            for c in clients:
-                if c is not ws:
-                    try:
-                        c.send(data)
-                    except Exception:
-                        pass
+            # an alle anderen im Raum weiterleiten (auch in anderen Prozessen)
+            signaling.publish(room, ws, data)
     finally:
-        clients.remove(ws)
-        if not clients:
-            del signal_rooms[room]
+        signaling.leave(room, ws)
 
 if __name__ == "__main__":
     # Check if SSL certificates exist
@@ -657,6 +843,10 @@ if __name__ == "__main__":
     cert_file = 'deeptalk.crt'
     key_file = 'deeptalk.key'
     
+    # Mit Reloader nur im Kind-Prozess, der tatsächlich bedient
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background()
+
     if os.path.exists(cert_file) and os.path.exists(key_file):
         print("🔒 Starting with HTTPS support")
         app.run(host='0.0.0.0', port=5000, debug=True, ssl_context=(cert_file, key_file))
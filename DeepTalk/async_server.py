@@ -0,0 +1,242 @@
+# async_server.py
+"""asyncio serving mode for the WebSocket endpoints.
+
+``/ws/match``, ``/ws/chat/<id>`` and ``/ws/signal/<room>`` run as coroutines
+on one event loop, so an idle socket costs a few KB instead of a thread.
+All other routes are the unchanged Flask app, served from a small thread
+pool. Chat writes and signaling NOTIFYs use a psycopg 3 async pool.
+
+    uvicorn async_server:asgi_app --host 0.0.0.0 --port 5000
+
+Sockets are registered in the same chat rooms / signaling backend as the
+threaded routes (via ``LoopSocket``), so messages sent through the HTTP
+fallback still reach async sockets.
+"""
+
+import os
+import json
+import asyncio
+import contextlib
+
+from a2wsgi import WSGIMiddleware
+from itsdangerous import BadSignature
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+from starlette.applications import Starlette
+from starlette.routing import Mount, WebSocketRoute
+from starlette.websockets import WebSocketDisconnect
+
+import chat
+from db import DATABASE_URL
+from app import (app as flask_app, match_engine, signaling, MATCH_WS_RECHECK,
+                 join_chat_room, leave_chat_room, recipient_online, broadcast_chat_message,
+                 queue_status, write_behind, start_background)
+from match_tick import MATCH_LISTEN
+
+ASYNC_DB_POOL_MIN = int(os.getenv("ASYNC_DB_POOL_MIN", "1"))
+ASYNC_DB_POOL_MAX = int(os.getenv("ASYNC_DB_POOL_MAX", "10"))
+WSGI_WORKERS = int(os.getenv("WSGI_WORKERS", "16"))
+# Matches wecken die Sockets über den MatchListener (Tick und Claims aller Worker);
+# Claim und Warteposition pro Socket nur noch selten, z.B. für eine beim Reconnect
+# verpasste NOTIFY. Ohne Listener bleibt es beim Intervall der Thread-Route.
+ASYNC_MATCH_RECHECK = float(os.getenv("ASYNC_MATCH_RECHECK", "120" if MATCH_LISTEN else str(MATCH_WS_RECHECK)))
+
+db_pool = None
+match_waiters = {}      # user_id -> set[asyncio.Future], nur im Loop-Thread benutzt
+
+
+class LoopSocket:
+    """Thread-safe ``send`` for a Starlette WebSocket.
+
+    Sync code (chat broadcast, signaling listener thread) calls ``send`` from
+    any thread; the text is queued on the loop and written by ``writer``.
+    """
+
+    def __init__(self, ws, loop):
+        self.ws = ws
+        self.loop = loop
+        self.queue = asyncio.Queue()
+
+    def send(self, data):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, data)
+
+    async def writer(self):
+        while True:
+            await self.ws.send_text(await self.queue.get())
+
+
+def session_user(ws):
+    """Read ``uid`` from the signed Flask session cookie."""
+    cookie = ws.cookies.get(flask_app.config["SESSION_COOKIE_NAME"])
+    if not cookie:
+        return None
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    try:
+        data = serializer.loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return None
+    return data.get("uid")
+
+
+def build_url(endpoint, **values):
+    return flask_app.url_map.bind("").build(endpoint, values)
+
+
+async def until_closed(ws):
+    """Drain incoming frames until the client disconnects."""
+    with contextlib.suppress(WebSocketDisconnect):
+        while True:
+            message = await ws.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+
+
+# --------- Match-Benachrichtigung ---------
+
+def _resolve_waiters(user_id, assigned):
+    for future in match_waiters.pop(user_id, ()):
+        if not future.done():
+            future.set_result(assigned)
+
+async def wait_for_assignment(user_id, timeout, closed):
+    future = asyncio.get_running_loop().create_future()
+    match_waiters.setdefault(user_id, set()).add(future)
+    try:
+        # Zuweisung kann vor dem Registrieren passiert sein
+        assigned = match_engine.assignment(user_id)
+        if assigned:
+            return assigned
+        await asyncio.wait({future, closed}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        return future.result() if future.done() else match_engine.assignment(user_id)
+    finally:
+        waiters = match_waiters.get(user_id)
+        if waiters is not None:
+            waiters.discard(future)
+            if not waiters:
+                match_waiters.pop(user_id, None)
+
+async def match_updates(ws):
+    user_id = session_user(ws)
+    if not user_id:
+        await ws.close()
+        return
+    await ws.accept()
+    await asyncio.to_thread(match_engine.ensure_restored)
+    closed = asyncio.create_task(until_closed(ws))
+    try:
+        while not closed.done():
+            assigned = await wait_for_assignment(user_id, ASYNC_MATCH_RECHECK, closed)
+            if closed.done():
+                return
+            if not assigned:
+                queued, assigned = await asyncio.to_thread(match_engine.claim, user_id)
+                if not assigned and not queued:
+                    await ws.send_text(json.dumps({"type": "left_queue", "url": build_url("match")}))
+                    break
+                if not assigned:
+                    # queue_position nimmt das Engine-Lock: nicht auf der Event-Loop
+                    status = await asyncio.to_thread(queue_status, user_id)
+                    await ws.send_text(json.dumps({"type": "position", **status}))
+            if assigned:
+                await ws.send_text(json.dumps({
+                    "type": "matched",
+                    "session_id": assigned["id"],
+                    "room_key": assigned["ice_room_key"],
+                    "url": build_url("session_view", sid=assigned["id"]),
+                }))
+                break
+        await ws.close()
+    finally:
+        closed.cancel()
+
+
+# --------- Chat ---------
+
+async def chat_socket(ws):
+    connection_id = ws.path_params["connection_id"]
+    user_id = session_user(ws)
+    if not user_id:
+        await ws.close()
+        return
+    async with db_pool.connection() as conn:
+        cur = await conn.execute(chat.MEMBERSHIP_SQL, (connection_id, user_id, user_id))
+        if not await cur.fetchone():
+            await ws.close()
+            return
+    await ws.accept()
+
+    peer = LoopSocket(ws, asyncio.get_running_loop())
+    writer = asyncio.create_task(peer.writer())
+    # Chat läuft über den Signaling-Raum: join wartet ggf. auf LISTEN
+    await asyncio.to_thread(join_chat_room, connection_id, peer, user_id)
+    try:
+        while True:
+            data = await ws.receive_text()
+            try:
+                message = str(json.loads(data).get("message", "")).strip()
+            except (ValueError, AttributeError):
+                continue
+            if not message:
+                continue
+            async with db_pool.connection() as conn:
+                async with conn.cursor() as cur:
+                    msg = await chat.astore_message(cur, connection_id, user_id, message[:500],
+                                                    read=recipient_online(connection_id, user_id))
+            # NOTIFY und Rendern pro Empfänger nicht auf der Event-Loop
+            await asyncio.to_thread(broadcast_chat_message, connection_id, msg)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        leave_chat_room(connection_id, peer)
+        writer.cancel()
+
+
+# --------- Signaling ---------
+
+async def signal(ws):
+    room = ws.path_params["room"]
+    await ws.accept()
+    peer = LoopSocket(ws, asyncio.get_running_loop())
+    writer = asyncio.create_task(peer.writer())
+    # PostgresSignaling.join wartet auf LISTEN im Listener-Thread
+    await asyncio.to_thread(signaling.join, room, peer)
+    try:
+        while True:
+            data = await ws.receive_text()
+            await signaling.apublish(room, peer, data, db_pool)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        signaling.leave(room, peer)
+        writer.cancel()
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_app):
+    global db_pool
+    loop = asyncio.get_running_loop()
+    db_pool = AsyncConnectionPool(DATABASE_URL, min_size=ASYNC_DB_POOL_MIN, max_size=ASYNC_DB_POOL_MAX,
+                                  kwargs={"row_factory": dict_row}, open=False)
+    # nicht auf die DB warten: Signaling mit SIGNAL_BACKEND=memory braucht keine
+    await db_pool.open(wait=False)
+    start_background()
+    match_engine.add_listener(lambda user_id, assigned: loop.call_soon_threadsafe(
+        _resolve_waiters, user_id, assigned))
+    print("⚡ Async WebSocket server ready")
+    try:
+        yield
+    finally:
+        # ausstehende read_at/last_activity-Updates nicht verlieren
+        await asyncio.to_thread(write_behind.stop)
+        await db_pool.close()
+
+
+asgi_app = Starlette(
+    routes=[
+        WebSocketRoute("/ws/match", match_updates),
+        WebSocketRoute("/ws/chat/{connection_id:int}", chat_socket),
+        WebSocketRoute("/ws/signal/{room}", signal),
+        Mount("/", app=WSGIMiddleware(flask_app, workers=WSGI_WORKERS)),
+    ],
+    lifespan=lifespan,
+)
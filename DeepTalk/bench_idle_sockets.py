@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""Compare threads and memory per 1k idle WebSockets: threaded vs. asyncio server.
+
+Starts each serving mode in a subprocess (SIGNAL_BACKEND=memory, no database
+needed), opens N idle /ws/signal sockets and reads Threads/VmRSS of the
+server from /proc. Linux only.
+
+    python bench_idle_sockets.py            # 1000 sockets
+    python bench_idle_sockets.py 5000
+"""
+
+import os
+import sys
+import time
+import base64
+import socket
+import asyncio
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PORT = 5301
+
+SERVERS = {
+    "threaded": [sys.executable, "-c",
+                 "import sys; sys.path.insert(0, {here!r})\n"
+                 "from werkzeug.serving import run_simple\n"
+                 # import app startet keine Hintergrund-Threads (app.start_background)
+                 "from app import app\n"
+                 "run_simple('127.0.0.1', {port}, app, threaded=True)"],
+    "asyncio": [sys.executable, "-m", "uvicorn", "async_server:asgi_app",
+                "--host", "127.0.0.1", "--port", "{port}", "--ws", "wsproto",
+                "--log-level", "warning", "--backlog", "4096"],
+}
+
+def proc_status(pid):
+    status = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            status[key] = value.strip()
+    return int(status["Threads"]), int(status["VmRSS"].split()[0])   # kB
+
+def wait_for_port(port, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+async def open_socket(port, room):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    key = base64.b64encode(os.urandom(16)).decode()
+    writer.write((f"GET /ws/signal/{room} HTTP/1.1\r\n"
+                  f"Host: 127.0.0.1:{port}\r\n"
+                  "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                  f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode())
+    await writer.drain()
+    status = await reader.readuntil(b"\r\n\r\n")
+    if b" 101 " not in status.split(b"\r\n", 1)[0]:
+        raise RuntimeError(status.decode(errors="replace"))
+    return writer
+
+async def open_sockets(port, count, concurrency=100):
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with gate:
+            # zwei Peers pro Raum wie bei einem echten Call
+            return await open_socket(port, f"bench_{i // 2}")
+
+    return await asyncio.gather(*(one(i) for i in range(count)))
+
+def bench(mode, count):
+    cmd = [part.format(here=HERE, port=PORT) for part in SERVERS[mode]]
+    # Ohne DB: Reaper, Match-Tick, Listener und Write-Behind bleiben in beiden Modi aus
+    env = dict(os.environ, SIGNAL_BACKEND="memory", REAPER_INTERVAL="0",
+               MATCH_TICK_INTERVAL="0", MATCH_LISTEN="0", CACHE_LISTEN="0", WRITE_BEHIND_INTERVAL="0")
+    server = subprocess.Popen(cmd, cwd=HERE, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_for_port(PORT):
+            raise RuntimeError(f"{mode} server did not start")
+        # einmal aufwärmen, damit Importe/Lazy-Init nicht mitgezählt werden
+        asyncio.run(open_sockets(PORT, 2))
+        time.sleep(1)
+        threads_before, rss_before = proc_status(server.pid)
+
+        async def run():
+            start = time.time()
+            writers = await open_sockets(PORT, count)
+            elapsed = time.time() - start
+            await asyncio.sleep(2)
+            threads, rss = proc_status(server.pid)
+            for writer in writers:
+                writer.close()
+            return elapsed, threads, rss
+
+        elapsed, threads, rss = asyncio.run(run())
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+    per_1k = 1000 / count
+    return {
+        "mode": mode,
+        "sockets": count,
+        "connect_s": elapsed,
+        "threads": threads,
+        "threads_per_1k": (threads - threads_before) * per_1k,
+        "rss_mb": rss / 1024,
+        "rss_mb_per_1k": (rss - rss_before) / 1024 * per_1k,
+    }
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    print(f"📊 {count} idle WebSockets per serving mode")
+    print("=" * 72)
+    print(f"{'mode':<10} {'connect':>9} {'threads':>8} {'threads/1k':>11} {'RSS MB':>8} {'MB/1k':>8}")
+    for mode in SERVERS:
+        r = bench(mode, count)
+        print(f"{r['mode']:<10} {r['connect_s']:>8.2f}s {r['threads']:>8} {r['threads_per_1k']:>11.0f} "
+              f"{r['rss_mb']:>8.1f} {r['rss_mb_per_1k']:>8.1f}")
+
+if __name__ == "__main__":
+    main()
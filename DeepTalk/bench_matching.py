@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Time one matching decision of scoring.CandidatePool against a large waiting pool.
+
+Fills the pool with random profiles (no database needed), then lets fresh
+seekers pick their best partner and reports the latency percentiles. Each
+decision also removes the chosen partner and puts a new user back, like the
+engine does.
+
+    python bench_matching.py                # 50k Wartende, 2000 Entscheidungen
+    python bench_matching.py 200000 500
+"""
+
+import os
+import sys
+import time
+import random
+from datetime import datetime, timezone
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from scoring import CandidatePool, MOODS, STYLES
+
+LANGS = ["de"] * 6 + ["en"] * 3 + ["fr", "es", "tr"]
+BUDGET_MS = 5.0
+
+def random_profile(rng, now):
+    preferences = rng.random() < 0.7
+    min_age = rng.randint(18, 40)
+    return {
+        "lang": rng.choice(LANGS),
+        "style": rng.choice(STYLES),
+        "mood": rng.choice(MOODS),
+        "preferred_lang": rng.choice(LANGS) if preferences else None,
+        "preferred_style": rng.choice(STYLES) if preferences else None,
+        "min_age": min_age if preferences else None,
+        "max_age": min_age + rng.randint(5, 40) if preferences else None,
+        "birth_year": rng.randint(1950, 2007) if rng.random() < 0.8 else None,
+        "enqueued_at": datetime.fromtimestamp(now - rng.uniform(0, 300), timezone.utc),
+    }
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+def main():
+    waiting = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    decisions = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    rng = random.Random(24)
+    now = time.time()
+
+    pool = CandidatePool()
+    started = time.perf_counter()
+    for i in range(waiting):
+        pool.add(f"user-{i}", random_profile(rng, now))
+    print(f"📥 {waiting} users loaded in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    timings = []
+    matched = 0
+    for i in range(decisions):
+        seeker = random_profile(rng, now)
+        seeker["enqueued_at"] = datetime.fromtimestamp(now, timezone.utc)
+        started = time.perf_counter()
+        best = pool.best(profile=seeker, now=now)
+        if best:
+            pool.remove(best[0])
+            matched += 1
+        timings.append((time.perf_counter() - started) * 1000)
+        pool.add(f"refill-{i}", random_profile(rng, now))
+
+    timings.sort()
+    p50, p99 = percentile(timings, 50), percentile(timings, 99)
+    print(f"🎯 {decisions} decisions over {len(pool)} waiting, {matched} matched")
+    print(f"⏱️  p50 {p50:.2f} ms | p95 {percentile(timings, 95):.2f} ms | p99 {p99:.2f} ms | "
+          f"max {timings[-1]:.2f} ms")
+    print(("✅" if p99 < BUDGET_MS else "❌") + f" p99 {'under' if p99 < BUDGET_MS else 'over'} {BUDGET_MS:.0f} ms")
+    return p99 < BUDGET_MS
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,186 @@
+# cache.py
+"""Small in-process read-through cache with TTL and LRU bounds.
+
+Concurrent misses for the same key are coalesced: one thread runs the loader,
+the others wait for its result. ``invalidate`` drops entries and makes sure a
+load that was already in flight does not write a stale value back.
+
+Each process has its own cache. ``publish_invalidation`` sends the keys on
+``CACHE_CHANNEL`` and an :class:`InvalidationListener` in every process
+drops them there too, so other workers do not serve a stale entry until its
+TTL runs out.
+"""
+
+import os
+import json
+import time
+import uuid
+import select
+import logging
+import threading
+from collections import OrderedDict
+
+import psycopg2
+
+from db import DATABASE_URL
+import events
+
+CACHE_CHANNEL = "deeptalk_cache"
+CACHE_LISTEN = os.getenv("CACHE_LISTEN", "1") == "1"    # 0: nur lokal invalidieren, TTL begrenzt den Rest
+# Eigene Invalidierungen sind lokal schon erledigt und kommen nicht noch einmal an
+ORIGIN = uuid.uuid4().hex
+
+
+class TTLCache:
+    def __init__(self, loader, maxsize=10000, ttl=30.0):
+        self.loader = loader
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (expires_at, value)
+        self._inflight = {}             # key -> threading.Event
+        self._generation = {}           # key -> Invalidierungszähler (nur für laufende Loads)
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry and entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                event = self._inflight.get(key)
+                if event is None:
+                    # Dieser Thread lädt, alle anderen warten auf ihn
+                    event = self._inflight[key] = threading.Event()
+                    generation = self._generation.get(key, 0)
+                    self.misses += 1
+                    break
+                self.coalesced += 1
+            event.wait()
+            # Ergebnis liegt jetzt im Cache (oder der Load ist fehlgeschlagen)
+
+        try:
+            value = self.loader(key)
+        except Exception:
+            with self._lock:
+                del self._inflight[key]
+            event.set()
+            raise
+
+        with self._lock:
+            del self._inflight[key]
+            if self._generation.get(key, 0) == generation:
+                self._entries[key] = (time.monotonic() + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+            if not self._inflight.get(key):
+                self._generation.pop(key, None)
+        event.set()
+        return value
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+                if key in self._inflight:
+                    self._generation[key] = self._generation.get(key, 0) + 1
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for key in self._inflight:
+                self._generation[key] = self._generation.get(key, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+def publish_invalidation(cur, name, *keys):
+    """Tell the other processes to drop ``keys`` from cache ``name`` (sent on commit)."""
+    cur.execute("SELECT pg_notify(%s, %s)", (CACHE_CHANNEL, json.dumps(
+        {"cache": name, "keys": [str(key) for key in keys], "origin": ORIGIN})))
+
+
+class InvalidationListener:
+    """LISTEN on ``CACHE_CHANNEL`` and invalidate the named local caches.
+
+    Runs on its own autocommit connection in a daemon thread and reconnects
+    after errors; after a reconnect every cache is cleared, since
+    invalidations may have been missed in between.
+    """
+
+    def __init__(self, caches, dsn=DATABASE_URL):
+        self.caches = caches        # name -> TTLCache
+        self.dsn = dsn
+        self.received = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, enabled=CACHE_LISTEN):
+        if not enabled or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True, name="cache-listener")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        connected_before = False
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute("LISTEN " + CACHE_CHANNEL)
+                if connected_before:
+                    for cache in self.caches.values():
+                        cache.clear()
+                connected_before = True
+                self._serve(conn)
+            except (psycopg2.Error, OSError) as e:
+                events.log("cache_listener_lost", level=logging.WARNING, error=str(e))
+                self._stop.wait(1)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def _serve(self, conn):
+        while not self._stop.is_set():
+            if select.select([conn], [], [], 1.0)[0]:
+                conn.poll()
+            while conn.notifies:
+                try:
+                    self.dispatch(conn.notifies.pop(0).payload)
+                except (ValueError, KeyError) as e:
+                    events.log("cache_dispatch_failed", level=logging.WARNING, error=str(e))
+
+    def dispatch(self, payload):
+        message = json.loads(payload)
+        if message.get("origin") == ORIGIN:
+            return
+        self.received += 1
+        cache = self.caches.get(message["cache"])
+        if cache is not None:
+            cache.invalidate(*message["keys"])
@@ -0,0 +1,129 @@
+# cards.py
+"""In-memory conversation card catalogue and per-session decks.
+
+The whole ``conversation_card`` table is small, so it is cached in process
+and reloaded every ``CARD_CACHE_TTL`` seconds. ``version`` is a hash of the
+loaded rows and only changes when the catalogue content changes.
+
+A deck is chosen once when a session is created (inside the claim
+transaction) and stored in ``session_card_usage``; session pages read the
+card ids from there and resolve them from the cache.
+"""
+
+import os
+import time
+import hashlib
+import threading
+
+from db import get_cursor
+
+CARD_CACHE_TTL = float(os.getenv("CARD_CACHE_TTL", "300"))
+DECK_SIZE = int(os.getenv("DECK_SIZE", "10"))
+
+# Karten, die die Teilnehmer schon in früheren Sessions hatten (pro Nutzer)
+SEEN_CARDS_SQL = """
+    SELECT DISTINCT sp.user_id::text AS user_id, scu.card_id
+    FROM session_card_usage scu
+    JOIN session_participant sp ON sp.session_id = scu.session_id
+    WHERE sp.user_id = ANY(%s::uuid[]) AND scu.session_id <> ALL(%s::uuid[])
+"""
+
+STORE_DECKS_SQL = """
+    INSERT INTO session_card_usage (session_id, card_id, position)
+    SELECT d.session_id, d.card_id, d.position
+    FROM unnest(%s::uuid[], %s::bigint[], %s::smallint[]) AS d(session_id, card_id, position)
+    ON CONFLICT DO NOTHING
+"""
+
+
+class CardCatalog:
+    def __init__(self, ttl=CARD_CACHE_TTL, deck_size=DECK_SIZE):
+        self.ttl = ttl
+        self.deck_size = deck_size
+        self.version = None
+        self._lock = threading.Lock()
+        self._cards = {}        # id -> card
+        self._ordered = []      # depth DESC, id ASC
+        self._loaded_at = None
+
+    def _ensure_loaded(self, cur=None):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+            self.reload(cur)
+
+    def reload(self, cur=None):
+        sql = "SELECT id, topic, depth, prompt, lang, style FROM conversation_card ORDER BY depth DESC, id ASC"
+        if cur is None:
+            with get_cursor() as own_cur:
+                own_cur.execute(sql)
+                rows = own_cur.fetchall()
+        else:
+            cur.execute(sql)
+            rows = cur.fetchall()
+        cards = [dict(row) for row in rows]
+        version = hashlib.sha1(repr([sorted(c.items()) for c in cards]).encode()).hexdigest()[:12]
+        with self._lock:
+            self._cards = {c["id"]: c for c in cards}
+            self._ordered = cards
+            self.version = version
+            self._loaded_at = time.monotonic()
+        return version
+
+    def get_many(self, card_ids):
+        """Resolve card ids in the given order, skipping deleted cards."""
+        self._ensure_loaded()
+        cards = self._cards
+        return [cards[card_id] for card_id in card_ids if card_id in cards]
+
+    def default_deck(self):
+        """Deck for sessions created before decks were stored."""
+        self._ensure_loaded()
+        return self._ordered[:self.deck_size]
+
+    def build_deck(self, lang, style, seen=(), cur=None):
+        """Pick the deepest matching cards, preferring ones not seen yet."""
+        self._ensure_loaded(cur)
+        seen = set(seen)
+        fitting = [c for c in self._ordered
+                   if c["lang"] in (None, lang) and c["style"] in (None, style)]
+        fresh = [c for c in fitting if c["id"] not in seen]
+        if len(fresh) < self.deck_size:
+            # Zu wenig neue Karten: mit schon gesehenen auffüllen
+            fresh += [c for c in fitting if c["id"] in seen][:self.deck_size - len(fresh)]
+        return fresh[:self.deck_size]
+
+    def store_deck(self, cur, session_id, lang, style, user_ids):
+        """Choose a deck for a new session and write it to session_card_usage."""
+        return self.store_decks(cur, [(session_id, lang, style, user_ids)])[0]
+
+    def store_decks(self, cur, sessions):
+        """Store decks for ``[(session_id, lang, style, user_ids), ...]``.
+
+        One query for the seen cards and one insert, however many sessions.
+        Returns the decks in the order of ``sessions``.
+        """
+        if not sessions:
+            return []
+        user_ids = sorted({str(u) for _, _, _, users in sessions for u in users})
+        session_ids = [str(session_id) for session_id, _, _, _ in sessions]
+        cur.execute(SEEN_CARDS_SQL, (user_ids, session_ids))
+        seen_by_user = {}
+        for row in cur.fetchall():
+            seen_by_user.setdefault(row["user_id"], set()).add(row["card_id"])
+        decks, rows = [], ([], [], [])
+        for session_id, lang, style, users in sessions:
+            seen = set().union(*(seen_by_user.get(str(u), ()) for u in users))
+            deck = self.build_deck(lang, style, seen, cur=cur)
+            decks.append(deck)
+            for position, card in enumerate(deck, 1):
+                rows[0].append(str(session_id))
+                rows[1].append(card["id"])
+                rows[2].append(position)
+        if rows[0]:
+            cur.execute(STORE_DECKS_SQL, rows)
+        return decks
+
+    def stats(self):
+        return {"version": self.version, "cards": len(self._cards), "deck_size": self.deck_size}
+
+
+catalog = CardCatalog()
@@ -0,0 +1,16 @@
+-- Conversation Cards Schema Update
+-- Cards can be restricted to a language and/or conversation style.
+-- NULL means the card fits every language / style.
+
+ALTER TABLE conversation_card
+ADD COLUMN IF NOT EXISTS lang TEXT,
+ADD COLUMN IF NOT EXISTS style convo_style;
+
+-- Die Start-Karten sind deutsch
+UPDATE conversation_card
+SET lang = 'de'
+WHERE lang IS NULL AND prompt IN (
+  'Was würdest du deinem jüngeren Ich sagen?',
+  'Welche Werte sind dir unverzichtbar?',
+  'Wovon träumst du gerade?'
+);
@@ -0,0 +1,151 @@
+# chat.py
+"""Chat message persistence shared by the Flask routes and the async server.
+
+The SQL lives in module constants so the psycopg2 (sync) and psycopg 3
+(async) code paths run exactly the same statements.
+"""
+
+import os
+
+from conversation_summary import RECORD_MESSAGE_SQL, record_message_params
+
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", "50"))
+CHAT_BATCH_MAX = int(os.getenv("CHAT_BATCH_MAX", "100"))   # Nachrichten pro Batch
+MESSAGE_MAX_LENGTH = 500
+CLIENT_KEY_MAX_LENGTH = 64
+
+MEMBERSHIP_SQL = """
+    SELECT id FROM user_connection 
+    WHERE id = %s AND (user1_id = %s OR user2_id = %s)
+"""
+
+INSERT_MESSAGE_SQL = """
+    INSERT INTO chat_message (connection_id, sender_id, message, read_at)
+    VALUES (%s, %s, %s, CASE WHEN %s THEN now() END)
+    RETURNING id, message, sent_at, sender_id
+"""
+
+TOUCH_CONNECTION_SQL = """
+    UPDATE user_connection 
+    SET last_activity = now() 
+    WHERE id = %s
+"""
+
+# Batch aus einem Statement: ids in Batch-Reihenfolge vergeben, Schlüssel
+# beanspruchen (Wiederholungen laufen in den Konflikt), nur für neu
+# beanspruchte Schlüssel Nachrichten einfügen. Bei Duplikaten liefert die
+# letzte Abfrage die id aus dem ersten Versuch.
+INSERT_BATCH_SQL = """
+    WITH batch AS MATERIALIZED (
+        SELECT b.client_key, b.message, b.position, nextval('chat_message_id_seq') AS id
+        FROM (
+            SELECT * FROM unnest(%(keys)s::text[], %(messages)s::text[]) WITH ORDINALITY
+                AS u(client_key, message, position)
+            ORDER BY position
+        ) b
+    ),
+    claimed AS (
+        INSERT INTO chat_message_key (connection_id, sender_id, client_key, message_id)
+        SELECT %(connection_id)s, %(sender_id)s, client_key, id FROM batch
+        ON CONFLICT DO NOTHING
+        RETURNING client_key
+    ),
+    inserted AS (
+        INSERT INTO chat_message (id, connection_id, sender_id, message, read_at)
+        SELECT b.id, %(connection_id)s, %(sender_id)s, b.message, CASE WHEN %(read)s THEN now() END
+        FROM batch b JOIN claimed USING (client_key)
+        ORDER BY b.position
+        RETURNING id, message, sent_at, sender_id
+    )
+    SELECT b.client_key, b.position,
+           COALESCE(i.id, k.message_id) AS id,
+           i.message, i.sent_at, i.sender_id,
+           i.id IS NOT NULL AS created
+    FROM batch b
+    LEFT JOIN inserted i ON i.id = b.id
+    LEFT JOIN chat_message_key k ON k.connection_id = %(connection_id)s
+        AND k.sender_id = %(sender_id)s AND k.client_key = b.client_key
+    ORDER BY b.position
+"""
+
+# Eine Seite Verlauf, neueste zuerst, vor dem Cursor (sent_at, id) der Nachricht
+# %(before_id)s. Rückwärts-Scan auf idx_chat_message_connection; die zusätzliche
+# sent_at-Bedingung macht den Cursor zur Index-Bedingung.
+HISTORY_SQL = """
+    SELECT 
+        cm.id,
+        cm.message,
+        cm.sent_at,
+        cm.sender_id,
+        sender.nickname as sender_nickname,
+        cm.sender_id = %(user_id)s as is_me
+    FROM chat_message cm
+    JOIN app_user sender ON cm.sender_id = sender.id
+    WHERE cm.connection_id = %(connection_id)s
+    AND (%(before_id)s::bigint IS NULL OR (
+        cm.sent_at <= (SELECT sent_at FROM chat_message WHERE id = %(before_id)s)
+        AND (cm.sent_at, cm.id) < (SELECT sent_at, id FROM chat_message WHERE id = %(before_id)s)
+    ))
+    ORDER BY cm.sent_at DESC, cm.id DESC
+    LIMIT %(limit)s
+"""
+
+def load_page(cur, connection_id, user_id, before_id=None, page_size=CHAT_PAGE_SIZE):
+    """Return ``(messages, has_more)`` for the page before ``before_id``.
+
+    Without ``before_id`` this is the latest page. Messages are in display
+    order (oldest first); ``has_more`` tells whether older ones exist.
+    """
+    cur.execute(HISTORY_SQL, {"user_id": user_id, "connection_id": connection_id,
+                              "before_id": before_id, "limit": page_size + 1})
+    rows = cur.fetchall()
+    has_more = len(rows) > page_size
+    return rows[:page_size][::-1], has_more
+
+def store_message(cur, connection_id, user_id, message, read=False):
+    """Insert a chat message, touch last_activity and update the summaries."""
+    cur.execute(INSERT_MESSAGE_SQL, (connection_id, user_id, message, read))
+    msg = dict(cur.fetchone())
+    cur.execute(TOUCH_CONNECTION_SQL, (connection_id,))
+    cur.execute(RECORD_MESSAGE_SQL, record_message_params(connection_id, msg, read))
+    return msg
+
+def store_messages(cur, connection_id, user_id, batch, read=False):
+    """Insert an ordered batch of ``(client_key, message)`` pairs in one statement.
+
+    Keys seen before (retries) are skipped; repeated keys within the batch
+    count once. last_activity and the summaries are updated once for the
+    batch. Returns one row per distinct key with ``id`` and ``created``;
+    created rows also carry ``message``, ``sent_at`` and ``sender_id``.
+    """
+    unique = {}
+    for client_key, message in batch:
+        unique.setdefault(client_key, message)
+    cur.execute(INSERT_BATCH_SQL, {"keys": list(unique), "messages": list(unique.values()),
+                                   "connection_id": connection_id, "sender_id": user_id, "read": read})
+    rows = [dict(row) for row in cur.fetchall()]
+    missing = [row["client_key"] for row in rows if row["id"] is None]
+    if missing:
+        # Schlüssel kam parallel aus einer noch offenen Transaktion: jetzt sichtbar
+        cur.execute("""
+            SELECT client_key, message_id FROM chat_message_key
+            WHERE connection_id = %s AND sender_id = %s AND client_key = ANY(%s)
+        """, (connection_id, user_id, missing))
+        ids = {row["client_key"]: row["message_id"] for row in cur.fetchall()}
+        for row in rows:
+            if row["id"] is None:
+                row["id"] = ids.get(row["client_key"])
+    created = [row for row in rows if row["created"]]
+    if created:
+        cur.execute(TOUCH_CONNECTION_SQL, (connection_id,))
+        cur.execute(RECORD_MESSAGE_SQL, record_message_params(connection_id, created[-1], read,
+                                                               count=len(created)))
+    return rows
+
+async def astore_message(cur, connection_id, user_id, message, read=False):
+    """Async variant of :func:`store_message` for a psycopg 3 cursor."""
+    await cur.execute(INSERT_MESSAGE_SQL, (connection_id, user_id, message, read))
+    msg = dict(await cur.fetchone())
+    await cur.execute(TOUCH_CONNECTION_SQL, (connection_id,))
+    await cur.execute(RECORD_MESSAGE_SQL, record_message_params(connection_id, msg, read))
+    return msg
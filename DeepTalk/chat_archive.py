@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""Archive old chat_message partitions to compressed files and restore them.
+
+``chat_message`` is partitioned by month (``migrations/002_partition_chat_message.sql``).
+``archive`` exports every monthly partition that ended before the cutoff as
+gzip'd CSV into ``CHAT_ARCHIVE_DIR``, records which connections it contains
+in ``chat_message_archive_connection`` and then detaches and drops it.
+``restore`` brings the archived messages of one connection back; they land
+in ``chat_message_default`` because their month no longer has a partition.
+
+    python chat_archive.py archive --older-than 365   # Tage
+    python chat_archive.py restore 1234
+    python chat_archive.py status
+    python chat_archive.py ensure                     # künftige Monate anlegen
+"""
+
+import io
+import os
+import re
+import csv
+import gzip
+import argparse
+from datetime import datetime, timedelta, timezone
+
+from psycopg2 import sql
+
+from db import get_cursor
+
+CHAT_ARCHIVE_DIR = os.getenv("CHAT_ARCHIVE_DIR",
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+CHAT_ARCHIVE_AFTER_DAYS = int(os.getenv("CHAT_ARCHIVE_AFTER_DAYS", "365"))
+PARTITIONS_AHEAD = int(os.getenv("CHAT_PARTITIONS_AHEAD", "3"))   # Monate im Voraus
+
+COLUMNS = ("id", "connection_id", "sender_id", "message", "sent_at", "read_at")
+
+MONTHLY_PARTITIONS_SQL = """
+    SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'chat_message'::regclass
+    AND c.relname ~ '^chat_message_y[0-9]{4}m[0-9]{2}$'
+    ORDER BY c.relname
+"""
+
+_BOUND = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def ensure_partitions(months_ahead=PARTITIONS_AHEAD):
+    """Create the monthly partitions up to ``months_ahead``. Returns how many were new.
+
+    Without migration 002 (no partition function) this does nothing.
+    """
+    with get_cursor(commit=True) as cur:
+        cur.execute("SELECT to_regproc('ensure_chat_message_partitions') IS NOT NULL AS ok")
+        if not cur.fetchone()["ok"]:
+            return 0
+        cur.execute("SELECT ensure_chat_message_partitions(now()::date, %s) AS created", (months_ahead,))
+        return cur.fetchone()["created"]
+
+
+def monthly_partitions(cur):
+    """``[(name, range_start, range_end)]`` of the attached monthly partitions."""
+    cur.execute(MONTHLY_PARTITIONS_SQL)
+    partitions = []
+    for row in cur.fetchall():
+        match = _BOUND.search(row["bound"])
+        if match:
+            start, end = (datetime.fromisoformat(value) for value in match.groups())
+            partitions.append((row["name"], start, end))
+    return partitions
+
+
+def archive_partition(name, range_start, range_end, directory=CHAT_ARCHIVE_DIR):
+    """Export one partition to ``<directory>/<name>.csv.gz``, then drop it.
+
+    Export, bookkeeping and DROP happen in one transaction; the file is
+    complete on disk before the partition goes away. Returns the row count.
+    """
+    os.makedirs(directory, exist_ok=True)
+    filename = f"{name}.csv.gz"
+    path = os.path.join(directory, filename)
+    table = sql.Identifier(name)
+
+    with get_cursor(commit=True) as cur:
+        cur.execute("SET LOCAL lock_timeout = '5s'")
+        # Keine Änderungen (read_at) mehr während des Exports
+        cur.execute(sql.SQL("LOCK TABLE {} IN SHARE MODE").format(table))
+        cur.execute(sql.SQL("SELECT count(*) AS n FROM {}").format(table))
+        expected = cur.fetchone()["n"]
+
+        with gzip.open(path + ".part", "wt", encoding="utf-8", newline="") as f:
+            cur.copy_expert(sql.SQL("COPY (SELECT {} FROM {} ORDER BY connection_id, sent_at, id) "
+                                    "TO STDOUT WITH (FORMAT csv, HEADER)").format(
+                sql.SQL(", ").join(map(sql.Identifier, COLUMNS)), table).as_string(cur), f)
+            exported = cur.rowcount
+            f.flush()
+            os.fsync(f.fileno())
+        if exported != expected:
+            os.remove(path + ".part")
+            raise RuntimeError(f"{name}: exported {exported} of {expected} rows")
+        os.replace(path + ".part", path)
+
+        cur.execute("""
+            INSERT INTO chat_message_archive (partition_name, range_start, range_end, file, messages)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (partition_name) DO UPDATE SET
+                file = EXCLUDED.file, messages = EXCLUDED.messages, archived_at = now()
+        """, (name, range_start, range_end, filename, expected))
+        cur.execute(sql.SQL("""
+            INSERT INTO chat_message_archive_connection (partition_name, connection_id, messages)
+            SELECT %s, connection_id, count(*) FROM {} GROUP BY connection_id
+            ON CONFLICT (connection_id, partition_name) DO UPDATE SET
+                messages = EXCLUDED.messages, restored_at = NULL
+        """).format(table), (name,))
+        cur.execute(sql.SQL("ALTER TABLE chat_message DETACH PARTITION {}").format(table))
+        cur.execute(sql.SQL("DROP TABLE {}").format(table))
+    return expected
+
+
+def archive(older_than_days=CHAT_ARCHIVE_AFTER_DAYS, directory=CHAT_ARCHIVE_DIR, dry_run=False):
+    """Archive all monthly partitions that ended before the cutoff. Returns ``[(name, rows)]``."""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    with get_cursor() as cur:
+        due = [p for p in monthly_partitions(cur) if p[2] <= cutoff]
+    done = []
+    for name, range_start, range_end in due:
+        rows = 0 if dry_run else archive_partition(name, range_start, range_end, directory)
+        done.append((name, rows))
+    return done
+
+
+def _archived_rows(path, connection_id):
+    """Yield the CSV rows of ``connection_id`` from an archive file."""
+    wanted = str(connection_id)
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        position = header.index("connection_id")
+        for row in reader:
+            if row[position] == wanted:
+                yield row
+
+
+def restore_connection(connection_id, directory=CHAT_ARCHIVE_DIR):
+    """Bring the archived messages of one connection back. Returns the number restored."""
+    restored = 0
+    with get_cursor(commit=True) as cur:
+        cur.execute("""
+            SELECT ac.partition_name, a.file
+            FROM chat_message_archive_connection ac
+            JOIN chat_message_archive a USING (partition_name)
+            WHERE ac.connection_id = %s AND ac.restored_at IS NULL
+            ORDER BY a.range_start
+        """, (connection_id,))
+        archives = cur.fetchall()
+        if not archives:
+            return 0
+
+        cur.execute("CREATE TEMP TABLE chat_message_restore (LIKE chat_message) ON COMMIT DROP")
+        for archived in archives:
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(_archived_rows(os.path.join(directory, archived["file"]),
+                                                        connection_id))
+            buffer.seek(0)
+            cur.copy_expert(f"COPY chat_message_restore ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                            buffer)
+
+        # Gelöschte Absender (ON DELETE CASCADE) nicht wiederbeleben
+        cur.execute(f"""
+            INSERT INTO chat_message ({', '.join(COLUMNS)})
+            SELECT {', '.join('r.' + c for c in COLUMNS)}
+            FROM chat_message_restore r
+            WHERE EXISTS (SELECT 1 FROM user_connection WHERE id = r.connection_id)
+            AND EXISTS (SELECT 1 FROM app_user WHERE id = r.sender_id)
+            ON CONFLICT DO NOTHING
+        """)
+        restored = cur.rowcount
+        cur.execute("""
+            UPDATE chat_message_archive_connection SET restored_at = now()
+            WHERE connection_id = %s AND partition_name = ANY(%s)
+        """, (connection_id, [a["partition_name"] for a in archives]))
+    return restored
+
+
+def status():
+    with get_cursor() as cur:
+        partitions = monthly_partitions(cur)
+        cur.execute("SELECT * FROM chat_message_archive ORDER BY range_start")
+        archived = cur.fetchall()
+    for name, range_start, range_end in partitions:
+        print(f"🗂️  {name}  {range_start:%Y-%m-%d} – {range_end:%Y-%m-%d}")
+    for row in archived:
+        print(f"📦 {row['partition_name']}  {row['messages']} messages in {row['file']} "
+              f"(archived {row['archived_at']:%Y-%m-%d})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--dir", default=CHAT_ARCHIVE_DIR, help="archive directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    archive_cmd = commands.add_parser("archive", help="archive partitions older than the cutoff")
+    archive_cmd.add_argument("--older-than", type=int, default=CHAT_ARCHIVE_AFTER_DAYS, help="days")
+    archive_cmd.add_argument("--dry-run", action="store_true", help="only list the partitions")
+    restore_cmd = commands.add_parser("restore", help="restore one connection's archived messages")
+    restore_cmd.add_argument("connection_id", type=int)
+    commands.add_parser("status", help="list partitions and archives")
+    ensure_cmd = commands.add_parser("ensure", help="create upcoming monthly partitions")
+    ensure_cmd.add_argument("--ahead", type=int, default=PARTITIONS_AHEAD, help="months")
+    args = parser.parse_args()
+
+    if args.command == "archive":
+        done = archive(args.older_than, args.dir, args.dry_run)
+        for name, rows in done:
+            print(f"{'🔍' if args.dry_run else '📦'} {name}" + ("" if args.dry_run else f": {rows} messages"))
+        if not done:
+            print("✅ Nothing to archive")
+    elif args.command == "restore":
+        print(f"✅ Restored {restore_connection(args.connection_id, args.dir)} messages")
+    elif args.command == "status":
+        status()
+    elif args.command == "ensure":
+        print(f"✅ Created {ensure_partitions(args.ahead)} partitions")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 -- Chat System Schema Update
 -- Add chat messages table for post-reveal conversations
+-- (migrations/002_partition_chat_message.sql stellt sie auf Monatspartitionen um)
 
 CREATE TABLE IF NOT EXISTS chat_message (
   id BIGSERIAL PRIMARY KEY,
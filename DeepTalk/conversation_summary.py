@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Maintain the denormalized conversation_summary table.
+
+Every write path that changes what /connections shows (new connection, new
+message) updates the two summary rows of the connection in the same
+transaction; read receipts and chat activity follow with the next
+``write_behind`` flush. ``rebuild()`` recomputes them from
+chat_message, e.g. after applying summary_schema_update.sql.
+"""
+
+import sys
+
+from db import get_cursor
+
+# Beide Blickrichtungen einer Verbindung: (user_id, other_user_id)
+_BOTH_SIDES = """
+    CROSS JOIN LATERAL (VALUES (uc.user1_id, uc.user2_id), (uc.user2_id, uc.user1_id)) AS side(user_id, other_user_id)
+"""
+
+def create(cur, connection_id):
+    """Add the summary rows for a freshly created connection."""
+    cur.execute("""
+        INSERT INTO conversation_summary (user_id, connection_id, other_user_id, connected_at, last_activity)
+        SELECT side.user_id, uc.id, side.other_user_id, uc.connected_at,
+               COALESCE(uc.last_activity, uc.connected_at)
+        FROM user_connection uc
+        """ + _BOTH_SIDES + """
+        WHERE uc.id = %s
+        ON CONFLICT (user_id, connection_id) DO NOTHING
+    """, (connection_id,))
+
+RECORD_MESSAGE_SQL = """
+    INSERT INTO conversation_summary AS cs
+        (user_id, connection_id, other_user_id, connected_at,
+         last_message, last_message_at, last_sender_id, unread_count, last_activity)
+    SELECT side.user_id, uc.id, side.other_user_id, uc.connected_at,
+           %(message)s, %(sent_at)s, %(sender_id)s,
+           CASE WHEN side.user_id <> %(sender_id)s AND NOT %(read)s THEN %(count)s ELSE 0 END,
+           %(sent_at)s
+    FROM user_connection uc
+    """ + _BOTH_SIDES + """
+    WHERE uc.id = %(connection_id)s
+    ON CONFLICT (user_id, connection_id) DO UPDATE SET
+        last_message = EXCLUDED.last_message,
+        last_message_at = EXCLUDED.last_message_at,
+        last_sender_id = EXCLUDED.last_sender_id,
+        unread_count = cs.unread_count + EXCLUDED.unread_count,
+        last_activity = EXCLUDED.last_activity
+"""
+
+def record_message_params(connection_id, msg, read=False, count=1):
+    """``msg`` is the newest of ``count`` new messages from the same sender."""
+    return {"connection_id": connection_id, "message": msg["message"], "sent_at": msg["sent_at"],
+            "sender_id": str(msg["sender_id"]), "read": read, "count": count}
+
+def record_message(cur, connection_id, msg, read=False, count=1):
+    """Set the last message for both sides and bump the recipient's unread count."""
+    cur.execute(RECORD_MESSAGE_SQL, record_message_params(connection_id, msg, read, count))
+
+def rebuild(connection_id=None):
+    """Recompute summaries from user_connection and chat_message.
+
+    Rebuilds a single connection or, without ``connection_id``, all of them.
+    Returns the number of summary rows written.
+    """
+    with get_cursor(commit=True) as cur:
+        cur.execute("""
+            DELETE FROM conversation_summary
+            WHERE %(connection_id)s::bigint IS NULL OR connection_id = %(connection_id)s
+        """, {"connection_id": connection_id})
+        cur.execute("""
+            INSERT INTO conversation_summary
+                (user_id, connection_id, other_user_id, connected_at,
+                 last_message, last_message_at, last_sender_id, unread_count, last_activity)
+            SELECT side.user_id, uc.id, side.other_user_id, uc.connected_at,
+                   latest_msg.message, latest_msg.sent_at, latest_msg.sender_id,
+                   (SELECT COUNT(*) FROM chat_message
+                    WHERE connection_id = uc.id
+                    AND sender_id = side.other_user_id
+                    AND read_at IS NULL),
+                   COALESCE(uc.last_activity, uc.connected_at)
+            FROM user_connection uc
+            """ + _BOTH_SIDES + """
+            LEFT JOIN LATERAL (
+                SELECT message, sent_at, sender_id
+                FROM chat_message
+                WHERE connection_id = uc.id
+                ORDER BY sent_at DESC, id DESC
+                LIMIT 1
+            ) latest_msg ON true
+            WHERE %(connection_id)s::bigint IS NULL OR uc.id = %(connection_id)s
+        """, {"connection_id": connection_id})
+        return cur.rowcount
+
+if __name__ == "__main__":
+    target = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    try:
+        rows = rebuild(target)
+        print(f"✅ Rebuilt {rows} conversation summaries")
+    except Exception as e:
+        print(f"❌ Rebuild failed: {e}")
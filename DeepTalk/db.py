@@ -1,6 +1,12 @@
 # db.py
 import os
+import time
+import atexit
+import threading
+from collections import deque
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
 import psycopg2.extras
 from contextlib import contextmanager
 from dotenv import load_dotenv
@@ -9,18 +15,321 @@ load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Pool-Konfiguration (Sekunden für alle Zeitangaben)
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN", "1"))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))
+POOL_CHECK_IDLE = float(os.getenv("DB_POOL_CHECK_IDLE", "30"))
+
+
+# Callbacks(sql, seconds) für jede Query über get_cursor(), z.B. metrics.py
+_query_observers = []
+
+
+def add_query_observer(callback):
+    """Call ``callback(sql, seconds)`` after every statement run via ``get_cursor``."""
+    _query_observers.append(callback)
+
+
+class TimedCursor(psycopg2.extras.RealDictCursor):
+    """RealDictCursor that reports each statement's duration to the observers."""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            elapsed = time.perf_counter() - start
+            for callback in _query_observers:
+                callback(query, elapsed)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            elapsed = time.perf_counter() - start
+            for callback in _query_observers:
+                callback(query, elapsed)
+
+
+class PoolTimeout(Exception):
+    """No connection became available within the pool wait timeout."""
+
+
+class ConnectionPool:
+    """Thread-safe psycopg2 connection pool.
+
+    Connections are created lazily up to ``max_size``. On checkout a connection
+    is dropped if it is closed or older than ``max_lifetime``, and pinged with
+    ``SELECT 1`` if it sat idle longer than ``check_idle``. Callers block for at
+    most ``timeout`` seconds when all connections are checked out.
+
+    Checkout takes the most recently used connection, so the ones at the other
+    end of the idle stack may never be checked out again. Every checkin
+    therefore also closes expired idle connections above ``min_size``.
+    """
+
+    def __init__(self, dsn, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+                 timeout=POOL_TIMEOUT, max_lifetime=POOL_MAX_LIFETIME,
+                 check_idle=POOL_CHECK_IDLE):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError("invalid pool size: min=%s max=%s" % (min_size, max_size))
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.check_idle = check_idle
+
+        self._cond = threading.Condition()
+        self._idle = deque()      # (conn, last_used) – rechts = zuletzt benutzt
+        self._created_at = {}     # conn -> Erstellungszeitpunkt
+        self._size = 0
+        self._checked_out = 0
+        self._waiting = 0
+        self._closed = False
+
+        self._requests = 0
+        self._waits = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._timeouts = 0
+        self._connections_created = 0
+        self._connections_closed = 0
+        self._health_check_failures = 0
+        self._connections_swept = 0
+
+    # --- Verbindungen erzeugen / verwerfen ---
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, cursor_factory=psycopg2.extras.RealDictCursor)
+        with self._cond:
+            self._created_at[conn] = time.monotonic()
+            self._connections_created += 1
+        return conn
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._created_at.pop(conn, None)
+            self._connections_closed += 1
+
+    def _expired(self, conn, now):
+        created = self._created_at.get(conn, now)
+        return self.max_lifetime > 0 and now - created > self.max_lifetime
+
+    def _healthy(self, conn, last_used, now):
+        if conn.closed:
+            return False
+        if self._expired(conn, now):
+            return False
+        if now - last_used > self.check_idle:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error:
+                with self._cond:
+                    self._health_check_failures += 1
+                return False
+        return True
+
+    def _sweep(self, now):
+        """Take expired idle connections above ``min_size`` out of the pool (lock held).
+
+        Returns them; the caller closes them outside the lock.
+        """
+        if self.max_lifetime <= 0 or self._size <= self.min_size:
+            return []
+        expired, keep = [], deque()
+        for conn, last_used in self._idle:
+            if self._size - len(expired) > self.min_size and self._expired(conn, now):
+                expired.append(conn)
+            else:
+                keep.append((conn, last_used))
+        if expired:
+            self._idle = keep
+            self._size -= len(expired)
+            self._connections_swept += len(expired)
+        return expired
+
+    def fill(self):
+        """Open connections until ``min_size`` are available."""
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    # --- Checkout / Checkin ---
+
+    def getconn(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+        with self._cond:
+            self._requests += 1
+            while True:
+                if self._closed:
+                    raise psycopg2.pool.PoolError("connection pool is closed")
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    conn, last_used = None, None
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(
+                        "no database connection available within %.1fs "
+                        "(max_size=%d)" % (self.timeout, self.max_size))
+                waited = True
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._checked_out += 1
+            if waited:
+                wait_time = time.monotonic() - start
+                self._waits += 1
+                self._wait_time_total += wait_time
+                self._wait_time_max = max(self._wait_time_max, wait_time)
+
+        # Netzwerk-I/O (Ping, Connect) ausserhalb des Locks
+        try:
+            if conn is not None and not self._healthy(conn, last_used, time.monotonic()):
+                self._close(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._checked_out -= 1
+                self._size -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def putconn(self, conn, discard=False):
+        if not discard and not conn.closed:
+            try:
+                # Offene Transaktionen (z.B. get_cursor() ohne commit) zurückrollen
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        if conn.closed or self._closed or self._expired(conn, time.monotonic()):
+            discard = True
+
+        if discard:
+            self._close(conn)
+        with self._cond:
+            self._checked_out -= 1
+            if discard:
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            # Abgelaufene am Ende des Stapels, die getconn nie mehr erreicht
+            swept = self._sweep(time.monotonic())
+            self._cond.notify()
+        for stale in swept:
+            self._close(stale)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            self._close(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "checked_out": self._checked_out,
+                "waiting": self._waiting,
+                "requests": self._requests,
+                "waits": self._waits,
+                "wait_time_total": round(self._wait_time_total, 6),
+                "wait_time_max": round(self._wait_time_max, 6),
+                "timeouts": self._timeouts,
+                "connections_created": self._connections_created,
+                "connections_closed": self._connections_closed,
+                "health_check_failures": self._health_check_failures,
+                "connections_swept": self._connections_swept,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                pool = ConnectionPool(DATABASE_URL)
+                pool.fill()
+                _pool = pool
+    return _pool
+
+
+def pool_stats():
+    return get_pool().stats() if _pool is not None else {}
+
+
+@atexit.register
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
 @contextmanager
 def get_conn():
-    conn = psycopg2.connect(DATABASE_URL, cursor_factory=psycopg2.extras.RealDictCursor)
+    pool = get_pool()
+    conn = pool.getconn()
+    discard = False
     try:
         yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        discard = True
+        raise
     finally:
-        conn.close()
+        pool.putconn(conn, discard=discard)
 
 @contextmanager
 def get_cursor(commit=False):
     with get_conn() as conn:
-        cur = conn.cursor()
+        cur = conn.cursor(cursor_factory=TimedCursor)
         try:
             yield cur
             if commit:
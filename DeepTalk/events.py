@@ -0,0 +1,103 @@
+# events.py
+"""Structured event log for the hot paths.
+
+``log("match_created", session_id=..., user_ids=[...])`` only puts the
+record on a bounded queue; a ``QueueListener`` thread turns it into one JSON
+line and writes it to stdout (or ``EVENT_LOG_FILE``). If the buffer is full
+the event is dropped and counted instead of blocking the request.
+
+    {"ts": "2024-05-01T12:00:00.123Z", "level": "info", "event": "match_created",
+     "session_id": "…", "user_ids": ["…", "…"]}
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+
+EVENT_LOG_BUFFER = int(os.getenv("EVENT_LOG_BUFFER", "10000"))
+EVENT_LOG_FILE = os.getenv("EVENT_LOG_FILE")
+
+
+class JsonLineFormatter(logging.Formatter):
+    def format(self, record):
+        created = time.gmtime(record.created)
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", created) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname.lower(),
+            "event": record.msg,
+        }
+        entry.update(getattr(record, "fields", {}))
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks: a full queue drops the record."""
+
+    def __init__(self, maxsize):
+        super().__init__(queue.Queue(maxsize))
+        self._lock_counts = threading.Lock()
+        self.emitted = 0
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Formatieren passiert im Listener-Thread, nicht im Request
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock_counts:
+                self.dropped += 1
+        else:
+            with self._lock_counts:
+                self.emitted += 1
+
+
+def _output_handler():
+    if EVENT_LOG_FILE:
+        handler = logging.FileHandler(EVENT_LOG_FILE, encoding="utf-8")
+    else:
+        handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonLineFormatter())
+    return handler
+
+
+logger = logging.getLogger("deeptalk.events")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+
+_handler = DroppingQueueHandler(EVENT_LOG_BUFFER)
+logger.addHandler(_handler)
+_listener = logging.handlers.QueueListener(_handler.queue, _output_handler())
+_listener.start()
+
+
+@atexit.register
+def flush():
+    """Stop the listener after writing everything that is still buffered."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def log(event, level=logging.INFO, **fields):
+    """Queue one event with its fields (user_id, session_id, connection_id, …)."""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"fields": fields})
+
+
+def stats():
+    return {
+        "emitted": _handler.emitted,
+        "dropped": _handler.dropped,
+        "buffered": _handler.queue.qsize(),
+        "buffer_size": _handler.queue.maxsize,
+    }
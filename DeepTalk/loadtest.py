@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""Load generator for the enqueue → match → session → reveal → chat funnel.
+
+Every virtual user runs the funnel in a loop with a fresh guest account:
+``/`` (guest login), ``/enqueue``, ``/match`` until matched,
+``/session/<sid>``, ``/reveal/<sid>``, then a few ``/chat/<id>/send`` with
+``/chat/<id>/messages`` polling in between. All users pick the same
+mood/style/lang, so they pair up with each other.
+
+Without ``--url`` the app is started in-process on a threaded werkzeug
+server against ``DATABASE_URL``. Results (throughput and p50/p95/p99 per
+route, matches per second) are printed and written as JSON; ``--compare``
+prints the change against an earlier result file.
+
+    python loadtest.py --users 50 --duration 60
+    python loadtest.py --users 50 --duration 60 --compare loadtest_results.json
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlencode, urlsplit
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+MATCH_POLL = 0.2        # Sekunden zwischen /match-Aufrufen
+MATCH_TIMEOUT = 15      # danach gibt ein Nutzer auf und beginnt neu
+CONNECTION_TIMEOUT = 10
+
+
+class Client:
+    """One browser: keep-alive connection plus the Flask session cookie."""
+
+    def __init__(self, base_url, stats):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.stats = stats
+        self.cookie = None
+        self.conn = None
+
+    def request(self, route, method, path, form=None):
+        """Send one request, record its latency under ``route``.
+
+        Returns ``(status, location, body)``; redirects are not followed.
+        """
+        headers = {"Cookie": self.cookie} if self.cookie else {}
+        body = None
+        if form is not None:
+            body = urlencode(form)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        start = time.perf_counter()
+        try:
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            self.conn.request(method, path, body=body, headers=headers)
+            resp = self.conn.getresponse()
+            data = resp.read()
+        except (OSError, http.client.HTTPException):
+            self.close()
+            self.stats.record(route, time.perf_counter() - start, ok=False)
+            raise
+        self.stats.record(route, time.perf_counter() - start, ok=resp.status < 400)
+        cookie = resp.getheader("Set-Cookie")
+        if cookie:
+            self.cookie = cookie.split(";", 1)[0]
+        return resp.status, resp.getheader("Location") or "", data
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}     # route -> [Sekunden]
+        self.errors = {}        # route -> Anzahl
+        self.sessions = set()
+        self.funnels = 0
+        self.abandoned = 0
+
+    def record(self, route, seconds, ok=True):
+        with self._lock:
+            self.latencies.setdefault(route, []).append(seconds)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    def matched(self, sid):
+        with self._lock:
+            self.sessions.add(sid)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_funnel(client, stats, messages, stop):
+    """One pass through the funnel. Returns False if the user gave up."""
+    client.cookie = None
+    client.request("/", "GET", "/")
+    client.request("/enqueue", "POST", "/enqueue", {"mood": "neutral", "style": "deep", "lang": "de"})
+
+    # Auf Match warten
+    deadline = time.time() + MATCH_TIMEOUT
+    sid = None
+    while not sid:
+        status, location, _ = client.request("/match", "GET", "/match")
+        match = re.search(r"/session/([0-9a-f-]{36})", location)
+        if match:
+            sid = match.group(1)
+        elif status in (301, 302, 303) or time.time() > deadline or stop.is_set():
+            return False
+        else:
+            time.sleep(MATCH_POLL)
+    stats.matched(sid)
+
+    client.request("/session/<sid>", "GET", f"/session/{sid}")
+    _, location, _ = client.request("/reveal/<sid>", "POST", f"/reveal/{sid}", {"vote": "yes"})
+
+    # Der zweite Yes-Vote landet direkt im Chat, der erste sucht ihn auf /connections
+    connection_id = None
+    deadline = time.time() + CONNECTION_TIMEOUT
+    while connection_id is None:
+        match = re.search(r"/chat/(\d+)", location)
+        if match:
+            connection_id = match.group(1)
+            break
+        if time.time() > deadline or stop.is_set():
+            return False
+        time.sleep(MATCH_POLL)
+        _, _, body = client.request("/connections", "GET", "/connections")
+        location = body.decode(errors="replace")
+
+    after_id = 0
+    for i in range(messages):
+        client.request("/chat/<id>/send", "POST", f"/chat/{connection_id}/send",
+                       {"message": f"load test message {i}"})
+        _, _, body = client.request("/chat/<id>/messages", "GET",
+                                    f"/chat/{connection_id}/messages?after_id={after_id}")
+        try:
+            after_id = json.loads(body).get("last_id") or after_id
+        except ValueError:
+            pass
+        time.sleep(random.uniform(0.05, 0.2))
+    return True
+
+
+def virtual_user(base_url, stats, messages, stop):
+    client = Client(base_url, stats)
+    while not stop.is_set():
+        try:
+            if run_funnel(client, stats, messages, stop):
+                with stats._lock:
+                    stats.funnels += 1
+            else:
+                with stats._lock:
+                    stats.abandoned += 1
+        except (OSError, http.client.HTTPException):
+            time.sleep(0.5)
+    client.close()
+
+
+def start_local_server(port):
+    from werkzeug.serving import make_server
+    from app import app, start_background
+
+    # Wie ein echter Server: Reaper, Match-Tick, Listener und Write-Behind laufen mit
+    start_background()
+    server = make_server("127.0.0.1", port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def summarize(stats, duration, config):
+    routes = {}
+    for route, values in sorted(stats.latencies.items()):
+        values = sorted(values)
+        routes[route] = {
+            "requests": len(values),
+            "errors": stats.errors.get(route, 0),
+            "throughput_rps": round(len(values) / duration, 2),
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+            "max_ms": round(values[-1] * 1000, 2),
+        }
+    total = sum(r["requests"] for r in routes.values())
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                  text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        revision = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "revision": revision,
+        "config": config,
+        "duration_s": round(duration, 2),
+        "requests": total,
+        "throughput_rps": round(total / duration, 2),
+        "matches": len(stats.sessions),
+        "matches_per_s": round(len(stats.sessions) / duration, 2),
+        "funnels_completed": stats.funnels,
+        "funnels_abandoned": stats.abandoned,
+        "routes": routes,
+    }
+
+
+def print_report(result, previous=None):
+    print()
+    print(f"📊 {result['requests']} requests in {result['duration_s']}s "
+          f"({result['throughput_rps']} req/s), {result['matches']} matches "
+          f"({result['matches_per_s']}/s), {result['funnels_completed']} funnels completed, "
+          f"{result['funnels_abandoned']} abandoned")
+    print("=" * 86)
+    print(f"{'route':<22} {'req':>7} {'err':>5} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'Δp95':>8}")
+    for route, r in result["routes"].items():
+        delta = ""
+        if previous and route in previous.get("routes", {}):
+            before = previous["routes"][route]["p95_ms"]
+            if before:
+                delta = f"{(r['p95_ms'] - before) / before * 100:+.0f}%"
+        print(f"{route:<22} {r['requests']:>7} {r['errors']:>5} {r['throughput_rps']:>8} "
+              f"{r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9} {delta:>8}")
+    if previous:
+        print(f"\nvs. {previous.get('revision')} ({previous.get('timestamp')}): "
+              f"throughput {previous['throughput_rps']} → {result['throughput_rps']} req/s, "
+              f"matches {previous['matches_per_s']} → {result['matches_per_s']}/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run")
+    parser.add_argument("--messages", type=int, default=5, help="chat messages per funnel")
+    parser.add_argument("--url", help="target server (default: start the app in-process)")
+    parser.add_argument("--port", type=int, default=5090, help="port of the in-process server")
+    parser.add_argument("--out", default="loadtest_results.json", help="result file")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args()
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+
+    server = None
+    base_url = args.url
+    if not base_url:
+        server = start_local_server(args.port)
+        base_url = f"http://127.0.0.1:{args.port}"
+
+    print(f"🚀 {args.users} virtual users against {base_url} for {args.duration}s")
+    stats = Stats()
+    stop = threading.Event()
+    threads = [threading.Thread(target=virtual_user, args=(base_url, stats, args.messages, stop), daemon=True)
+               for _ in range(args.users)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+        time.sleep(0.01)
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=MATCH_TIMEOUT + 5)
+    duration = time.time() - start
+    if server:
+        server.shutdown()
+
+    config = {"users": args.users, "duration": args.duration, "messages": args.messages, "url": base_url}
+    result = summarize(stats, duration, config)
+    print_report(result, previous)
+    with open(args.out, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\n💾 Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+# match_tick.py
+"""Periodic batch pairing of the whole match queue.
+
+Every ``MATCH_TICK_INTERVAL`` seconds one tick reads the oldest
+``MATCH_TICK_BATCH`` queue rows without locking them, pairs them with
+:class:`scoring.CandidatePool`, then locks only the picked rows
+(``FOR UPDATE SKIP LOCKED``, unchanged since the snapshot) and creates the
+sessions of all pairs whose rows it got with one statement. Requests keep
+enqueueing and claiming while the plan runs. The pairing is greedy: the
+longest waiter picks its best scored partner first, then the next one, so
+long waiters are served first and each pick maximises compatibility among
+what is left. A transaction-level advisory lock makes sure only one process
+ticks at a time; the others skip.
+
+Every created session is published with ``pg_notify`` on ``MATCH_CHANNEL``
+in the same transaction; :class:`MatchListener` in each app process hands it
+to the local :class:`matchmaking.MatchEngine`, so the waiting sockets of all
+workers are woken.
+
+Enqueue still pairs instantly; the tick picks up everyone whose constraints
+relaxed while waiting and waiters from other worker processes.
+
+Runs as a daemon thread inside the app (0 turns it off) or standalone:
+
+    python match_tick.py          # loop
+    python match_tick.py --once   # one tick, prints the report
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import select
+import logging
+import threading
+
+import psycopg2
+
+from db import DATABASE_URL, get_cursor, PoolTimeout
+from cards import catalog
+from matchmaking import MATCH_CHANNEL, PROFILE_COLUMNS, PROFILE_JOINS
+from scoring import CandidatePool
+import events
+
+MATCH_TICK_INTERVAL = float(os.getenv("MATCH_TICK_INTERVAL", "0.25"))   # Sekunden
+MATCH_TICK_MAX_PICKS = int(os.getenv("MATCH_TICK_MAX_PICKS", "2000"))   # Scoring-Durchläufe pro Tick
+MATCH_TICK_BATCH = int(os.getenv("MATCH_TICK_BATCH", "2000"))    # älteste Wartende pro Tick
+TICK_LOCK_KEY = 0x6d61746368    # Advisory-Lock, nur ein Prozess tickt
+MATCH_LISTEN = os.getenv("MATCH_LISTEN", "1") == "1"     # 0: keine Tick-Matches anderer Prozesse
+
+# Ohne Sperren: Requests dürfen während des Plans weiter einreihen und claimen
+SNAPSHOT_SQL = f"""
+    SELECT {PROFILE_COLUMNS}
+    FROM match_queue q {PROFILE_JOINS}
+    ORDER BY q.enqueued_at ASC
+    LIMIT %(batch)s
+"""
+
+# Nur die geplanten Zeilen sperren, und nur, wenn sie seit dem Snapshot
+# unverändert sind (kein neues Enqueue mit anderen Merkmalen)
+LOCK_PICKED_SQL = """
+    SELECT q.user_id
+    FROM match_queue q
+    JOIN unnest(%(user_ids)s::uuid[], %(enqueued_at)s::timestamptz[]) AS s(user_id, enqueued_at)
+      ON q.user_id = s.user_id AND q.enqueued_at = s.enqueued_at
+    FOR UPDATE OF q SKIP LOCKED
+"""
+
+# Alle Paare eines Ticks in einem Statement: Queue-Zeilen löschen, Sessions
+# und Teilnehmer anlegen. Die Zeilen sind durch LOCK_PICKED_SQL schon gesperrt.
+CREATE_SESSIONS_SQL = """
+    WITH pairs AS (
+        SELECT *
+        FROM unnest(%(a)s::uuid[], %(b)s::uuid[], %(lang)s::text[],
+                    %(style)s::convo_style[], %(room_key)s::text[])
+             AS p(a, b, lang, style, room_key)
+    ), claimed AS (
+        DELETE FROM match_queue
+        WHERE user_id IN (SELECT a FROM pairs UNION ALL SELECT b FROM pairs)
+    ), sess AS (
+        INSERT INTO conversation_session (status, lang, style, ice_room_key, started_at)
+        SELECT 'initiated', lang, style, room_key, now()
+        FROM pairs
+        RETURNING id, ice_room_key
+    ), parts AS (
+        INSERT INTO session_participant (session_id, user_id, joined_at)
+        SELECT sess.id, u.user_id, now()
+        FROM sess
+        JOIN pairs ON pairs.room_key = sess.ice_room_key
+        CROSS JOIN LATERAL (VALUES (pairs.a), (pairs.b)) AS u(user_id)
+    )
+    SELECT id, ice_room_key FROM sess
+"""
+
+# Zugestellt erst mit dem Commit, also nie vor der Session selbst
+NOTIFY_MATCHES_SQL = "SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload"
+
+
+def plan_pairs(rows, now=None, max_picks=MATCH_TICK_MAX_PICKS):
+    """Greedy pairing of snapshot ``rows`` (oldest first): ``[(row_a, row_b, score)]``."""
+    pool = CandidatePool(capacity=max(len(rows), 1))
+    by_id = {}
+    for row in rows:
+        user_id = str(row["user_id"])
+        by_id[user_id] = row
+        pool.add(user_id, row)
+
+    pairs = []
+    picks = 0
+    for user_id in list(by_id):
+        if picks >= max_picks or len(pool) < 2:
+            break
+        if user_id not in pool:
+            continue
+        picks += 1
+        best = pool.best(user_id, now=now)
+        if best is None:
+            continue
+        partner, score = best
+        pool.remove(user_id)
+        pool.remove(partner)
+        pairs.append((by_id[user_id], by_id[partner], score))
+    return pairs
+
+
+class MatchTicker:
+    def __init__(self, engine=None):
+        self.engine = engine
+        self.ticks = 0
+        self.skipped = 0            # Tick lief schon in einem anderen Prozess
+        self.pairs = 0
+        self.max_tick_ms = 0.0
+        self.last_report = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        """One tick. Returns a report dict, or None if another process holds the tick."""
+        start = time.time()
+        with get_cursor(commit=True) as cur:
+            cur.execute("SELECT pg_try_advisory_xact_lock(%s) AS leader", (TICK_LOCK_KEY,))
+            if not cur.fetchone()["leader"]:
+                self.skipped += 1
+                return None
+            cur.execute(SNAPSHOT_SQL, {"batch": MATCH_TICK_BATCH})
+            rows = cur.fetchall()
+            planned = time.time()
+            pairs = plan_pairs(rows)
+            plan_ms = (time.time() - planned) * 1000
+            planned_pairs = len(pairs)
+            sessions = []
+            if pairs:
+                picked = [row for a, b, _ in pairs for row in (a, b)]
+                cur.execute(LOCK_PICKED_SQL, {
+                    "user_ids": [str(row["user_id"]) for row in picked],
+                    "enqueued_at": [row["enqueued_at"] for row in picked],
+                })
+                locked = {str(row["user_id"]) for row in cur.fetchall()}
+                # Paare mit einer weggeclaimten oder geänderten Seite fallen weg
+                pairs = [(a, b, score) for a, b, score in pairs
+                         if str(a["user_id"]) in locked and str(b["user_id"]) in locked]
+            if pairs:
+                room_keys = [uuid.uuid4().hex for _ in pairs]
+                cur.execute(CREATE_SESSIONS_SQL, {
+                    "a": [str(a["user_id"]) for a, _, _ in pairs],
+                    "b": [str(b["user_id"]) for _, b, _ in pairs],
+                    "lang": [a["lang"] for a, _, _ in pairs],
+                    "style": [a["style"] for a, _, _ in pairs],
+                    "room_key": room_keys,
+                })
+                session_of = {row["ice_room_key"]: str(row["id"]) for row in cur.fetchall()}
+                for (a, b, score), room_key in zip(pairs, room_keys):
+                    user_ids = [str(a["user_id"]), str(b["user_id"])]
+                    sessions.append((session_of[room_key], room_key, user_ids, score))
+                # Alle Decks des Ticks in zwei Statements statt zwei pro Paar
+                catalog.store_decks(cur, [
+                    (session_id, a["lang"], a["style"], user_ids)
+                    for (a, _, _), (session_id, _, user_ids, _) in zip(pairs, sessions)])
+                cur.execute(NOTIFY_MATCHES_SQL, (MATCH_CHANNEL, [
+                    json.dumps({"session_id": session_id, "ice_room_key": room_key, "user_ids": user_ids})
+                    for session_id, room_key, user_ids, _ in sessions]))
+
+        for session_id, room_key, user_ids, score in sessions:
+            if self.engine is not None:
+                # Eigener Prozess sofort, die anderen über MATCH_CHANNEL
+                apply_match(self.engine, session_id, room_key, user_ids)
+            events.log("match_created", session_id=session_id, user_ids=user_ids,
+                       source="tick", score=round(score, 2))
+
+        report = {
+            "queued": len(rows),
+            "pairs": len(sessions),
+            "contended": planned_pairs - len(sessions),     # Zeilen inzwischen geclaimt/geändert
+            "plan_ms": round(plan_ms, 1),
+            "duration_ms": round((time.time() - start) * 1000, 1),
+        }
+        self.ticks += 1
+        self.pairs += report["pairs"]
+        self.max_tick_ms = max(self.max_tick_ms, report["duration_ms"])
+        self.last_report = report
+        if sessions:
+            events.log("match_tick", **report)
+        return report
+
+    # --- Thread ---
+
+    def start(self, interval=MATCH_TICK_INTERVAL):
+        if interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, args=(interval,), daemon=True, name="match-tick")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.run_once()
+            except (psycopg2.Error, PoolTimeout) as e:
+                events.log("match_tick_failed", level=logging.WARNING, error=str(e))
+
+    def stats(self):
+        return {
+            "ticks": self.ticks,
+            "skipped": self.skipped,
+            "pairs": self.pairs,
+            "pairs_per_tick": round(self.pairs / self.ticks, 2) if self.ticks else 0.0,
+            "max_tick_ms": self.max_tick_ms,
+            "last_report": self.last_report,
+        }
+
+
+def apply_match(engine, session_id, room_key, user_ids, known_only=False):
+    """Record a tick session in ``engine``, each user with the other as partner."""
+    for user_id in user_ids:
+        partner_id = next((other for other in user_ids if other != user_id), None)
+        engine.matched({"id": session_id, "ice_room_key": room_key, "partner_id": partner_id},
+                       user_id, known_only=known_only)
+
+
+class MatchListener:
+    """LISTEN on ``MATCH_CHANNEL`` and hand tick and claim sessions to the local engine.
+
+    Runs on its own autocommit connection in a daemon thread and reconnects
+    after errors. Only users this process knows are recorded (see
+    :meth:`matchmaking.MatchEngine.matched`).
+    """
+
+    def __init__(self, engine, dsn=DATABASE_URL):
+        self.engine = engine
+        self.dsn = dsn
+        self.received = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, enabled=MATCH_LISTEN):
+        if not enabled or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True, name="match-listener")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute("LISTEN " + MATCH_CHANNEL)
+                self._serve(conn)
+            except (psycopg2.Error, OSError) as e:
+                events.log("match_listener_lost", level=logging.WARNING, error=str(e))
+                self._stop.wait(1)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def _serve(self, conn):
+        while not self._stop.is_set():
+            if select.select([conn], [], [], 1.0)[0]:
+                conn.poll()
+            while conn.notifies:
+                try:
+                    self.dispatch(conn.notifies.pop(0).payload)
+                except (ValueError, KeyError) as e:
+                    events.log("match_dispatch_failed", level=logging.WARNING, error=str(e))
+
+    def dispatch(self, payload):
+        match = json.loads(payload)
+        self.received += 1
+        apply_match(self.engine, match["session_id"], match["ice_room_key"], match["user_ids"],
+                    known_only=True)
+
+
+if __name__ == "__main__":
+    ticker = MatchTicker()
+    if "--once" in sys.argv:
+        print(ticker.run_once())
+    else:
+        print(f"⏱️  Match tick every {MATCH_TICK_INTERVAL}s")
+        while True:
+            try:
+                report = ticker.run_once()
+                if report and report["pairs"]:
+                    print(f"🤝 {report['pairs']} pairs from {report['queued']} waiting "
+                          f"in {report['duration_ms']} ms")
+            except (psycopg2.Error, PoolTimeout) as e:
+                events.log("match_tick_failed", level=logging.WARNING, error=str(e))
+            time.sleep(max(MATCH_TICK_INTERVAL, 0.05))
@@ -0,0 +1,490 @@
+# matchmaking.py
+"""In-process matchmaking engine.
+
+Waiting users live in FIFO buckets keyed by ``(lang, style, mood)`` and, with
+their preferences, in a :class:`scoring.CandidatePool`. A new entry is paired
+with the best scored candidate of the whole pool (compatibility, wait time,
+constraints that relax while waiting); otherwise it waits. Queue depth per
+bucket and in total is the size of these structures, a user's position in the
+bucket comes from :class:`QueueRanks` in O(log n). ``match_queue`` stays the
+durable store: every enqueue is written there first and
+:meth:`MatchEngine.restore` rebuilds the buckets from it after a restart
+(pairing the restored users is left to the batch tick and the claim rechecks).
+
+The engine lock only guards the in-memory structures; no database round
+trip runs while it is held. Partners being claimed are reserved in memory so
+concurrent local seekers do not score them meanwhile.
+
+Sessions are only ever created through ``CLAIM_SQL``: one statement that locks
+both queue rows with ``FOR UPDATE SKIP LOCKED``, deletes them and inserts the
+session plus its participants. A user can therefore end up in at most one
+session even with several worker processes claiming concurrently. Every
+claimed session is published on ``MATCH_CHANNEL`` in the same transaction,
+like the sessions of the batch tick, so the partner's socket on another
+worker is woken without polling.
+"""
+
+import json
+import threading
+import uuid
+from collections import OrderedDict
+
+from db import get_cursor
+from cards import catalog
+import events
+from scoring import CandidatePool
+
+# Neue Sessions (Claim und Tick) für die MatchListener aller Prozesse
+MATCH_CHANNEL = "deeptalk_match"
+
+
+# Atomarer Claim: beide Queue-Zeilen sperren, löschen und Session anlegen.
+# Ohne %(partner)s wird der älteste Wartende desselben Buckets genommen,
+# mit %(partner)s genau dieser (vom Scoring gewählt, auch bucketübergreifend).
+# queued/partner_queued sehen die committeten Zeilen, seeker_held/partner_held
+# ob dieses Statement sie sperren konnte: so unterscheidet der Aufrufer
+# "weg" von "gerade von einem anderen Worker gesperrt".
+CLAIM_SQL = """
+    WITH me AS (
+        SELECT user_id, lang, style, mood
+        FROM match_queue
+        WHERE user_id = %(user_id)s
+        FOR UPDATE SKIP LOCKED
+    ), cand AS (
+        SELECT q.user_id
+        FROM match_queue q, me
+        WHERE q.user_id <> me.user_id
+          AND ((%(partner)s::uuid IS NULL
+                AND q.lang = me.lang AND q.style = me.style AND q.mood = me.mood)
+               OR q.user_id = %(partner)s::uuid)
+        ORDER BY q.enqueued_at ASC
+        LIMIT 1
+        FOR UPDATE OF q SKIP LOCKED
+    ), claimed AS (
+        DELETE FROM match_queue
+        WHERE user_id IN (SELECT user_id FROM me UNION ALL SELECT user_id FROM cand)
+          AND EXISTS (SELECT 1 FROM cand)
+        RETURNING user_id
+    ), sess AS (
+        INSERT INTO conversation_session (status, lang, style, ice_room_key, started_at)
+        SELECT 'initiated', me.lang, me.style, %(room_key)s, now()
+        FROM me, cand
+        RETURNING id, ice_room_key, lang, style
+    ), parts AS (
+        INSERT INTO session_participant (session_id, user_id, joined_at)
+        SELECT sess.id, claimed.user_id, now()
+        FROM sess, claimed
+    )
+    SELECT EXISTS (SELECT 1 FROM match_queue WHERE user_id = %(user_id)s) AS queued,
+           EXISTS (SELECT 1 FROM me) AS seeker_held,
+           EXISTS (SELECT 1 FROM match_queue WHERE user_id = %(partner)s::uuid) AS partner_queued,
+           sess.id, sess.ice_room_key, sess.lang, sess.style, cand.user_id AS partner_id
+    FROM (SELECT 1) AS one
+    LEFT JOIN sess ON true
+    LEFT JOIN cand ON true
+"""
+
+
+def claim_outcome(cur, user_id, partner_id=None):
+    """Run ``CLAIM_SQL`` for ``user_id`` and say why it did or did not match.
+
+    Returns ``(outcome, session)``. ``outcome`` is ``"matched"``,
+    ``"seeker_gone"`` / ``"seeker_locked"`` (the user's own queue row is
+    deleted / being claimed by another worker), ``"partner_gone"`` /
+    ``"partner_locked"`` for the given ``partner_id``, or ``"no_partner"``
+    when the bucket has nobody claimable. ``session`` (``id``,
+    ``ice_room_key``, ``partner_id``) is set for ``"matched"``; its card
+    deck is stored in the same transaction.
+    """
+    cur.execute(CLAIM_SQL, {"user_id": user_id, "partner": partner_id,
+                            "room_key": uuid.uuid4().hex})
+    row = cur.fetchone()
+    if row["id"] is None:
+        if not row["queued"]:
+            return "seeker_gone", None
+        if not row["seeker_held"]:
+            return "seeker_locked", None
+        if partner_id is None:
+            return "no_partner", None
+        return ("partner_locked" if row["partner_queued"] else "partner_gone"), None
+    partner_id = str(row["partner_id"])
+    catalog.store_deck(cur, row["id"], row["lang"], row["style"], [user_id, partner_id])
+    # Zustellung beim Commit; MatchListener der anderen Worker weckt deren Sockets
+    cur.execute("SELECT pg_notify(%s, %s)", (MATCH_CHANNEL, json.dumps({
+        "session_id": str(row["id"]), "ice_room_key": row["ice_room_key"],
+        "user_ids": [str(user_id), partner_id]})))
+    return "matched", {"id": str(row["id"]), "ice_room_key": row["ice_room_key"],
+                       "partner_id": partner_id}
+
+
+def claim_match(cur, user_id, partner_id=None):
+    """Run ``CLAIM_SQL`` for ``user_id``.
+
+    Returns ``(queued, session)``: whether the user still has a committed queue
+    row, and the created session (``id``, ``ice_room_key``, ``partner_id``) or
+    None if no partner could be claimed.
+    """
+    outcome, session = claim_outcome(cur, user_id, partner_id)
+    return outcome != "seeker_gone", session
+
+
+# Queue-Zeile plus alles, was das Scoring über den User wissen muss
+PROFILE_COLUMNS = """
+    q.user_id, q.enqueued_at, q.mood, q.style, q.lang, u.birth_year,
+    p.preferred_style, p.preferred_lang, p.min_age, p.max_age
+"""
+PROFILE_JOINS = """
+    JOIN app_user u ON u.id = q.user_id
+    LEFT JOIN user_preferences p ON p.user_id = q.user_id
+"""
+
+ENQUEUE_SQL = f"""
+    WITH q AS (
+        INSERT INTO match_queue(user_id, mood, style, lang)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (user_id) DO UPDATE SET
+            mood=EXCLUDED.mood,
+            style=EXCLUDED.style,
+            lang=EXCLUDED.lang,
+            enqueued_at=now()
+        RETURNING *
+    )
+    SELECT {PROFILE_COLUMNS} FROM q {PROFILE_JOINS}
+"""
+
+RESTORE_SQL = f"""
+    SELECT {PROFILE_COLUMNS} FROM match_queue q {PROFILE_JOINS}
+    ORDER BY q.enqueued_at ASC
+"""
+
+
+def bucket_key(lang, style, mood):
+    return (lang or "de", style or "deep", mood or "neutral")
+
+
+class QueueRanks:
+    """FIFO positions of one bucket in O(log n).
+
+    Every entry gets an increasing ticket; a Fenwick tree over the tickets
+    counts the entries still waiting, so a user's position is the prefix sum
+    up to their ticket. Removing from the middle (claims by other workers,
+    reaper) is O(log n) as well. Tickets are renumbered when they run out.
+    """
+
+    def __init__(self, capacity=64):
+        self._tree = [0] * (capacity + 1)
+        self._ticket = {}       # user_id -> Ticket
+        self._next = 1
+
+    def __len__(self):
+        return len(self._ticket)
+
+    def add(self, user_id):
+        if user_id in self._ticket:
+            return
+        if self._next >= len(self._tree):
+            self._rebuild()
+        self._ticket[user_id] = self._next
+        self._update(self._next, 1)
+        self._next += 1
+
+    def remove(self, user_id):
+        ticket = self._ticket.pop(user_id, None)
+        if ticket is not None:
+            self._update(ticket, -1)
+
+    def position(self, user_id):
+        """1-based position of ``user_id`` in the bucket, or None."""
+        ticket = self._ticket.get(user_id)
+        if ticket is None:
+            return None
+        position = 0
+        while ticket > 0:
+            position += self._tree[ticket]
+            ticket -= ticket & -ticket
+        return position
+
+    def _update(self, index, delta):
+        while index < len(self._tree):
+            self._tree[index] += delta
+            index += index & -index
+
+    def _rebuild(self):
+        # Tickets lückenlos neu vergeben; nur wachsen, wenn die Hälfte belegt ist
+        capacity = len(self._tree) - 1
+        if len(self._ticket) * 2 > capacity:
+            capacity *= 2
+        self._tree = [0] * (capacity + 1)
+        order = sorted(self._ticket, key=self._ticket.get)
+        self._ticket = {user_id: i for i, user_id in enumerate(order, 1)}
+        for index in range(1, capacity + 1):
+            if index <= len(order):
+                self._tree[index] += 1
+            parent = index + (index & -index)
+            if parent <= capacity:
+                self._tree[parent] += self._tree[index]
+        self._next = len(order) + 1
+
+
+class MatchEngine:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._buckets = {}      # (lang, style, mood) -> OrderedDict[user_id -> enqueued_at]
+        self._bucket_of = {}    # user_id -> (lang, style, mood)
+        self._ranks = {}        # (lang, style, mood) -> QueueRanks für die Warteposition
+        self._pool = CandidatePool()    # alle Wartenden mit Präferenzen fürs Scoring
+        self._assigned = {}     # user_id -> {"id": sid, "ice_room_key": room_key}
+        self._events = {}       # user_id -> {threading.Event} je wartendem WebSocket
+        self._listeners = []    # callback(user_id, assigned), z.B. für den asyncio-Server
+        self._claiming = set()  # gerade per CLAIM_SQL umworbene User, fürs Scoring gesperrt
+        self._restore_lock = threading.Lock()
+        self._restored = False
+
+    # --- Startup ---
+
+    def ensure_restored(self):
+        if not self._restored:
+            with self._restore_lock:
+                if not self._restored:
+                    self.restore()
+
+    def restore(self):
+        """Rebuild the buckets from ``match_queue`` in enqueue order.
+
+        Pairs that would have formed meanwhile are found by the next batch
+        tick or claim recheck, not here.
+        """
+        with get_cursor() as cur:
+            cur.execute(RESTORE_SQL)
+            rows = cur.fetchall()
+        with self._lock:
+            self._buckets.clear()
+            self._bucket_of.clear()
+            self._ranks.clear()
+            self._pool = CandidatePool()
+            for row in rows:
+                self._add(str(row["user_id"]), row)
+            self._restored = True
+        return len(rows)
+
+    # --- Queue ---
+
+    def enqueue(self, user_id, mood, style, lang):
+        """Persist the queue entry and pair it with the best scored candidate.
+
+        Returns the assigned session dict, or None if the user now waits.
+        """
+        self.ensure_restored()
+        with self._lock:
+            self._remove(user_id)
+            self._assigned.pop(user_id, None)
+        # Upsert und Claim in einer Transaktion: die eigene Zeile bleibt bis zum Commit gesperrt
+        with get_cursor(commit=True) as cur:
+            cur.execute(ENQUEUE_SQL, (user_id, mood, style, lang))
+            profile = cur.fetchone()
+            assigned = self._pair(cur, user_id, profile)
+        with self._lock:
+            if assigned:
+                self._assign(assigned, user_id, assigned["partner_id"])
+            elif user_id in self._assigned:
+                # Nach dem Commit schon vom Tick oder einem SQL-Claim vergeben
+                assigned = self._assigned[user_id]
+            else:
+                self._add(user_id, profile)
+            return assigned
+
+    def claim(self, user_id):
+        """Re-score a waiting user, then claim straight from ``match_queue``.
+
+        The scoring pass catches partners that became acceptable because the
+        constraints relaxed while waiting; the SQL claim finds bucket partners
+        enqueued by other worker processes. Returns ``(queued, session)`` like
+        :func:`claim_match`.
+        """
+        with self._lock:
+            scored = user_id in self._pool and user_id not in self._claiming
+            if scored:
+                self._claiming.add(user_id)
+        if scored:
+            try:
+                with get_cursor(commit=True) as cur:
+                    assigned = self._pair(cur, user_id)
+            finally:
+                with self._lock:
+                    self._claiming.discard(user_id)
+            if assigned:
+                with self._lock:
+                    self._remove(user_id)
+                    self._assign(assigned, user_id, assigned["partner_id"])
+                return False, assigned
+        with get_cursor(commit=True) as cur:
+            queued, assigned = claim_match(cur, user_id)
+        if assigned:
+            with self._lock:
+                self._remove(user_id)
+                self._remove(assigned["partner_id"])
+                self._assign(assigned, user_id, assigned["partner_id"])
+            events.log("match_created", session_id=assigned["id"], user_ids=[user_id, assigned["partner_id"]],
+                       source="claim")
+        return queued, assigned
+
+    def matched(self, assigned, *user_ids, known_only=False):
+        """Record a session created outside the engine (batch tick) for ``user_ids``.
+
+        With ``known_only`` (notifications about other processes' users) only
+        users waiting here or with a blocked match socket are recorded;
+        listeners hear about everyone. Repeats of a known session are ignored.
+        """
+        with self._lock:
+            for user_id in user_ids:
+                current = self._assigned.get(user_id)
+                if current is not None and current["id"] == assigned["id"]:
+                    continue
+                known = user_id in self._bucket_of or user_id in self._events
+                self._remove(user_id)
+                if known or not known_only:
+                    self._assign(assigned, user_id)
+                else:
+                    # z.B. asyncio-Sockets, die ihre Waiter selbst verwalten
+                    for callback in self._listeners:
+                        callback(user_id, assigned)
+
+    def expire(self, *user_ids):
+        """Drop users whose queue row was removed elsewhere (e.g. by the reaper)."""
+        with self._lock:
+            for user_id in user_ids:
+                self._remove(str(user_id))
+
+    def is_waiting(self, user_id):
+        return user_id in self._bucket_of
+
+    def total_waiting(self):
+        return len(self._bucket_of)
+
+    def queue_position(self, user_id):
+        """``(position, waiting)`` of the user in their bucket, or None if not waiting."""
+        with self._lock:
+            key = self._bucket_of.get(user_id)
+            if key is None:
+                return None
+            return self._ranks[key].position(user_id), len(self._buckets[key])
+
+    def stats(self):
+        return {"waiting": len(self._bucket_of), "buckets": len(self._buckets)}
+
+    # --- Assignments ---
+
+    def assignment(self, user_id):
+        return self._assigned.get(user_id)
+
+    def wait_for_assignment(self, user_id, timeout):
+        """Block until ``user_id`` is matched in this process or ``timeout`` passes."""
+        with self._lock:
+            assigned = self._assigned.get(user_id)
+            if assigned:
+                return assigned
+            event = threading.Event()
+            self._events.setdefault(user_id, set()).add(event)
+        try:
+            event.wait(timeout)
+            return self._assigned.get(user_id)
+        finally:
+            with self._lock:
+                # Nach Timeout oder Abbruch nicht liegen lassen
+                waiting = self._events.get(user_id)
+                if waiting is not None:
+                    waiting.discard(event)
+                    if not waiting:
+                        del self._events[user_id]
+
+    def add_listener(self, callback):
+        """Call ``callback(user_id, assigned)`` for every new assignment.
+
+        Runs with the engine lock held, so callbacks must only hand the
+        result off (e.g. ``loop.call_soon_threadsafe``) and never block.
+        """
+        with self._lock:
+            self._listeners.append(callback)
+
+    def release(self, *user_ids):
+        """Forget assignments once their session is over."""
+        with self._lock:
+            for user_id in user_ids:
+                self._assigned.pop(str(user_id), None)
+
+    def release_session(self, session_id):
+        """Forget the assignments of every participant of an ended session."""
+        session_id = str(session_id)
+        with self._lock:
+            for user_id in [user_id for user_id, assigned in self._assigned.items()
+                            if str(assigned["id"]) == session_id]:
+                del self._assigned[user_id]
+
+    # --- Pairing (takes the lock itself, never across a claim) ---
+
+    def _pair(self, cur, user_id, profile=None):
+        """Claim the best scored partner that is still claimable.
+
+        ``profile`` is the seeker's queue row for a new entry; without it the
+        seeker is scored from its row in the pool. A partner whose queue row
+        is gone is dropped from the pool; one that another worker is claiming
+        right now is only skipped for this attempt. If the seeker's own row is
+        gone or locked, the attempt stops; the next claim or tick retries.
+        Scoring runs under the lock, the claim on ``cur`` outside of it.
+        """
+        skipped = set()
+        while True:
+            with self._lock:
+                if profile is None and user_id not in self._pool:
+                    return None     # inzwischen anderweitig vergeben
+                best = self._pool.best(user_id, profile, exclude=skipped | self._claiming)
+                if best is None:
+                    return None
+                partner, score = best
+                self._claiming.add(partner)
+            outcome = None
+            try:
+                outcome, assigned = claim_outcome(cur, user_id, partner)
+            finally:
+                with self._lock:
+                    self._claiming.discard(partner)
+                    if outcome in ("matched", "partner_gone"):
+                        self._remove(partner)
+            if outcome == "matched":
+                events.log("match_created", session_id=assigned["id"], user_ids=[partner, user_id],
+                           source="scored", score=round(score, 2))
+                return assigned
+            if outcome in ("seeker_gone", "seeker_locked"):
+                return None
+            if outcome == "partner_locked":
+                skipped.add(partner)
+
+    # --- Internals (caller holds the lock) ---
+
+    def _add(self, user_id, profile):
+        key = bucket_key(profile["lang"], profile["style"], profile["mood"])
+        bucket = self._buckets.setdefault(key, OrderedDict())
+        bucket[user_id] = profile["enqueued_at"]
+        self._ranks.setdefault(key, QueueRanks()).add(user_id)
+        self._pool.add(user_id, profile)
+        self._bucket_of[user_id] = key
+
+    def _remove(self, user_id):
+        key = self._bucket_of.pop(user_id, None)
+        if key is None:
+            return
+        bucket = self._buckets[key]
+        bucket.pop(user_id, None)
+        self._ranks[key].remove(user_id)
+        self._pool.remove(user_id)
+        if not bucket:
+            del self._buckets[key]
+            del self._ranks[key]
+
+    def _assign(self, assigned, *user_ids):
+        for user_id in user_ids:
+            self._assigned[user_id] = assigned
+            for event in self._events.pop(user_id, ()):
+                event.set()
+            for callback in self._listeners:
+                callback(user_id, assigned)
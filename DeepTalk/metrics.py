@@ -0,0 +1,231 @@
+# metrics.py
+"""Request and query timing, exposed as Prometheus text on ``/metrics``.
+
+``init_app`` times every HTTP request (histogram per route and method) and
+counts the queries it ran; ``db.get_cursor`` cursors report each statement,
+which is aggregated per normalized SQL text. Other components register
+their ``stats()`` dicts as gauges via ``add_collector``.
+
+``/metrics`` is off by default (404). Set ``METRICS_TOKEN`` to allow
+requests with ``Authorization: Bearer <token>`` and/or
+``METRICS_ALLOW_NETWORKS`` (comma separated, e.g. ``127.0.0.1/32,10.0.0.0/8``)
+to allow scrapers by ``remote_addr``; behind a proxy that needs ``ProxyFix``.
+"""
+
+import os
+import re
+import hmac
+import time
+import ipaddress
+import threading
+from contextvars import ContextVar
+
+from flask import Response, g, request
+
+import db
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+MAX_STATEMENTS = 500    # verschiedene SQL-Texte, danach landet alles unter "other"
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+METRICS_ALLOW_NETWORKS = [ipaddress.ip_network(net.strip(), strict=False)
+                          for net in os.getenv("METRICS_ALLOW_NETWORKS", "").split(",") if net.strip()]
+
+# Queries des laufenden Requests (None außerhalb eines Requests)
+_request_queries = ContextVar("request_queries", default=None)
+
+_WHITESPACE = re.compile(r"\s+")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+
+
+def normalize_sql(sql):
+    """Collapse whitespace and replace literals so equal statements group together."""
+    if isinstance(sql, bytes):
+        sql = sql.decode(errors="replace")
+    sql = _WHITESPACE.sub(" ", str(sql)).strip()
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    return sql[:300]
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {self.count}'
+        yield f"{name}_sum{{{labels}}} {self.sum:.6f}"
+        yield f"{name}_count{{{labels}}} {self.count}"
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {}       # (route, method) -> Histogram
+        self.queries = {}       # (route, method) -> Histogram der Queries pro Request
+        self.requests = {}      # (route, method, status) -> Anzahl
+        self.statements = {}    # normalisiertes SQL -> [count, total, max]
+        self.collectors = {}    # prefix -> callable, liefert ein dict
+
+    def observe_request(self, route, method, status, seconds, queries):
+        key = (route, method)
+        with self._lock:
+            if key not in self.latency:
+                self.latency[key] = Histogram(LATENCY_BUCKETS)
+                self.queries[key] = Histogram(QUERY_COUNT_BUCKETS)
+            self.latency[key].observe(seconds)
+            self.queries[key].observe(queries)
+            status_key = (route, method, status)
+            self.requests[status_key] = self.requests.get(status_key, 0) + 1
+
+    def observe_query(self, sql, seconds):
+        counter = _request_queries.get()
+        if counter is not None:
+            counter[0] += 1
+        statement = normalize_sql(sql)
+        with self._lock:
+            entry = self.statements.get(statement)
+            if entry is None:
+                if len(self.statements) >= MAX_STATEMENTS:
+                    statement = "other"
+                entry = self.statements.setdefault(statement, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+            if seconds > entry[2]:
+                entry[2] = seconds
+
+    def add_collector(self, prefix, collect):
+        self.collectors[prefix] = collect
+
+    def render(self):
+        out = []
+        with self._lock:
+            out.append("# HELP deeptalk_request_duration_seconds HTTP request latency by route.")
+            out.append("# TYPE deeptalk_request_duration_seconds histogram")
+            for (route, method), hist in sorted(self.latency.items()):
+                out.extend(hist.lines("deeptalk_request_duration_seconds",
+                                      f'route="{_escape(route)}",method="{method}"'))
+
+            out.append("# HELP deeptalk_request_queries Database queries per HTTP request.")
+            out.append("# TYPE deeptalk_request_queries histogram")
+            for (route, method), hist in sorted(self.queries.items()):
+                out.extend(hist.lines("deeptalk_request_queries",
+                                      f'route="{_escape(route)}",method="{method}"'))
+
+            out.append("# HELP deeptalk_requests_total HTTP requests by route and status.")
+            out.append("# TYPE deeptalk_requests_total counter")
+            for (route, method, status), count in sorted(self.requests.items()):
+                out.append(f'deeptalk_requests_total{{route="{_escape(route)}",method="{method}",'
+                           f'status="{status}"}} {count}')
+
+            statements = sorted(self.statements.items(), key=lambda item: -item[1][1])
+            out.append("# HELP deeptalk_query_duration_seconds Time spent per normalized SQL statement.")
+            out.append("# TYPE deeptalk_query_duration_seconds summary")
+            for sql, (count, total, _) in statements:
+                label = f'statement="{_escape(sql)}"'
+                out.append(f"deeptalk_query_duration_seconds_sum{{{label}}} {total:.6f}")
+                out.append(f"deeptalk_query_duration_seconds_count{{{label}}} {count}")
+            out.append("# HELP deeptalk_query_duration_max_seconds Slowest run per normalized SQL statement.")
+            out.append("# TYPE deeptalk_query_duration_max_seconds gauge")
+            for sql, (_, _, slowest) in statements:
+                out.append(f'deeptalk_query_duration_max_seconds{{statement="{_escape(sql)}"}} {slowest:.6f}')
+
+            collectors = list(self.collectors.items())
+
+        for prefix, collect in collectors:
+            try:
+                values = collect()
+            except Exception:
+                continue
+            for key, value in sorted(values.items()):
+                # Nur Zahlen als Gauges; verschachtelte Werte (z.B. last_report) überspringen
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                out.append(f"deeptalk_{prefix}_{key} {value}")
+        return "\n".join(out) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+registry = Metrics()
+db.add_query_observer(registry.observe_query)
+
+
+def add_collector(prefix, collect):
+    """Expose the numeric values of ``collect()`` as ``deeptalk_<prefix>_<key>`` gauges."""
+    registry.add_collector(prefix, collect)
+
+
+def metrics_allowed(authorization, remote_addr, token=None, networks=None):
+    """Whether a request with this Authorization header and address may scrape."""
+    token = METRICS_TOKEN if token is None else token
+    networks = METRICS_ALLOW_NETWORKS if networks is None else networks
+    if token and hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode()):
+        return True
+    try:
+        address = ipaddress.ip_address(remote_addr or "")
+    except ValueError:
+        return False
+    return any(address in network for network in networks)
+
+
+def init_app(app):
+    """Register the timing hooks and the ``/metrics`` route on ``app``."""
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = [0]
+        g.metrics_token = _request_queries.set(g.metrics_queries)
+
+    def _record(status):
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return
+        _request_queries.reset(g.pop("metrics_token"))
+        rule = request.url_rule.rule if request.url_rule else "<unmatched>"
+        # WebSockets laufen so lange wie die Verbindung, die zählen nicht als Request
+        if rule.startswith("/ws/"):
+            return
+        registry.observe_request(rule, request.method, status,
+                                 time.perf_counter() - start, g.metrics_queries[0])
+
+    @app.after_request
+    def _stop_timer(response):
+        _record(response.status_code)
+        return response
+
+    @app.teardown_request
+    def _record_failure(exc):
+        # Nur wenn after_request nicht lief (unbehandelte Exception)
+        _record(500)
+
+    @app.get("/metrics")
+    def metrics():
+        if not METRICS_TOKEN and not METRICS_ALLOW_NETWORKS:
+            # Nicht konfiguriert: Endpunkt gibt es nicht
+            return Response("not found\n", status=404, mimetype="text/plain")
+        if not metrics_allowed(request.headers.get("Authorization", ""), request.remote_addr):
+            return Response("unauthorized\n", status=401, mimetype="text/plain")
+        return Response(registry.render(), mimetype="text/plain; version=0.0.4")
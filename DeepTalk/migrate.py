@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""Apply versioned migrations from ``migrations/``.
+
+Files are named ``NNN_description.sql`` and applied once, in order; applied
+versions are recorded in ``schema_migration``. Every statement runs on its
+own in autocommit mode so ``CREATE INDEX CONCURRENTLY`` works.
+
+    python migrate.py            # apply pending migrations
+    python migrate.py --status   # list applied / pending
+"""
+
+import os
+import re
+import sys
+import time
+
+import psycopg2
+import psycopg2.extras
+
+from db import DATABASE_URL
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+MIGRATION_FILE = re.compile(r"^(\d+)_[\w-]+\.sql$")
+
+
+def available_migrations():
+    """Return ``[(version, filename)]`` sorted by version."""
+    migrations = []
+    for name in os.listdir(MIGRATIONS_DIR):
+        match = MIGRATION_FILE.match(name)
+        if match:
+            migrations.append((int(match.group(1)), name))
+    return sorted(migrations)
+
+
+def split_statements(sql):
+    """Split a migration file on ``;``, keeping ``$$ ... $$`` bodies together."""
+    statements, current, in_dollar = [], [], False
+    for line in sql.splitlines():
+        if not in_dollar and line.strip().startswith("--"):
+            continue
+        current.append(line)
+        if line.count("$$") % 2:
+            in_dollar = not in_dollar
+        if not in_dollar and line.rstrip().endswith(";"):
+            statement = "\n".join(current).strip()
+            if statement.rstrip(";").strip():
+                statements.append(statement)
+            current = []
+    if "\n".join(current).strip():
+        statements.append("\n".join(current).strip())
+    return statements
+
+
+def applied_versions(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migration (
+            version INT PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
+    cur.execute("SELECT version FROM schema_migration")
+    return {row["version"] for row in cur.fetchall()}
+
+
+def migrate(dsn=DATABASE_URL):
+    """Apply all pending migrations. Returns the list of applied filenames."""
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    done = []
+    try:
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            applied = applied_versions(cur)
+            for version, name in available_migrations():
+                if version in applied:
+                    continue
+                with open(os.path.join(MIGRATIONS_DIR, name), encoding="utf-8") as f:
+                    statements = split_statements(f.read())
+                start = time.time()
+                print(f"🔧 Applying {name} ({len(statements)} statements)")
+                for statement in statements:
+                    try:
+                        cur.execute(statement)
+                    except psycopg2.Error:
+                        # Abgebrochenes CONCURRENTLY hinterlässt einen INVALID-Index, den
+                        # IF NOT EXISTS danach überspringt -> vor erneutem Lauf droppen
+                        print(f"❌ Failed in {name}:\n{statement}")
+                        raise
+                cur.execute("INSERT INTO schema_migration (version, name) VALUES (%s, %s)",
+                            (version, name))
+                print(f"✅ {name} applied in {time.time() - start:.1f}s")
+                done.append(name)
+    finally:
+        conn.close()
+    return done
+
+
+def status(dsn=DATABASE_URL):
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    try:
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            applied = applied_versions(cur)
+    finally:
+        conn.close()
+    for version, name in available_migrations():
+        print(f"{'✅' if version in applied else '⏳'} {name}")
+
+
+if __name__ == "__main__":
+    if "--status" in sys.argv:
+        status()
+    else:
+        applied = migrate()
+        if not applied:
+            print("✅ Database is up to date")
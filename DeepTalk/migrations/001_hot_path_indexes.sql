@@ -0,0 +1,24 @@
+-- 001: Indizes für die heißen Abfragen in app.py / matchmaking.py / reaper.py
+-- CONCURRENTLY blockiert keine Schreibzugriffe, darf aber nicht in einer
+-- Transaktion laufen (migrate.py führt jedes Statement einzeln aus).
+
+-- Offene Session eines Users (index(), match())
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_session_participant_user
+    ON session_participant(user_id);
+
+-- Monitore und Reaper (offene Sessions nach Alter)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_conversation_session_status_created
+    ON conversation_session(status, created_at);
+
+-- Reaper, Restore und Monitore (älteste Wartende)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_match_queue_enqueued
+    ON match_queue(enqueued_at);
+
+-- Kandidatensuche in CLAIM_SQL: gleicher Bucket, ältester zuerst
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_match_queue_bucket
+    ON match_queue(lang, style, mood, enqueued_at);
+
+-- Ungelesene Nachrichten (als gelesen markieren, unread_count neu berechnen)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_chat_message_unread
+    ON chat_message(connection_id, sender_id)
+    WHERE read_at IS NULL;
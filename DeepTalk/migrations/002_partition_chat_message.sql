@@ -0,0 +1,104 @@
+-- 002: chat_message nach Monaten partitionieren (RANGE auf sent_at)
+-- Alte Monate lassen sich dann als Ganzes archivieren und droppen
+-- (chat_archive.py), VACUUM und Indexpflege betreffen nur die aktiven Monate.
+--
+-- Die Umstellung läuft als ein DO-Block, also in einer Transaktion: alte
+-- Tabelle sperren, Partitionen anlegen, Daten kopieren, Tabelle tauschen.
+-- chat_message ist währenddessen gesperrt, bei großen Tabellen also in einem
+-- Wartungsfenster laufen lassen.
+
+-- Monatspartitionen chat_message_yYYYYmMM von from_month bis months_ahead
+-- Monate in die Zukunft; vorhandene werden übersprungen.
+CREATE OR REPLACE FUNCTION ensure_chat_message_partitions(from_month DATE, months_ahead INT)
+RETURNS INT LANGUAGE plpgsql AS $$
+DECLARE
+    month DATE := date_trunc('month', from_month)::date;
+    last_month DATE := (date_trunc('month', now()) + make_interval(months => months_ahead))::date;
+    part_name TEXT;
+    created INT := 0;
+BEGIN
+    WHILE month <= last_month LOOP
+        part_name := format('chat_message_y%sm%s', to_char(month, 'YYYY'), to_char(month, 'MM'));
+        IF to_regclass(part_name) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I PARTITION OF chat_message FOR VALUES FROM (%L) TO (%L)',
+                           part_name, month, (month + interval '1 month')::date);
+            created := created + 1;
+        END IF;
+        month := (month + interval '1 month')::date;
+    END LOOP;
+    RETURN created;
+END;
+$$;
+
+DO $$
+DECLARE
+    first_month DATE;
+    copied BIGINT;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'chat_message'::regclass) = 'p' THEN
+        RETURN;
+    END IF;
+
+    LOCK TABLE chat_message IN ACCESS EXCLUSIVE MODE;
+    ALTER TABLE chat_message RENAME TO chat_message_unpartitioned;
+    ALTER TABLE chat_message_unpartitioned RENAME CONSTRAINT chat_message_pkey TO chat_message_unpartitioned_pkey;
+
+    -- Primärschlüssel muss den Partitionsschlüssel enthalten; id kommt weiter
+    -- aus derselben Sequenz
+    CREATE TABLE chat_message (
+        id BIGINT NOT NULL DEFAULT nextval('chat_message_id_seq'),
+        connection_id BIGINT NOT NULL,
+        sender_id UUID NOT NULL,
+        message TEXT NOT NULL,
+        sent_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        read_at TIMESTAMPTZ,
+        CONSTRAINT chat_message_pkey PRIMARY KEY (id, sent_at),
+        CONSTRAINT chat_message_connection_id_fkey FOREIGN KEY (connection_id)
+            REFERENCES user_connection(id) ON DELETE CASCADE,
+        CONSTRAINT chat_message_sender_id_fkey FOREIGN KEY (sender_id)
+            REFERENCES app_user(id) ON DELETE CASCADE
+    ) PARTITION BY RANGE (sent_at);
+
+    -- Fängt alles außerhalb der Monatspartitionen auf (z.B. wiederhergestellte
+    -- Nachrichten aus archivierten Monaten)
+    CREATE TABLE chat_message_default PARTITION OF chat_message DEFAULT;
+
+    SELECT COALESCE(min(sent_at), now())::date INTO first_month FROM chat_message_unpartitioned;
+    PERFORM ensure_chat_message_partitions(first_month, 3);
+
+    INSERT INTO chat_message (id, connection_id, sender_id, message, sent_at, read_at)
+    SELECT id, connection_id, sender_id, message, sent_at, read_at FROM chat_message_unpartitioned;
+    GET DIAGNOSTICS copied = ROW_COUNT;
+    IF copied <> (SELECT count(*) FROM chat_message_unpartitioned) THEN
+        RAISE EXCEPTION 'chat_message copy incomplete: % rows', copied;
+    END IF;
+
+    ALTER SEQUENCE chat_message_id_seq OWNED BY chat_message.id;
+    DROP TABLE chat_message_unpartitioned;
+END;
+$$;
+
+-- Indizes auf der Elterntabelle gelten für alle (auch künftige) Partitionen
+CREATE INDEX IF NOT EXISTS idx_chat_message_connection ON chat_message(connection_id, sent_at);
+CREATE INDEX IF NOT EXISTS idx_chat_message_sender ON chat_message(sender_id);
+CREATE INDEX IF NOT EXISTS idx_chat_message_unread
+    ON chat_message(connection_id, sender_id)
+    WHERE read_at IS NULL;
+
+-- Archivierte Monate (chat_archive.py) und welche Verbindungen darin vorkommen
+CREATE TABLE IF NOT EXISTS chat_message_archive (
+    partition_name TEXT PRIMARY KEY,
+    range_start TIMESTAMPTZ NOT NULL,
+    range_end TIMESTAMPTZ NOT NULL,
+    file TEXT NOT NULL,
+    messages BIGINT NOT NULL,
+    archived_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS chat_message_archive_connection (
+    partition_name TEXT NOT NULL REFERENCES chat_message_archive(partition_name) ON DELETE CASCADE,
+    connection_id BIGINT NOT NULL,
+    messages INT NOT NULL,
+    restored_at TIMESTAMPTZ,
+    PRIMARY KEY (connection_id, partition_name)
+);
@@ -0,0 +1,16 @@
+-- 003: Idempotenz-Schlüssel für POST /chat/<id>/messages (Batch-Senden)
+-- Der Client vergibt pro Nachricht einen Schlüssel; ein erneut gesendeter
+-- Batch nach Netzabbruch legt bereits gespeicherte Nachrichten nicht doppelt an.
+-- Eigene Tabelle, weil ein UNIQUE-Index auf dem partitionierten chat_message
+-- sent_at enthalten müsste. Der Reaper löscht Schlüssel nach CHAT_KEY_MAX_AGE.
+
+CREATE TABLE IF NOT EXISTS chat_message_key (
+    connection_id BIGINT NOT NULL REFERENCES user_connection(id) ON DELETE CASCADE,
+    sender_id UUID NOT NULL,
+    client_key TEXT NOT NULL,
+    message_id BIGINT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (connection_id, sender_id, client_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_chat_message_key_created ON chat_message_key(created_at);
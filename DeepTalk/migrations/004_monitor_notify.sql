@@ -0,0 +1,53 @@
+-- 004: Änderungs-Events für monitor_matching.py
+-- match_queue, conversation_session und session_participant melden jede
+-- Änderung per NOTIFY auf 'deeptalk_monitor'. Der Monitor hält daraus seine
+-- Zahlen im Speicher und muss die Tabellen nicht mehr abfragen. Ein NOTIFY
+-- pro Zeile ist auch ohne Listener nicht umsonst (Notify-Queue, globale Sperre
+-- beim Commit); 006 ersetzt diese Trigger durch Statement-Trigger.
+
+CREATE OR REPLACE FUNCTION notify_monitor_queue() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('deeptalk_monitor', json_build_object(
+            'kind', 'dequeue', 'user_id', OLD.user_id, 'enqueued_at', OLD.enqueued_at, 'at', now())::text);
+        RETURN OLD;
+    END IF;
+    PERFORM pg_notify('deeptalk_monitor', json_build_object(
+        'kind', 'enqueue', 'user_id', NEW.user_id, 'lang', NEW.lang, 'style', NEW.style,
+        'mood', NEW.mood, 'enqueued_at', NEW.enqueued_at, 'at', now())::text);
+    RETURN NEW;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION notify_monitor_session() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.status = NEW.status THEN
+        RETURN NEW;
+    END IF;
+    PERFORM pg_notify('deeptalk_monitor', json_build_object(
+        'kind', 'session', 'id', NEW.id,
+        'old_status', CASE WHEN TG_OP = 'UPDATE' THEN OLD.status END,
+        'status', NEW.status, 'at', now())::text);
+    RETURN NEW;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION notify_monitor_participant() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_notify('deeptalk_monitor', json_build_object(
+        'kind', 'participant', 'session_id', NEW.session_id, 'user_id', NEW.user_id, 'at', now())::text);
+    RETURN NEW;
+END;
+$$;
+
+CREATE OR REPLACE TRIGGER match_queue_monitor
+    AFTER INSERT OR UPDATE OR DELETE ON match_queue
+    FOR EACH ROW EXECUTE FUNCTION notify_monitor_queue();
+
+CREATE OR REPLACE TRIGGER conversation_session_monitor
+    AFTER INSERT OR UPDATE OF status ON conversation_session
+    FOR EACH ROW EXECUTE FUNCTION notify_monitor_session();
+
+CREATE OR REPLACE TRIGGER session_participant_monitor
+    AFTER INSERT ON session_participant
+    FOR EACH ROW EXECUTE FUNCTION notify_monitor_participant();
@@ -0,0 +1,16 @@
+-- 005: Letzte Aktivität einer Session
+-- Die Session-Seite meldet sich per Heartbeat (POST /session/<id>/heartbeat).
+-- Der Reaper beendet Sessions erst, wenn dieser länger als SESSION_MAX_AGE
+-- ausbleibt, statt laufende Gespräche nach fester Dauer abzubrechen;
+-- index()/match() leiten nur auf Sessions mit frischer Aktivität um.
+
+ALTER TABLE conversation_session
+    ADD COLUMN IF NOT EXISTS last_activity TIMESTAMPTZ NOT NULL DEFAULT now();
+
+-- Offene Sessions von vor der Migration: Aktivität ab Start bzw. Anlage
+UPDATE conversation_session
+SET last_activity = COALESCE(started_at, created_at)
+WHERE ended_at IS NULL AND last_activity > COALESCE(started_at, created_at);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_conversation_session_open_activity
+    ON conversation_session(status, last_activity) WHERE ended_at IS NULL;
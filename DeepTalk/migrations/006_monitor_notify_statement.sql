@@ -0,0 +1,130 @@
+-- 006: Monitor-Events pro Statement statt pro Zeile
+-- 004 hat für jede geänderte Zeile ein eigenes pg_notify abgesetzt. Das ist
+-- nicht gratis: jedes NOTIFY landet in der Notify-Queue der Transaktion, wird
+-- beim Commit gegen Duplikate geprüft und unter einer globalen Sperre
+-- eingereiht, die alle committenden Transaktionen mit NOTIFY serialisiert.
+-- Ein Match-Tick über 200 Wartende erzeugte so rund 600 Events in einem Commit.
+-- Jetzt fasst ein Statement-Trigger die Transition Table zu einem Payload
+-- {"kind", "at", "rows": [...]} zusammen, in Stücken zu 40 Zeilen, damit die
+-- 8000-Byte-Grenze von NOTIFY hält. Transition Tables erlauben nur ein Event
+-- pro Trigger und keine Spaltenliste, daher je Event ein eigener Trigger; der
+-- UPDATE-Trigger auf conversation_session läuft deshalb auch beim Heartbeat,
+-- findet dort aber keine Statusänderung und sendet nichts.
+
+CREATE OR REPLACE FUNCTION monitor_queue_changes() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    payload text;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        FOR payload IN
+            SELECT json_build_object('kind', 'dequeue', 'at', now(), 'rows', json_agg(json_build_object(
+                'user_id', user_id, 'enqueued_at', enqueued_at)))::text
+            FROM (SELECT *, (row_number() OVER () - 1) / 40 AS chunk FROM changed) c
+            GROUP BY chunk
+        LOOP
+            PERFORM pg_notify('deeptalk_monitor', payload);
+        END LOOP;
+    ELSE
+        FOR payload IN
+            SELECT json_build_object('kind', 'enqueue', 'at', now(), 'rows', json_agg(json_build_object(
+                'user_id', user_id, 'lang', lang, 'style', style, 'mood', mood,
+                'enqueued_at', enqueued_at)))::text
+            FROM (SELECT *, (row_number() OVER () - 1) / 40 AS chunk FROM changed) c
+            GROUP BY chunk
+        LOOP
+            PERFORM pg_notify('deeptalk_monitor', payload);
+        END LOOP;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION monitor_session_changes() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    payload text;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        FOR payload IN
+            SELECT json_build_object('kind', 'session', 'at', now(), 'rows', json_agg(json_build_object(
+                'id', id, 'old_status', NULL, 'status', status)))::text
+            FROM (SELECT *, (row_number() OVER () - 1) / 40 AS chunk FROM new_rows) c
+            GROUP BY chunk
+        LOOP
+            PERFORM pg_notify('deeptalk_monitor', payload);
+        END LOOP;
+    ELSE
+        -- Nur echte Statuswechsel, nicht last_activity vom Heartbeat
+        FOR payload IN
+            SELECT json_build_object('kind', 'session', 'at', now(), 'rows', json_agg(json_build_object(
+                'id', id, 'old_status', old_status, 'status', status)))::text
+            FROM (
+                SELECT n.id, o.status AS old_status, n.status,
+                       (row_number() OVER () - 1) / 40 AS chunk
+                FROM new_rows n
+                JOIN old_rows o ON o.id = n.id
+                WHERE o.status IS DISTINCT FROM n.status
+            ) c
+            GROUP BY chunk
+        LOOP
+            PERFORM pg_notify('deeptalk_monitor', payload);
+        END LOOP;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION monitor_participant_changes() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    payload text;
+BEGIN
+    FOR payload IN
+        SELECT json_build_object('kind', 'participant', 'at', now(), 'rows', json_agg(json_build_object(
+            'session_id', session_id, 'user_id', user_id)))::text
+        FROM (SELECT *, (row_number() OVER () - 1) / 40 AS chunk FROM new_rows) c
+        GROUP BY chunk
+    LOOP
+        PERFORM pg_notify('deeptalk_monitor', payload);
+    END LOOP;
+    RETURN NULL;
+END;
+$$;
+
+-- Erst die neuen Trigger anlegen, dann die alten entfernen: dazwischen kommen
+-- Events höchstens doppelt an, gehen aber nicht verloren
+CREATE OR REPLACE TRIGGER match_queue_monitor_insert
+    AFTER INSERT ON match_queue
+    REFERENCING NEW TABLE AS changed
+    FOR EACH STATEMENT EXECUTE FUNCTION monitor_queue_changes();
+
+CREATE OR REPLACE TRIGGER match_queue_monitor_update
+    AFTER UPDATE ON match_queue
+    REFERENCING NEW TABLE AS changed
+    FOR EACH STATEMENT EXECUTE FUNCTION monitor_queue_changes();
+
+CREATE OR REPLACE TRIGGER match_queue_monitor_delete
+    AFTER DELETE ON match_queue
+    REFERENCING OLD TABLE AS changed
+    FOR EACH STATEMENT EXECUTE FUNCTION monitor_queue_changes();
+
+CREATE OR REPLACE TRIGGER conversation_session_monitor_insert
+    AFTER INSERT ON conversation_session
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION monitor_session_changes();
+
+CREATE OR REPLACE TRIGGER conversation_session_monitor_update
+    AFTER UPDATE ON conversation_session
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION monitor_session_changes();
+
+CREATE OR REPLACE TRIGGER session_participant_monitor_insert
+    AFTER INSERT ON session_participant
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION monitor_participant_changes();
+
+DROP TRIGGER IF EXISTS match_queue_monitor ON match_queue;
+DROP TRIGGER IF EXISTS conversation_session_monitor ON conversation_session;
+DROP TRIGGER IF EXISTS session_participant_monitor ON session_participant;
+
+DROP FUNCTION IF EXISTS notify_monitor_queue();
+DROP FUNCTION IF EXISTS notify_monitor_session();
+DROP FUNCTION IF EXISTS notify_monitor_participant();
@@ -1,50 +1,240 @@
 #!/usr/bin/env python3
-"""Real-time monitoring of the matching system."""
+"""Real-time monitoring of the matching system.
 
+Listens on the ``deeptalk_monitor`` channel (statement triggers from
+``migrations/006_monitor_notify_statement.sql``, one payload with all rows
+of a statement) and keeps its numbers in memory:
+queue depth per (lang, style, mood), matches per minute, wait-time
+percentiles of the recent matches and open sessions by status. The
+database is only read once at start (and after a reconnect) for the
+current state; after that every change arrives as an event, so a refresh
+costs the same no matter how long the queue is.
+
+    python monitor_matching.py                # Statuszeile alle 2 Sekunden
+    python monitor_matching.py --buckets      # plus Warteschlange pro Bucket
+    python monitor_matching.py --json         # eine JSON-Zeile pro Refresh
+"""
+
+import os
 import sys
+import json
 import time
-sys.path.insert(0, '/home/tim/DeepTalk')
-
-from db import get_cursor
+import select
+import argparse
+from collections import Counter, deque
 from datetime import datetime
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import psycopg2
+import psycopg2.extras
+
+from db import DATABASE_URL
+
+CHANNEL = "deeptalk_monitor"
+OPEN_STATUSES = ("initiated", "connecting", "connected")
+RATE_WINDOW = 60        # Sekunden für Matches/Minute und beendete Sessions
+WAIT_WINDOW = 300       # Sekunden, über die die Wartezeit-Perzentile laufen
+WAIT_SAMPLES = 2000     # obere Grenze für die Perzentil-Stichprobe
+MATCH_GRACE = 10        # Sekunden, in denen ein Dequeue noch einer Session zugeordnet wird
+
+QUEUE_SNAPSHOT_SQL = "SELECT user_id, lang, style, mood, enqueued_at FROM match_queue"
+SESSION_SNAPSHOT_SQL = """
+    SELECT id, status FROM conversation_session
+    WHERE status = ANY(%s::session_status[]) AND ended_at IS NULL
+"""
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class MatchMonitor:
+    """Rolling aggregates over the change events; every event is O(1)."""
+
+    def __init__(self):
+        self.waiting = {}               # user_id -> bucket
+        self.depth = Counter()          # bucket -> Wartende
+        self.sessions = {}              # session_id -> offener Status
+        self.open_by_status = Counter()
+        self.matches = deque()          # monotonic je neuer Session
+        self.closed = deque()           # (monotonic, status) je beendeter Session
+        self.waits = deque(maxlen=WAIT_SAMPLES)     # (monotonic, Sekunden) je gematchtem User
+        self._dequeued = {}             # user_id -> (monotonic, Wartezeit), bis die Session kommt
+        self.events = 0
+
+    # --- Zustand ---
+
+    def load(self, cur):
+        """Replace the state with a snapshot of match_queue and the open sessions."""
+        self.waiting.clear()
+        self.depth.clear()
+        self.sessions.clear()
+        self.open_by_status.clear()
+        cur.execute(QUEUE_SNAPSHOT_SQL)
+        for row in cur.fetchall():
+            self._enqueue(str(row["user_id"]), (row["lang"], row["style"], row["mood"]))
+        cur.execute(SESSION_SNAPSHOT_SQL, (list(OPEN_STATUSES),))
+        for row in cur.fetchall():
+            self._set_status(str(row["id"]), row["status"])
+
+    def _enqueue(self, user_id, bucket):
+        self._dequeue(user_id)
+        self.waiting[user_id] = bucket
+        self.depth[bucket] += 1
+
+    def _dequeue(self, user_id):
+        bucket = self.waiting.pop(user_id, None)
+        if bucket is not None:
+            self.depth[bucket] -= 1
+            if not self.depth[bucket]:
+                del self.depth[bucket]
+        return bucket
+
+    def _set_status(self, session_id, status):
+        previous = self.sessions.pop(session_id, None)
+        if previous is not None:
+            self.open_by_status[previous] -= 1
+            if not self.open_by_status[previous]:
+                del self.open_by_status[previous]
+        if status in OPEN_STATUSES:
+            self.sessions[session_id] = status
+            self.open_by_status[status] += 1
+
+    # --- Events ---
+
+    def apply(self, event, now=None):
+        """Update the aggregates from one decoded NOTIFY payload."""
+        now = time.monotonic() if now is None else now
+        if "rows" in event:
+            # Ein Payload pro Statement: {"kind", "at", "rows": [...]}
+            for row in event["rows"]:
+                self._apply_row(dict(row, kind=event["kind"], at=event["at"]), now)
+        else:
+            # Einzelzeilen-Format der Trigger aus 004
+            self._apply_row(event, now)
+        self._expire(now)
+
+    def _apply_row(self, event, now):
+        self.events += 1
+        kind = event.get("kind")
+        if kind == "enqueue":
+            self._enqueue(event["user_id"], (event["lang"], event["style"], event["mood"]))
+        elif kind == "dequeue":
+            self._dequeue(event["user_id"])
+            # Kommt in derselben Transaktion eine Session, war das die Wartezeit bis zum Match
+            waited = (datetime.fromisoformat(event["at"])
+                      - datetime.fromisoformat(event["enqueued_at"])).total_seconds()
+            self._dequeued.pop(event["user_id"], None)
+            self._dequeued[event["user_id"]] = (now, max(waited, 0.0))
+        elif kind == "session":
+            if event.get("old_status") is None:
+                self.matches.append(now)
+            elif event["status"] not in OPEN_STATUSES:
+                self.closed.append((now, event["status"]))
+            self._set_status(event["id"], event["status"])
+        elif kind == "participant":
+            dequeued = self._dequeued.pop(event["user_id"], None)
+            if dequeued is not None:
+                self.waits.append((now, dequeued[1]))
+
+    def _expire(self, now):
+        while self.matches and self.matches[0] < now - RATE_WINDOW:
+            self.matches.popleft()
+        while self.closed and self.closed[0][0] < now - RATE_WINDOW:
+            self.closed.popleft()
+        while self.waits and self.waits[0][0] < now - WAIT_WINDOW:
+            self.waits.popleft()
+        # Dequeues ohne Session (Reaper, Abbruch) nach MATCH_GRACE vergessen
+        while self._dequeued:
+            user_id, (at, _) = next(iter(self._dequeued.items()))
+            if at >= now - MATCH_GRACE:
+                break
+            del self._dequeued[user_id]
+
+    def stats(self, now=None):
+        now = time.monotonic() if now is None else now
+        self._expire(now)
+        waits = sorted(seconds for _, seconds in self.waits)
+        return {
+            "queue": len(self.waiting),
+            "buckets": {"/".join(bucket): n for bucket, n in self.depth.most_common()},
+            "matches_per_min": round(len(self.matches) * 60 / RATE_WINDOW, 1),
+            "wait_p50_s": percentile(waits, 50),
+            "wait_p95_s": percentile(waits, 95),
+            "wait_p99_s": percentile(waits, 99),
+            "wait_samples": len(waits),
+            "sessions": {status: self.open_by_status.get(status, 0) for status in OPEN_STATUSES},
+            "closed_per_min": dict(Counter(status for _, status in self.closed)),
+            "events": self.events,
+        }
+
+
+def _seconds(value):
+    return "-" if value is None else f"{value:.1f}s"
+
+
+def format_line(stats, buckets=False):
+    sessions = ", ".join(f"{status} {n}" for status, n in stats["sessions"].items())
+    line = (f"⏱️  {datetime.now():%H:%M:%S} | Queue: {stats['queue']} | "
+            f"Matches/min: {stats['matches_per_min']} | "
+            f"Wait p50/p95/p99: {_seconds(stats['wait_p50_s'])}/{_seconds(stats['wait_p95_s'])}/"
+            f"{_seconds(stats['wait_p99_s'])} | Sessions: {sessions}")
+    if buckets and stats["buckets"]:
+        line += "\n    " + "  ".join(f"{bucket}: {n}" for bucket, n in stats["buckets"].items())
+    return line
+
+
+def listen(monitor, dsn=DATABASE_URL, interval=2.0, on_refresh=print):
+    """LISTEN, load the snapshot, then apply events and refresh every ``interval`` seconds."""
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(dsn)
+            conn.autocommit = True
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                # Erst LISTEN, dann Snapshot: nichts geht dazwischen verloren,
+                # doppelt ankommende Events ändern den Zustand nicht
+                cur.execute("LISTEN " + CHANNEL)
+                monitor.load(cur)
+            next_refresh = time.monotonic()
+            while True:
+                timeout = max(next_refresh - time.monotonic(), 0)
+                if select.select([conn], [], [], timeout)[0]:
+                    conn.poll()
+                    while conn.notifies:
+                        monitor.apply(json.loads(conn.notifies.pop(0).payload))
+                if time.monotonic() >= next_refresh:
+                    on_refresh(monitor.stats())
+                    next_refresh += interval
+        except (psycopg2.Error, OSError) as e:
+            print(f"⚠️  Connection lost ({e}), reconnecting")
+            if conn is not None:
+                conn.close()
+            time.sleep(1)
+
 
 def monitor_matching():
     """Monitor the matching system in real-time."""
-    
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--interval", type=float, default=2.0, help="seconds between refreshes")
+    parser.add_argument("--buckets", action="store_true", help="show the queue per (lang, style, mood)")
+    parser.add_argument("--json", action="store_true", help="print one JSON line per refresh")
+    args = parser.parse_args()
+
     print("🔍 DeepTalk Matching Monitor")
     print("Press Ctrl+C to stop")
     print("=" * 50)
-    
+
+    def refresh(stats):
+        print(json.dumps(stats) if args.json else format_line(stats, args.buckets), flush=True)
+
     try:
-        while True:
-            with get_cursor() as cur:
-                # Check queue
-                cur.execute("SELECT COUNT(*) as count FROM match_queue;")
-                queue_count = cur.fetchone()['count']
-                
-                # Check active sessions
-                cur.execute("SELECT COUNT(*) as count FROM conversation_session WHERE status != 'ended';")
-                active_sessions = cur.fetchone()['count']
-                
-                # Get queue details
-                cur.execute("SELECT user_id, enqueued_at FROM match_queue ORDER BY enqueued_at;")
-                queue_users = cur.fetchall()
-                
-                # Display status
-                timestamp = datetime.now().strftime("%H:%M:%S")
-                print(f"⏱️  {timestamp} | Queue: {queue_count} users | Active Sessions: {active_sessions}", end="")
-                
-                if queue_users:
-                    print(" | Waiting:", end="")
-                    for user in queue_users:
-                        user_short = str(user['user_id'])[:8]
-                        print(f" {user_short}", end="")
-                print()
-                
-                time.sleep(2)
-                
+        listen(MatchMonitor(), interval=args.interval, on_refresh=refresh)
     except KeyboardInterrupt:
         print("\n👋 Monitor stopped")
 
 if __name__ == "__main__":
-    monitor_matching()
\ No newline at end of file
+    monitor_matching()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# reaper.py
+"""Background cleanup for abandoned sessions and queue entries.
+
+Sessions that were never ended (tab closed, connection lost) are marked
+``dropped`` once their heartbeat (``last_activity``) is older than
+``SESSION_MAX_AGE``; ``match_queue`` rows older than ``QUEUE_MAX_AGE`` and
+idempotency keys of batch-sent chat messages older than ``CHAT_KEY_MAX_AGE``
+are deleted. All run in batches of
+``REAPER_BATCH`` rows, each in its own short transaction with
+``FOR UPDATE SKIP LOCKED`` and a ``lock_timeout``, so the reaper never blocks
+a request for long and several processes can run it side by side. Once an
+hour it also creates the upcoming monthly ``chat_message`` partitions.
+
+Runs as a daemon thread inside the app (``REAPER_INTERVAL`` seconds, 0 turns
+it off) or standalone:
+
+    python reaper.py          # loop
+    python reaper.py --once   # one pass, prints the report
+"""
+
+import os
+import sys
+import time
+import logging
+import threading
+
+import psycopg2
+
+from db import get_cursor, PoolTimeout
+import chat_archive
+import events
+
+SESSION_MAX_AGE = int(os.getenv("SESSION_MAX_AGE", "600"))     # Sekunden ohne Heartbeat
+QUEUE_MAX_AGE = int(os.getenv("QUEUE_MAX_AGE", "900"))         # Sekunden in match_queue
+CHAT_KEY_MAX_AGE = int(os.getenv("CHAT_KEY_MAX_AGE", "604800"))  # Idempotenz-Schlüssel (7 Tage)
+REAPER_BATCH = int(os.getenv("REAPER_BATCH", "200"))
+REAPER_MAX_BATCHES = int(os.getenv("REAPER_MAX_BATCHES", "50"))  # pro Durchlauf und Tabelle
+REAPER_INTERVAL = int(os.getenv("REAPER_INTERVAL", "60"))
+PARTITION_CHECK_INTERVAL = 3600     # Sekunden; legt künftige chat_message-Monate an
+
+OPEN_STATUSES = ("initiated", "connecting", "connected")
+
+CLOSE_STALE_SESSIONS_SQL = """
+    WITH stale AS (
+        SELECT id
+        FROM conversation_session
+        WHERE status = ANY(%(statuses)s::session_status[])
+          AND ended_at IS NULL
+          AND last_activity < now() - %(max_age)s * interval '1 second'
+        ORDER BY last_activity
+        LIMIT %(batch)s
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE conversation_session cs
+    SET status = 'dropped', ended_at = now()
+    FROM stale
+    WHERE cs.id = stale.id
+    RETURNING cs.id,
+              ARRAY(SELECT user_id::text FROM session_participant WHERE session_id = cs.id) AS user_ids
+"""
+
+EXPIRE_QUEUE_SQL = """
+    WITH old AS (
+        SELECT user_id
+        FROM match_queue
+        WHERE enqueued_at < now() - %(max_age)s * interval '1 second'
+        ORDER BY enqueued_at
+        LIMIT %(batch)s
+        FOR UPDATE SKIP LOCKED
+    )
+    DELETE FROM match_queue q
+    USING old
+    WHERE q.user_id = old.user_id
+    RETURNING q.user_id
+"""
+
+EXPIRE_CHAT_KEYS_SQL = """
+    WITH old AS (
+        SELECT ctid
+        FROM chat_message_key
+        WHERE created_at < now() - %(max_age)s * interval '1 second'
+        ORDER BY created_at
+        LIMIT %(batch)s
+        FOR UPDATE SKIP LOCKED
+    )
+    DELETE FROM chat_message_key k
+    USING old
+    WHERE k.ctid = old.ctid
+    RETURNING k.message_id
+"""
+
+
+class Reaper:
+    def __init__(self, engine=None, session_max_age=SESSION_MAX_AGE, queue_max_age=QUEUE_MAX_AGE,
+                 batch=REAPER_BATCH, max_batches=REAPER_MAX_BATCHES, chat_key_max_age=CHAT_KEY_MAX_AGE):
+        self.engine = engine    # MatchEngine des Prozesses, wird über entfernte User informiert
+        self.session_max_age = session_max_age
+        self.queue_max_age = queue_max_age
+        self.chat_key_max_age = chat_key_max_age
+        self.batch = batch
+        self.max_batches = max_batches
+        self._thread = None
+        self._stop = threading.Event()
+
+        self.runs = 0
+        self.sessions_closed = 0
+        self.queue_expired = 0
+        self.chat_keys_expired = 0
+        self.last_report = None
+        self._partitions_checked = None
+
+    def _batches(self, sql, max_age):
+        """Run ``sql`` batch by batch until a batch comes back short."""
+        rows = []
+        batches = 0
+        while batches < self.max_batches:
+            with get_cursor(commit=True) as cur:
+                cur.execute("SET LOCAL lock_timeout = '1s'")
+                cur.execute("SET LOCAL statement_timeout = '5s'")
+                cur.execute(sql, {"statuses": list(OPEN_STATUSES), "max_age": max_age,
+                                  "batch": self.batch})
+                batch = cur.fetchall()
+            batches += 1
+            rows.extend(batch)
+            if len(batch) < self.batch:
+                break
+        return rows, batches
+
+    def run_once(self):
+        """One reaper pass. Returns a report dict."""
+        start = time.time()
+        sessions, session_batches = self._batches(CLOSE_STALE_SESSIONS_SQL, self.session_max_age)
+        expired, queue_batches = self._batches(EXPIRE_QUEUE_SQL, self.queue_max_age)
+        keys, key_batches = self._batches(EXPIRE_CHAT_KEYS_SQL, self.chat_key_max_age)
+
+        partitions = 0
+        if (self._partitions_checked is None
+                or time.monotonic() - self._partitions_checked >= PARTITION_CHECK_INTERVAL):
+            partitions = chat_archive.ensure_partitions()
+            self._partitions_checked = time.monotonic()
+
+        if self.engine is not None:
+            self.engine.release(*(uid for row in sessions for uid in row["user_ids"]))
+            self.engine.expire(*(str(row["user_id"]) for row in expired))
+
+        report = {
+            "sessions_closed": len(sessions),
+            "queue_expired": len(expired),
+            "chat_keys_expired": len(keys),
+            "batches": session_batches + queue_batches + key_batches,
+            "partitions_created": partitions,
+            "duration_ms": round((time.time() - start) * 1000, 1),
+        }
+        self.runs += 1
+        self.sessions_closed += report["sessions_closed"]
+        self.queue_expired += report["queue_expired"]
+        self.chat_keys_expired += report["chat_keys_expired"]
+        self.last_report = report
+        if sessions or expired or keys or partitions:
+            events.log("reaper_run", **report)
+        return report
+
+    # --- Thread ---
+
+    def start(self, interval=REAPER_INTERVAL):
+        if interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, args=(interval,), daemon=True, name="reaper")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.run_once()
+            except (psycopg2.Error, PoolTimeout) as e:
+                events.log("reaper_failed", level=logging.WARNING, error=str(e))
+
+    def stats(self):
+        return {
+            "runs": self.runs,
+            "sessions_closed": self.sessions_closed,
+            "queue_expired": self.queue_expired,
+            "chat_keys_expired": self.chat_keys_expired,
+            "last_report": self.last_report,
+        }
+
+
+if __name__ == "__main__":
+    reaper = Reaper()
+    if "--once" in sys.argv:
+        print(reaper.run_once())
+    else:
+        print(f"🧹 Reaper running every {REAPER_INTERVAL}s "
+              f"(sessions > {SESSION_MAX_AGE}s, queue > {QUEUE_MAX_AGE}s)")
+        while True:
+            try:
+                reaper.run_once()
+            except (psycopg2.Error, PoolTimeout) as e:
+                events.log("reaper_failed", level=logging.WARNING, error=str(e))
+            time.sleep(max(REAPER_INTERVAL, 1))
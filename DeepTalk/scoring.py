@@ -0,0 +1,188 @@
+# scoring.py
+"""Preference-aware candidate scoring for the matchmaking engine.
+
+The waiting users are kept as columnar numpy arrays (one row per user, swap
+remove keeps rows ``0..n-1`` dense). :meth:`CandidatePool.best` scores every
+candidate for one seeker in a single vectorized pass:
+
+- compatibility: same language, style and mood (with a small affinity table
+  for related moods) plus how well each side fits the other's
+  ``user_preferences`` (``preferred_style``, ``preferred_lang``);
+- wait time: long waiters get a bonus, so they are picked first among
+  similar candidates.
+
+Hard constraints relax as the pair waits: mood after ``MOOD_STRICT_FOR``,
+style after ``STYLE_STRICT_FOR`` seconds, language after ``LANG_STRICT_FOR``
+(then only towards the preferred language), and each user's
+``min_age``/``max_age`` window widens by ``AGE_SLACK_PER_MINUTE`` years per
+minute they waited. ``bench_matching.py`` measures a decision over 50k waiting users.
+"""
+
+import os
+import time
+
+import numpy as np
+
+MOODS = ("energized", "calm", "down", "curious", "lonely", "stressed", "neutral")
+STYLES = ("deep", "casual", "fun")
+
+MOOD_STRICT_FOR = float(os.getenv("MATCH_MOOD_STRICT_FOR", "15"))     # Sekunden
+STYLE_STRICT_FOR = float(os.getenv("MATCH_STYLE_STRICT_FOR", "30"))
+LANG_STRICT_FOR = float(os.getenv("MATCH_LANG_STRICT_FOR", "90"))
+AGE_SLACK_PER_MINUTE = float(os.getenv("MATCH_AGE_SLACK_PER_MINUTE", "2"))   # Jahre
+WAIT_HORIZON = 120.0    # ab hier gibt es den vollen Wartebonus
+
+# Gewichte; ein perfektes Paar ohne Wartezeit hat 10 Punkte
+W_LANG = 4.0
+W_MOOD = 3.0
+W_STYLE = 2.0
+W_PREFERENCE = 1.0
+W_WAIT = 2.0
+
+
+def _mood_affinity():
+    affinity = np.eye(len(MOODS), dtype=np.float32)
+    index = {mood: i for i, mood in enumerate(MOODS)}
+    # Neutral passt halb zu allem, dazu ein paar Stimmungen, die sich ergänzen
+    affinity[index["neutral"], :] = affinity[:, index["neutral"]] = 0.5
+    for a, b in (("lonely", "down"), ("curious", "energized"), ("calm", "stressed")):
+        affinity[index[a], index[b]] = affinity[index[b], index[a]] = 0.5
+    affinity[index["neutral"], index["neutral"]] = 1.0
+    return affinity
+
+
+MOOD_AFFINITY = _mood_affinity()
+
+_COLUMNS = {
+    "lang": np.int16,
+    "style": np.int8,
+    "mood": np.int8,
+    "preferred_lang": np.int16,     # -1: keine Präferenz
+    "preferred_style": np.int8,
+    "min_age": np.int16,
+    "max_age": np.int16,
+    "birth_year": np.int16,         # 0: unbekannt
+    "enqueued_at": np.float64,      # Unix-Zeit
+}
+
+
+class CandidatePool:
+    """Waiting users as columns; add/remove O(1), one scoring pass O(n)."""
+
+    def __init__(self, capacity=1024):
+        self._columns = {name: np.zeros(capacity, dtype) for name, dtype in _COLUMNS.items()}
+        self._ids = []          # Zeile -> user_id
+        self._row = {}          # user_id -> Zeile
+        self._langs = {}        # Sprachcode -> int
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, user_id):
+        return user_id in self._row
+
+    def add(self, user_id, profile):
+        """Add or replace ``user_id``; ``profile`` has the queue and preference columns."""
+        self.remove(user_id)
+        row = len(self._ids)
+        if row == len(self._columns["lang"]):
+            for name, column in self._columns.items():
+                self._columns[name] = np.concatenate([column, np.zeros_like(column)])
+        for name, value in self._encode(profile).items():
+            self._columns[name][row] = value
+        self._ids.append(user_id)
+        self._row[user_id] = row
+
+    def remove(self, user_id):
+        row = self._row.pop(user_id, None)
+        if row is None:
+            return
+        last = len(self._ids) - 1
+        if row != last:
+            # Letzte Zeile in die Lücke ziehen
+            moved = self._ids[last]
+            for column in self._columns.values():
+                column[row] = column[last]
+            self._ids[row] = moved
+            self._row[moved] = row
+        self._ids.pop()
+
+    def best(self, user_id=None, profile=None, now=None, exclude=()):
+        """Best partner for a seeker as ``(partner_id, score)``, or None.
+
+        The seeker is either a pool member (``user_id``, excluded from the
+        candidates) or an outside ``profile`` such as a fresh enqueue.
+        Members in ``exclude`` are skipped without leaving the pool.
+        """
+        n = len(self._ids)
+        if not n:
+            return None
+        if profile is not None:
+            seeker = self._encode(profile)
+        else:
+            seeker = {name: column[self._row[user_id]] for name, column in self._columns.items()}
+        now = time.time() if now is None else now
+        year = time.gmtime(now).tm_year
+        c = {name: column[:n] for name, column in self._columns.items()}
+
+        candidate_wait = now - c["enqueued_at"]
+        seeker_wait = max(now - seeker["enqueued_at"], 0.0)
+        # Gemeinsame Merkmale lockern mit der längeren Wartezeit des Paares
+        pair_wait = np.maximum(candidate_wait, seeker_wait)
+
+        same_lang = c["lang"] == seeker["lang"]
+        same_style = c["style"] == seeker["style"]
+        mood = MOOD_AFFINITY[seeker["mood"]][c["mood"]]
+
+        ok = same_lang | ((pair_wait >= LANG_STRICT_FOR)
+                          & ((c["lang"] == seeker["preferred_lang"]) | (c["preferred_lang"] == seeker["lang"])))
+        ok &= same_style | (pair_wait >= STYLE_STRICT_FOR)
+        ok &= (mood >= 1.0) | (pair_wait >= MOOD_STRICT_FOR)
+
+        # Altersfenster: jeder mit seiner eigenen Wartezeit
+        known = c["birth_year"] > 0
+        age = year - c["birth_year"]
+        slack = seeker_wait / 60 * AGE_SLACK_PER_MINUTE
+        ok &= ~known | ((age >= seeker["min_age"] - slack) & (age <= seeker["max_age"] + slack))
+        if seeker["birth_year"] > 0:
+            seeker_age = year - seeker["birth_year"]
+            slack = candidate_wait / 60 * AGE_SLACK_PER_MINUTE
+            ok &= (seeker_age >= c["min_age"] - slack) & (seeker_age <= c["max_age"] + slack)
+        if profile is None:
+            ok[self._row[user_id]] = False
+        for skipped in exclude:
+            row = self._row.get(skipped)
+            if row is not None:
+                ok[row] = False
+
+        score = (W_LANG * same_lang + W_STYLE * same_style + W_MOOD * mood
+                 + W_PREFERENCE / 4 * (c["style"] == seeker["preferred_style"])
+                 + W_PREFERENCE / 4 * (c["preferred_style"] == seeker["style"])
+                 + W_PREFERENCE / 4 * (c["lang"] == seeker["preferred_lang"])
+                 + W_PREFERENCE / 4 * (c["preferred_lang"] == seeker["lang"])
+                 + W_WAIT * np.minimum(candidate_wait / WAIT_HORIZON, 1.0))
+        score = np.where(ok, score, -np.inf)
+        row = int(np.argmax(score))
+        if not ok[row]:
+            return None
+        return self._ids[row], float(score[row])
+
+    def _lang_code(self, lang):
+        if lang is None:
+            return -1
+        return self._langs.setdefault(lang, len(self._langs))
+
+    def _encode(self, profile):
+        enqueued_at = profile.get("enqueued_at")
+        preferred_style = profile.get("preferred_style")
+        return {
+            "lang": self._lang_code(profile.get("lang") or "de"),
+            "style": STYLES.index(profile.get("style") or "deep"),
+            "mood": MOODS.index(profile.get("mood") or "neutral"),
+            "preferred_lang": self._lang_code(profile.get("preferred_lang")),
+            "preferred_style": STYLES.index(preferred_style) if preferred_style else -1,
+            "min_age": profile.get("min_age") or 0,
+            "max_age": profile.get("max_age") or 200,
+            "birth_year": profile.get("birth_year") or 0,
+            "enqueued_at": enqueued_at.timestamp() if enqueued_at is not None else time.time(),
+        }
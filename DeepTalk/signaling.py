@@ -0,0 +1,216 @@
+# signaling.py
+"""WebRTC signaling backends for the /ws/signal/<room> relay.
+
+``MemorySignaling`` keeps rooms in a dict and only works when both peers are
+connected to the same process. ``PostgresSignaling`` additionally relays
+messages between worker processes via ``LISTEN/NOTIFY`` on the app database,
+so peers can land on any worker. Select with ``SIGNAL_BACKEND=memory|postgres``.
+"""
+
+import os
+import json
+import uuid
+import select
+import hashlib
+import logging
+import threading
+import time
+from collections import deque
+
+import psycopg2
+
+from db import DATABASE_URL, get_cursor
+import events
+
+# NOTIFY-Payloads sind auf 8000 Bytes begrenzt; darüber geht es über signal_message
+NOTIFY_MAX_PAYLOAD = 7900
+
+PRUNE_OVERFLOW_SQL = "DELETE FROM signal_message WHERE created_at < now() - interval '5 minutes'"
+INSERT_OVERFLOW_SQL = "INSERT INTO signal_message (room, payload) VALUES (%s, %s) RETURNING id"
+NOTIFY_SQL = "SELECT pg_notify(%s, %s)"
+
+
+class MemorySignaling:
+    """Relay between sockets of the same process (original MVP behaviour)."""
+
+    def __init__(self):
+        self.rooms = {}     # room -> [ws]
+        self._lock = threading.Lock()
+
+    def join(self, room, ws):
+        with self._lock:
+            self.rooms.setdefault(room, []).append(ws)
+
+    def leave(self, room, ws):
+        with self._lock:
+            clients = self.rooms.get(room, [])
+            if ws in clients:
+                clients.remove(ws)
+            if not clients:
+                self.rooms.pop(room, None)
+
+    def publish(self, room, ws, data):
+        self._deliver(room, data, exclude=ws)
+
+    async def apublish(self, room, ws, data, pool):
+        """``publish`` for the async server; ``pool`` is a psycopg AsyncConnectionPool."""
+        self._deliver(room, data, exclude=ws)
+
+    def _deliver(self, room, data, exclude=None):
+        with self._lock:
+            clients = list(self.rooms.get(room, []))
+        # an alle anderen im Raum weiterleiten
+        for c in clients:
+            if c is not exclude:
+                try:
+                    c.send(data)
+                except Exception:
+                    pass
+
+
+class PostgresSignaling(MemorySignaling):
+    """Relay across processes with one LISTEN channel per room.
+
+    Local peers are served directly; every message is also sent with
+    ``pg_notify`` so other processes hosting the room can deliver it. Each
+    process keeps one dedicated autocommit connection that LISTENs on the
+    channels of its rooms. Only the listener thread touches that connection;
+    ``join``/``leave`` hand LISTEN/UNLISTEN to it and wake it through a pipe.
+    """
+
+    def __init__(self, dsn=DATABASE_URL):
+        super().__init__()
+        self.dsn = dsn
+        self.origin = uuid.uuid4().hex[:12]
+        self._commands = deque()    # (sql, threading.Event)
+        self._wake_r, self._wake_w = os.pipe()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    @staticmethod
+    def channel(room):
+        return "signal_" + hashlib.md5(room.encode()).hexdigest()[:24]
+
+    # --- Listener-Thread ---
+
+    def _command(self, sql):
+        """Queue ``sql`` for the listener thread; returns an Event set once it ran."""
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name="signal-listener")
+                self._thread.start()
+        done = threading.Event()
+        self._commands.append((sql, done))
+        os.write(self._wake_w, b"x")
+        return done
+
+    def _run(self):
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    for room in list(self.rooms):
+                        cur.execute("LISTEN " + self.channel(room))
+                self._serve(conn)
+            except (psycopg2.Error, OSError) as e:
+                events.log("signal_listener_lost", level=logging.WARNING, error=str(e))
+                if conn is not None:
+                    conn.close()
+                # Beim Neuverbinden werden alle offenen Räume ohnehin neu gelistet
+                while self._commands:
+                    self._commands.popleft()[1].set()
+                time.sleep(1)
+
+    def _serve(self, conn):
+        while True:
+            readable, _, _ = select.select([conn, self._wake_r], [], [], 5.0)
+            if self._wake_r in readable:
+                os.read(self._wake_r, 4096)
+            while self._commands:
+                sql, done = self._commands.popleft()
+                try:
+                    with conn.cursor() as cur:
+                        cur.execute(sql)
+                finally:
+                    done.set()
+            conn.poll()
+            while conn.notifies:
+                try:
+                    self._dispatch(conn.notifies.pop(0).payload)
+                except Exception as e:
+                    events.log("signal_dispatch_failed", level=logging.WARNING, error=str(e))
+
+    def _dispatch(self, payload):
+        msg = json.loads(payload)
+        if msg["origin"] == self.origin:
+            return
+        data = msg.get("data")
+        if data is None:
+            with get_cursor() as cur:
+                cur.execute("SELECT payload FROM signal_message WHERE id = %s", (msg["ref"],))
+                row = cur.fetchone()
+            if not row:
+                return
+            data = row["payload"]
+        self._deliver(msg["room"], data)
+
+    # --- Räume ---
+
+    # Mitgliedschaft prüfen und LISTEN/UNLISTEN einreihen unter demselben Lock:
+    # so landen die Befehle in der Reihenfolge, in der sich die Räume ändern
+
+    def join(self, room, ws):
+        done = None
+        with self._lock:
+            if room not in self.rooms:
+                done = self._command("LISTEN " + self.channel(room))
+            self.rooms.setdefault(room, []).append(ws)
+        if done is not None:
+            done.wait(5.0)
+
+    def leave(self, room, ws):
+        with self._lock:
+            clients = self.rooms.get(room, [])
+            if ws in clients:
+                clients.remove(ws)
+            if not clients and self.rooms.pop(room, None) is not None:
+                self._command("UNLISTEN " + self.channel(room))
+
+    def publish(self, room, ws, data):
+        self._deliver(room, data, exclude=ws)
+        payload = json.dumps({"origin": self.origin, "room": room, "data": data})
+        with get_cursor(commit=True) as cur:
+            if len(payload.encode()) > NOTIFY_MAX_PAYLOAD:
+                # Grosse SDPs: Inhalt in signal_message ablegen, nur die ID notifizieren
+                cur.execute(PRUNE_OVERFLOW_SQL)
+                cur.execute(INSERT_OVERFLOW_SQL, (room, data))
+                payload = json.dumps({"origin": self.origin, "room": room,
+                                      "ref": cur.fetchone()["id"]})
+            cur.execute(NOTIFY_SQL, (self.channel(room), payload))
+
+    async def apublish(self, room, ws, data, pool):
+        self._deliver(room, data, exclude=ws)
+        payload = json.dumps({"origin": self.origin, "room": room, "data": data})
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                if len(payload.encode()) > NOTIFY_MAX_PAYLOAD:
+                    await cur.execute(PRUNE_OVERFLOW_SQL)
+                    await cur.execute(INSERT_OVERFLOW_SQL, (room, data))
+                    payload = json.dumps({"origin": self.origin, "room": room,
+                                          "ref": (await cur.fetchone())["id"]})
+                await cur.execute(NOTIFY_SQL, (self.channel(room), payload))
+
+
+BACKENDS = {
+    "memory": MemorySignaling,
+    "postgres": PostgresSignaling,
+}
+
+
+def create_backend(name=None):
+    name = (name or os.getenv("SIGNAL_BACKEND", "memory")).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"unknown SIGNAL_BACKEND {name!r} (expected one of {', '.join(BACKENDS)})")
+    return BACKENDS[name]()
@@ -0,0 +1,13 @@
+-- Signaling Schema Update
+-- Overflow storage for WebRTC signaling messages that do not fit into a
+-- NOTIFY payload (max. 8000 bytes). Only used with SIGNAL_BACKEND=postgres;
+-- rows are short-lived and pruned by the sender.
+
+CREATE TABLE IF NOT EXISTS signal_message (
+  id BIGSERIAL PRIMARY KEY,
+  room TEXT NOT NULL,
+  payload TEXT NOT NULL,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_signal_message_created ON signal_message(created_at);
@@ -0,0 +1,21 @@
+-- Conversation Summary Schema Update
+-- Denormalized per-user view of each connection for the /connections page.
+-- Maintained by app.py on send / read / reveal; rebuild with:
+--   python conversation_summary.py
+
+CREATE TABLE IF NOT EXISTS conversation_summary (
+  user_id UUID NOT NULL REFERENCES app_user(id) ON DELETE CASCADE,
+  connection_id BIGINT NOT NULL REFERENCES user_connection(id) ON DELETE CASCADE,
+  other_user_id UUID NOT NULL REFERENCES app_user(id) ON DELETE CASCADE,
+  connected_at TIMESTAMPTZ NOT NULL,
+  last_message TEXT,
+  last_message_at TIMESTAMPTZ,
+  last_sender_id UUID,
+  unread_count INTEGER NOT NULL DEFAULT 0,
+  last_activity TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (user_id, connection_id)
+);
+
+-- /connections: ein Range-Scan pro User, bereits sortiert
+CREATE INDEX IF NOT EXISTS idx_conversation_summary_user_activity ON conversation_summary(user_id, last_activity DESC);
+CREATE INDEX IF NOT EXISTS idx_conversation_summary_connection ON conversation_summary(connection_id);
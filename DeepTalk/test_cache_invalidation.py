@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""Cache invalidations reach the caches of other processes over NOTIFY."""
+
+import os
+import sys
+import json
+import time
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import psycopg2
+from db import get_cursor
+from cache import CACHE_CHANNEL, InvalidationListener, TTLCache, publish_invalidation
+
+def _wait_for(condition, seconds=5.0):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+def test_cache_invalidation():
+    """A NOTIFY from another process drops the key, our own is ignored."""
+
+    print("🧪 Testing cross-process cache invalidation")
+    print("=" * 50)
+
+    loads = []
+    cache = TTLCache(lambda key: loads.append(key) or key, ttl=3600)
+    listener = InvalidationListener({"user": cache})
+    try:
+        listener.start(enabled=True)
+        # Warten, bis LISTEN steht: eigene Nachrichten kommen an, werden aber übersprungen
+        with get_cursor(commit=True) as cur:
+            publish_invalidation(cur, "user", "warmup")
+        time.sleep(0.5)
+
+        cache.get("a")
+        cache.get("b")
+        with get_cursor(commit=True) as cur:
+            # Wie publish_invalidation aus einem anderen Worker
+            cur.execute("SELECT pg_notify(%s, %s)", (CACHE_CHANNEL, json.dumps(
+                {"cache": "user", "keys": ["a"], "origin": "other-worker"})))
+        assert _wait_for(lambda: listener.received >= 1), "invalidation not received"
+        cache.get("a")
+        cache.get("b")
+        assert loads == ["a", "b", "a"], loads
+        print("✅ Key invalidated by another process is reloaded, others stay cached")
+
+        received = listener.received
+        with get_cursor(commit=True) as cur:
+            publish_invalidation(cur, "user", "b")
+        time.sleep(0.5)
+        assert listener.received == received, "own invalidation applied twice"
+        print("✅ Own invalidations are not applied a second time")
+    except psycopg2.OperationalError as e:
+        print(f"❌ Database not available: {e}")
+        return False
+    finally:
+        listener.stop()
+
+    return True
+
+if __name__ == "__main__":
+    test_cache_invalidation()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Polling for new chat messages does not skip messages that commit late."""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import psycopg2
+from db import get_cursor
+
+def test_chat_poll():
+    """A message with an older sent_at than the cursor still reaches the poller."""
+
+    print("🧪 Testing chat polling")
+    print("=" * 50)
+
+    try:
+        from app import app
+
+        with get_cursor(commit=True) as cur:
+            cur.execute("""
+                INSERT INTO app_user (onboarding_done)
+                SELECT TRUE FROM generate_series(1, 2)
+                RETURNING id
+            """)
+            a, b = sorted(str(row["id"]) for row in cur.fetchall())
+            cur.execute("""
+                INSERT INTO conversation_session (status, ice_room_key, ended_at)
+                VALUES ('ended', 'chat_poll', now())
+                RETURNING id
+            """)
+            session_id = cur.fetchone()["id"]
+            cur.execute("""
+                INSERT INTO user_connection (user1_id, user2_id, session_id)
+                VALUES (%s, %s, %s)
+                RETURNING id
+            """, (a, b, session_id))
+            connection_id = cur.fetchone()["id"]
+            cur.execute("""
+                INSERT INTO chat_message (connection_id, sender_id, message, sent_at)
+                VALUES (%s, %s, 'first', now() - interval '2 seconds')
+                RETURNING id
+            """, (connection_id, b))
+            first_id = cur.fetchone()["id"]
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess["uid"] = a
+
+        # Zweite Nachricht: größere id, aber früheres sent_at (lange Transaktion, spät committet)
+        with get_cursor(commit=True) as cur:
+            cur.execute("""
+                INSERT INTO chat_message (connection_id, sender_id, message, sent_at)
+                VALUES (%s, %s, 'late', now() - interval '5 seconds')
+            """, (connection_id, b))
+
+        poll = client.get(f"/chat/{connection_id}/messages?after_id={first_id}")
+        assert poll.status_code == 200, poll.data
+        texts = [m["message"] for m in poll.json["messages"]]
+        assert texts == ["late"], texts
+        assert poll.json["last_id"] == first_id, poll.json
+        print(f"✅ Late committed message delivered with the overlap, cursor kept: {texts}")
+
+        # Stand erreicht: der nächste Poll ist leer, obwohl alles im Overlap liegt
+        have = ",".join(str(m["id"]) for m in poll.json["messages"])
+        again = client.get(f"/chat/{connection_id}/messages?after_id={first_id}&have={first_id},{have}")
+        assert again.json == {"messages": [], "html": "", "last_id": first_id}, again.json
+        with get_cursor(commit=True) as cur:
+            cur.execute("""
+                INSERT INTO chat_message (connection_id, sender_id, message)
+                VALUES (%s, %s, 'next')
+                RETURNING id
+            """, (connection_id, b))
+            next_id = cur.fetchone()["id"]
+        newer = client.get(f"/chat/{connection_id}/messages?after_id={first_id}&have={first_id},{have}")
+        assert [m["message"] for m in newer.json["messages"]] == ["next"], newer.json
+        assert newer.json["last_id"] == next_id
+        plain = client.get(f"/chat/{connection_id}/messages?after_id={next_id}")
+        assert plain.json["messages"] == [], "without have: only what follows the cursor"
+        print("✅ Nothing new is an empty response, new messages come exactly once")
+
+        bad = client.get(f"/chat/{connection_id}/messages?since=yesterday")
+        assert bad.status_code == 400, bad.status_code
+        assert client.get(f"/chat/{connection_id}/messages?have=1,x").status_code == 400
+        ok = client.get(f"/chat/{connection_id}/messages?since=2026-01-01T00:00:00%2B00:00")
+        assert ok.status_code == 200 and len(ok.json["messages"]) == 3, ok.json
+        print("✅ Invalid since is a 400, a valid one returns the messages")
+
+        with get_cursor(commit=True) as cur:
+            cur.execute("DELETE FROM chat_message WHERE connection_id = %s", (connection_id,))
+            cur.execute("DELETE FROM user_connection WHERE id = %s", (connection_id,))
+            cur.execute("DELETE FROM conversation_session WHERE id = %s", (session_id,))
+            cur.execute("DELETE FROM app_user WHERE id IN (%s, %s)", (a, b))
+    except psycopg2.OperationalError as e:
+        print(f"❌ Database not available: {e}")
+        return False
+
+    return True
+
+if __name__ == "__main__":
+    test_chat_poll()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""Claims tell a gone queue row from one another worker is claiming right now."""
+
+import os
+import sys
+from datetime import datetime, timezone
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import json
+import select
+
+import psycopg2
+from db import DATABASE_URL, get_cursor
+from matchmaking import MATCH_CHANNEL, MatchEngine, claim_outcome
+
+def test_claim_outcome():
+    """Locked partners are skipped for one attempt, gone ones are dropped."""
+
+    print("🧪 Testing claim outcomes")
+    print("=" * 50)
+
+    try:
+        with get_cursor(commit=True) as cur:
+            cur.execute("""
+                INSERT INTO app_user (onboarding_done)
+                SELECT TRUE FROM generate_series(1, 4)
+                RETURNING id
+            """)
+            seeker, locked, free, gone = sorted(str(row["id"]) for row in cur.fetchall())
+            cur.execute("""
+                INSERT INTO match_queue (user_id, mood, style, lang)
+                SELECT unnest(%s::uuid[]), 'calm', 'deep', 'yy'
+            """, ([seeker, locked, free],))
+
+        listen = psycopg2.connect(DATABASE_URL)
+        listen.autocommit = True
+        with listen.cursor() as cur:
+            cur.execute("LISTEN " + MATCH_CHANNEL)
+
+        engine = MatchEngine()
+        engine._restored = True
+        now = datetime.now(timezone.utc)
+        # Gesperrter Partner ist der beste (wartet am längsten), der weggefallene der zweitbeste
+        for user_id, waited in ((locked, 100), (gone, 50), (free, 0)):
+            engine._add(user_id, {"lang": "yy", "style": "deep", "mood": "calm",
+                                  "enqueued_at": datetime.fromtimestamp(now.timestamp() - waited, timezone.utc)})
+
+        # Ein anderer Worker hält die Zeile von "locked", bis unser Claim durch ist
+        with get_cursor() as other:
+            other.execute("SELECT 1 FROM match_queue WHERE user_id = %s FOR UPDATE", (locked,))
+            with get_cursor(commit=True) as cur:
+                assert claim_outcome(cur, seeker, locked) == ("partner_locked", None)
+                assert claim_outcome(cur, seeker, gone) == ("partner_gone", None)
+            with get_cursor(commit=True) as cur:
+                engine._add(seeker, {"lang": "yy", "style": "deep", "mood": "calm", "enqueued_at": now})
+                assigned = engine._pair(cur, seeker)
+        assert assigned and assigned["partner_id"] == free, assigned
+        assert engine.is_waiting(locked), "locked partner stays in the pool"
+        assert not engine.is_waiting(gone), "gone partner is dropped"
+        print("✅ Locked partner skipped, gone partner dropped, next best claimed")
+
+        # Der Partner wartet evtl. an einem anderen Worker: dessen MatchListener hört die Session
+        published = []
+        if select.select([listen], [], [], 2.0)[0]:
+            listen.poll()
+            published = [json.loads(n.payload) for n in listen.notifies]
+        listen.close()
+        assert any(m["session_id"] == assigned["id"] and set(m["user_ids"]) == {seeker, free}
+                   for m in published), published
+        print("✅ Claimed session published for the listeners of other workers")
+
+        with get_cursor() as other:
+            other.execute("SELECT 1 FROM match_queue WHERE user_id = %s FOR UPDATE", (locked,))
+            with get_cursor(commit=True) as cur:
+                assert claim_outcome(cur, locked) == ("seeker_locked", None)
+        with get_cursor(commit=True) as cur:
+            assert claim_outcome(cur, gone) == ("seeker_gone", None)
+            assert claim_outcome(cur, locked) == ("no_partner", None)
+        print("✅ Seeker locked, seeker gone and empty bucket are told apart")
+
+        # Session vorbei: beide Teilnehmer vergessen, nicht nur der Aufrufer
+        with engine._lock:
+            engine._assign(assigned, seeker, free)
+        engine.release_session(assigned["id"])
+        assert engine.assignment(seeker) is None and engine.assignment(free) is None
+        assert engine.wait_for_assignment(gone, 0.01) is None
+        assert gone not in engine._events, "timed out waiter leaves no event behind"
+        print("✅ Ended session releases every participant, timed out waiters are cleaned up")
+
+        with get_cursor(commit=True) as cur:
+            cur.execute("DELETE FROM match_queue WHERE user_id = %s", (locked,))
+            cur.execute("DELETE FROM session_participant WHERE session_id = %s", (assigned["id"],))
+            cur.execute("DELETE FROM conversation_session WHERE id = %s", (assigned["id"],))
+            cur.execute("DELETE FROM app_user WHERE id IN (%s, %s, %s, %s)", (seeker, locked, free, gone))
+    except psycopg2.OperationalError as e:
+        print(f"❌ Database not available: {e}")
+        return False
+
+    return True
+
+if __name__ == "__main__":
+    test_claim_outcome()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Fire hundreds of parallel /match calls and check nobody is matched twice."""
+
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import psycopg2
+from db import get_cursor
+
+USERS = 200
+CALLS_PER_USER = 2
+WORKERS = 32
+
+def _client_for(app, user_id):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["uid"] = user_id
+    return client
+
+def test_match_concurrency():
+    """Every queued user ends up in at most one session, every session has two users."""
+
+    print("🧪 Testing concurrent /match claims")
+    print("=" * 50)
+
+    try:
+        from app import app, match_engine
+        match_engine.ensure_restored()
+
+        # Wartende direkt in match_queue anlegen (wie von anderen Worker-Prozessen)
+        with get_cursor(commit=True) as cur:
+            cur.execute("""
+                INSERT INTO app_user (onboarding_done)
+                SELECT TRUE FROM generate_series(1, %s)
+                RETURNING id
+            """, (USERS,))
+            user_ids = [str(row["id"]) for row in cur.fetchall()]
+            cur.execute("""
+                INSERT INTO match_queue (user_id, mood, style, lang)
+                SELECT unnest(%s::uuid[]), 'neutral', 'deep', 'de'
+            """, (user_ids,))
+        print(f"✅ Queued {len(user_ids)} test users")
+    except psycopg2.OperationalError as e:
+        print(f"❌ Database not available: {e}")
+        return False
+
+    clients = {uid: _client_for(app, uid) for uid in user_ids}
+    calls = [uid for uid in user_ids for _ in range(CALLS_PER_USER)]
+
+    def hit(uid):
+        return clients[uid].get("/match").status_code
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        statuses = list(pool.map(hit, calls))
+    print(f"✅ Fired {len(statuses)} parallel /match calls")
+    assert all(code in (200, 302) for code in statuses), statuses
+
+    try:
+        with get_cursor(commit=True) as cur:
+            cur.execute("""
+                SELECT user_id, COUNT(*) AS sessions
+                FROM session_participant
+                WHERE user_id = ANY(%s::uuid[])
+                GROUP BY user_id
+                HAVING COUNT(*) > 1
+            """, (user_ids,))
+            doubles = cur.fetchall()
+
+            cur.execute("""
+                SELECT sp.session_id, COUNT(*) AS participants
+                FROM session_participant sp
+                WHERE sp.session_id IN (
+                    SELECT session_id FROM session_participant WHERE user_id = ANY(%s::uuid[])
+                )
+                GROUP BY sp.session_id
+            """, (user_ids,))
+            sessions = cur.fetchall()
+
+            cur.execute("SELECT COUNT(*) AS count FROM match_queue WHERE user_id = ANY(%s::uuid[])", (user_ids,))
+            still_waiting = cur.fetchone()["count"]
+
+            # Aufräumen
+            cur.execute("""
+                DELETE FROM conversation_session WHERE id IN (
+                    SELECT session_id FROM session_participant WHERE user_id = ANY(%s::uuid[])
+                )
+            """, (user_ids,))
+            cur.execute("DELETE FROM app_user WHERE id = ANY(%s::uuid[])", (user_ids,))
+    finally:
+        match_engine.release(*user_ids)
+
+    matched = sum(row["participants"] for row in sessions)
+    print(f"✅ {len(sessions)} sessions, {matched} matched users, {still_waiting} still waiting")
+
+    assert not doubles, f"users in more than one session: {doubles}"
+    assert all(row["participants"] == 2 for row in sessions), sessions
+    assert matched + still_waiting == len(user_ids)
+    print("✅ No user was matched twice")
+    return True
+
+if __name__ == "__main__":
+    test_match_concurrency()
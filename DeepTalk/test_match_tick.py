@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""The match tick pairs the whole queue in one transaction, longest waiters first."""
+
+import os
+import sys
+import json
+import time
+import select
+from datetime import datetime, timedelta, timezone
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import psycopg2
+from db import DATABASE_URL, get_cursor
+from matchmaking import MatchEngine
+from cards import catalog
+from match_tick import MATCH_CHANNEL, MatchListener, MatchTicker, plan_pairs
+
+USERS = 40
+
+def _row(user_id, waited, **fields):
+    row = {"user_id": user_id, "lang": "de", "style": "deep", "mood": "calm", "birth_year": 1990,
+           "enqueued_at": datetime.now(timezone.utc) - timedelta(seconds=waited)}
+    row.update(fields)
+    return row
+
+def test_match_tick():
+    """Plan a pairing in memory, then let a tick pair real queue rows."""
+
+    print("🧪 Testing the batch match tick")
+    print("=" * 50)
+
+    rows = [_row("picky", 50, min_age=18, max_age=22), _row("mid", 40), _row("new", 30),
+            _row("young", 0, birth_year=2006)]
+    pairs = {(a["user_id"], b["user_id"]) for a, b, _ in plan_pairs(rows)}
+    # "picky" wählt zuerst und nimmt den einzigen im Altersfenster, dann "mid"
+    assert pairs == {("picky", "young"), ("mid", "new")}, pairs
+    print("✅ Longest waiter picks first, preferences decide the rest")
+
+    try:
+        listen = psycopg2.connect(DATABASE_URL)
+        listen.autocommit = True
+        with listen.cursor() as cur:
+            cur.execute("LISTEN " + MATCH_CHANNEL)
+
+        with get_cursor(commit=True) as cur:
+            cur.execute("""
+                INSERT INTO app_user (onboarding_done)
+                SELECT TRUE FROM generate_series(1, %s)
+                RETURNING id
+            """, (USERS,))
+            user_ids = [str(row["id"]) for row in cur.fetchall()]
+            cur.execute("""
+                INSERT INTO match_queue (user_id, mood, style, lang)
+                SELECT unnest(%s::uuid[]), 'curious', 'casual', 'tk'
+            """, (user_ids,))
+
+        ticker = MatchTicker()
+        # Ein anderer Worker claimt gerade zwei der Wartenden: der Tick lässt sie aus
+        with get_cursor() as other:
+            other.execute("SELECT 1 FROM match_queue WHERE user_id = ANY(%s::uuid[]) FOR UPDATE",
+                          (user_ids[:2],))
+            report = ticker.run_once()
+        assert report and report["pairs"] >= 1, report
+        with get_cursor() as cur:
+            cur.execute("SELECT count(*) AS n FROM match_queue WHERE user_id = ANY(%s::uuid[])",
+                        (user_ids[:2],))
+            assert cur.fetchone()["n"] == 2, "locked rows are not paired"
+        print(f"✅ Rows claimed elsewhere left out: {report}")
+
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            report = ticker.run_once() or report
+            with get_cursor() as cur:
+                cur.execute("SELECT count(*) AS n FROM match_queue WHERE user_id = ANY(%s::uuid[])",
+                            (user_ids,))
+                if cur.fetchone()["n"] == 0:
+                    break
+            time.sleep(0.1)
+        print(f"✅ Tick report: {report}, stats: {ticker.stats()}")
+
+        # Andere Prozesse erfahren die Matches per NOTIFY, ihre Engine nur für eigene User
+        engine = MatchEngine()
+        engine._restored = True
+        engine._add(user_ids[0], {"lang": "tk", "style": "casual", "mood": "curious",
+                                  "enqueued_at": datetime.now(timezone.utc)})
+        listener = MatchListener(engine)
+        notified = {}
+        deadline = time.monotonic() + 5
+        while len(notified) < USERS and time.monotonic() < deadline:
+            select.select([listen], [], [], 0.1)
+            listen.poll()
+            while listen.notifies:
+                payload = listen.notifies.pop(0).payload
+                match = json.loads(payload)
+                if set(match["user_ids"]) & set(user_ids):
+                    notified.update(dict.fromkeys(match["user_ids"], match["session_id"]))
+                    listener.dispatch(payload)
+        listen.close()
+        assert set(notified) == set(user_ids), len(notified)
+        assert engine.assignment(user_ids[0])["id"] == notified[user_ids[0]]
+        assert not engine.is_waiting(user_ids[0])
+        assert engine.assignment(user_ids[1]) is None, "unknown users are not recorded"
+        print("✅ Every match published on the channel, applied for local users only")
+
+        with get_cursor(commit=True) as cur:
+            cur.execute("""
+                SELECT sp.session_id, count(*) AS participants
+                FROM session_participant sp
+                WHERE sp.session_id IN (
+                    SELECT session_id FROM session_participant WHERE user_id = ANY(%s::uuid[])
+                )
+                GROUP BY sp.session_id
+            """, (user_ids,))
+            sessions = cur.fetchall()
+            cur.execute("""
+                SELECT count(DISTINCT session_id) AS sessions, count(*) AS cards
+                FROM session_card_usage WHERE session_id = ANY(%s::uuid[])
+            """, ([row["session_id"] for row in sessions],))
+            decks = cur.fetchone()
+            deck_size = len(catalog.build_deck("tk", "casual", cur=cur))
+            cur.execute("""
+                DELETE FROM conversation_session WHERE id = ANY(%s::uuid[])
+            """, ([row["session_id"] for row in sessions],))
+            cur.execute("DELETE FROM app_user WHERE id = ANY(%s::uuid[])", (user_ids,))
+
+        assert len(sessions) == USERS // 2, sessions
+        assert all(row["participants"] == 2 for row in sessions), sessions
+        print(f"✅ {USERS} waiting users paired into {len(sessions)} sessions")
+        assert decks["sessions"] == (len(sessions) if deck_size else 0), decks
+        assert decks["cards"] == len(sessions) * deck_size, (decks, deck_size)
+        print(f"✅ Decks stored in one batch: {decks['cards']} cards for {decks['sessions']} sessions")
+    except psycopg2.OperationalError as e:
+        print(f"❌ Database not available: {e}")
+        return False
+
+    return True
+
+if __name__ == "__main__":
+    test_match_tick()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""/metrics is off unless a token or an allowed network is configured."""
+
+import os
+import sys
+import ipaddress
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import metrics
+from app import app
+
+def test_metrics_auth():
+    """No config: 404; token or network: allowed, anything else: 401."""
+
+    print("🧪 Testing /metrics access control")
+    print("=" * 50)
+
+    client = app.test_client()
+    token, networks = metrics.METRICS_TOKEN, metrics.METRICS_ALLOW_NETWORKS
+    try:
+        metrics.METRICS_TOKEN, metrics.METRICS_ALLOW_NETWORKS = None, []
+        assert client.get("/metrics").status_code == 404
+        print("✅ Not configured: /metrics is not served")
+
+        metrics.METRICS_TOKEN = "s3cret"
+        assert client.get("/metrics").status_code == 401
+        assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+        assert client.get("/metrics", headers={"Authorization": "Bearer s3cret"}).status_code == 200
+        print("✅ Token required and accepted")
+
+        metrics.METRICS_TOKEN = None
+        metrics.METRICS_ALLOW_NETWORKS = [ipaddress.ip_network("10.0.0.0/8")]
+        assert client.get("/metrics", environ_base={"REMOTE_ADDR": "10.1.2.3"}).status_code == 200
+        assert client.get("/metrics", environ_base={"REMOTE_ADDR": "192.168.1.5"}).status_code == 401
+        print("✅ Allowed network scrapes without token, others are refused")
+    finally:
+        metrics.METRICS_TOKEN, metrics.METRICS_ALLOW_NETWORKS = token, networks
+
+    return True
+
+if __name__ == "__main__":
+    test_metrics_auth()
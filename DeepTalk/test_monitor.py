@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Queue and match changes reach the monitor as NOTIFY events."""
+
+import os
+import sys
+import json
+import time
+import select
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import psycopg2
+import psycopg2.extras
+from db import DATABASE_URL, get_cursor
+from matchmaking import claim_match
+from match_tick import TICK_LOCK_KEY
+from monitor_matching import CHANNEL, MatchMonitor
+
+def _drain(conn, monitor, seconds=1.0):
+    """Apply everything that arrives within ``seconds``; returns the number of payloads."""
+    payloads = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        if select.select([conn], [], [], 0.1)[0]:
+            conn.poll()
+            while conn.notifies:
+                monitor.apply(json.loads(conn.notifies.pop(0).payload))
+                payloads += 1
+    return payloads
+
+def test_monitor():
+    """Enqueue two users, match them and check the monitor's aggregates."""
+
+    print("🧪 Testing the event-driven matching monitor")
+    print("=" * 50)
+
+    try:
+        conn = psycopg2.connect(DATABASE_URL)
+        conn.autocommit = True
+        monitor = MatchMonitor()
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            cur.execute("LISTEN " + CHANNEL)
+            # Tick-Lock halten: ein laufender Match-Tick paart die Testnutzer nicht vorher
+            cur.execute("SELECT pg_advisory_lock(%s)", (TICK_LOCK_KEY,))
+            monitor.load(cur)
+        before = monitor.stats()
+
+        with get_cursor(commit=True) as cur:
+            cur.execute("""
+                INSERT INTO app_user (onboarding_done)
+                SELECT TRUE FROM generate_series(1, 2)
+                RETURNING id
+            """)
+            a, b = [str(row["id"]) for row in cur.fetchall()]
+            cur.execute("""
+                INSERT INTO match_queue (user_id, mood, style, lang)
+                VALUES (%s, 'lonely', 'fun', 'xx'), (%s, 'lonely', 'fun', 'xx')
+            """, (a, b))
+        payloads = _drain(conn, monitor)
+        assert monitor.stats()["buckets"].get("xx/fun/lonely") == 2, monitor.stats()
+        assert payloads == 1, f"{payloads} payloads for one INSERT"
+        print("✅ Enqueues show up in the bucket depth, one payload per statement")
+
+        with get_cursor(commit=True) as cur:
+            _, session = claim_match(cur, a)
+        assert session, "no match"
+        _drain(conn, monitor)
+        after = monitor.stats()
+        assert "xx/fun/lonely" not in after["buckets"], after
+        assert after["queue"] == before["queue"], (before, after)
+        assert after["sessions"]["initiated"] == before["sessions"]["initiated"] + 1, after
+        assert after["wait_samples"] == before["wait_samples"] + 2, after
+        assert after["matches_per_min"] >= 1
+        print(f"✅ Match counted: {after['matches_per_min']}/min, wait p50 {after['wait_p50_s']}s")
+
+        # Heartbeat ändert keinen Status: kein Event
+        with get_cursor(commit=True) as cur:
+            cur.execute("UPDATE conversation_session SET last_activity = now() WHERE id = %s",
+                        (session["id"],))
+        assert _drain(conn, monitor, 0.3) == 0, "heartbeat sent a monitor event"
+
+        with get_cursor(commit=True) as cur:
+            cur.execute("UPDATE conversation_session SET status = 'ended', ended_at = now() WHERE id = %s",
+                        (session["id"],))
+        _drain(conn, monitor)
+        assert monitor.stats()["sessions"]["initiated"] == before["sessions"]["initiated"]
+        print("✅ Ended session left the open-session counts")
+        conn.close()
+
+        with get_cursor(commit=True) as cur:
+            cur.execute("DELETE FROM session_participant WHERE session_id = %s", (session["id"],))
+            cur.execute("DELETE FROM conversation_session WHERE id = %s", (session["id"],))
+            cur.execute("DELETE FROM app_user WHERE id IN (%s, %s)", (a, b))
+    except psycopg2.OperationalError as e:
+        print(f"❌ Database not available: {e}")
+        return False
+
+    return True
+
+if __name__ == "__main__":
+    test_monitor()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""Expired idle connections at the bottom of the pool's stack get closed."""
+
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import psycopg2
+from db import DATABASE_URL, ConnectionPool
+
+def test_pool_sweep():
+    """After a burst, expired idle connections above min_size are closed on checkin."""
+
+    print("🧪 Testing the connection pool sweep")
+    print("=" * 50)
+
+    pool = ConnectionPool(DATABASE_URL, min_size=1, max_size=4, max_lifetime=3600)
+    try:
+        # Lastspitze: vier Verbindungen, danach nur noch eine im Wechsel benutzt
+        burst = [pool.getconn() for _ in range(4)]
+        for conn in burst:
+            pool.putconn(conn)
+        assert pool.stats()["idle"] == 4
+        bottom = [conn for conn, _ in list(pool._idle)[:3]]
+        for conn in bottom:
+            pool._created_at[conn] -= 7200
+
+        conn = pool.getconn()
+        pool.putconn(conn)
+        stats = pool.stats()
+        assert stats["connections_swept"] == 3 and stats["size"] == 1, stats
+        assert all(conn.closed for conn in bottom)
+        print(f"✅ {stats['connections_swept']} expired idle connections closed, {stats['size']} left")
+
+        # Auch abgelaufen, aber min_size bleibt offen (getconn ersetzt sie beim nächsten Checkout)
+        pair = [pool.getconn(), pool.getconn()]
+        for conn in pair:
+            pool.putconn(conn)
+        for conn, _ in list(pool._idle):
+            pool._created_at[conn] -= 7200
+        with pool._cond:
+            swept = pool._sweep(time.monotonic())
+        for conn in swept:
+            pool._close(conn)
+        assert len(swept) == 1 and pool.stats()["size"] == 1, pool.stats()
+        print("✅ Never sweeps below min_size")
+    except psycopg2.OperationalError as e:
+        print(f"❌ Database not available: {e}")
+        return False
+    finally:
+        pool.close()
+
+    return True
+
+if __name__ == "__main__":
+    test_pool_sweep()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""EXPLAIN the hot queries on a seeded dataset and fail on sequential scans.
+
+Copies the hot tables with all their indexes into a scratch schema inside
+one transaction (rolled back at the end), seeds them, runs ANALYZE and
+checks that none of the hot queries plans a Seq Scan on those tables. The
+copies keep the statistics away from autovacuum and the real data out of
+the picture. Needs the indexes and the partitioned chat_message from
+``migrations/`` (``python migrate.py``).
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import psycopg2
+from db import get_cursor
+
+USERS = 5000
+SESSIONS = 20000
+QUEUED = 1000
+CONNECTIONS = 2000
+MESSAGES = 50000
+
+SEEDED_TABLES = {"app_user", "conversation_session", "session_participant", "match_queue",
+                 "user_connection", "chat_message", "conversation_summary", "session_card_usage"}
+
+# Partitionierte Tabellen (migrations/002): Kopie ebenfalls partitioniert
+PARTITIONED_TABLES = {"chat_message": "RANGE (sent_at)"}
+
+SEED_SQL = [
+    "CREATE SCHEMA plan_check",
+] + [
+    f"CREATE TABLE plan_check.{table} (LIKE public.{table} INCLUDING ALL)"
+    + (f" PARTITION BY {PARTITIONED_TABLES[table]}" if table in PARTITIONED_TABLES else "")
+    for table in sorted(SEEDED_TABLES)
+] + [
+    "SET LOCAL search_path = plan_check, public",
+    # Ältere Monate und laufender Monat; die Nachrichten reichen über beide
+    """
+    CREATE TABLE chat_message_old PARTITION OF chat_message
+    FOR VALUES FROM (MINVALUE) TO (date_trunc('month', now()))
+    """,
+    """
+    CREATE TABLE chat_message_current PARTITION OF chat_message
+    FOR VALUES FROM (date_trunc('month', now())) TO (MAXVALUE)
+    """,
+    """
+    INSERT INTO app_user (onboarding_done, nickname)
+    SELECT TRUE, 'plan_' || i FROM generate_series(1, %(users)s) AS i
+    """,
+    """
+    CREATE TEMP TABLE plan_user ON COMMIT DROP AS
+    SELECT row_number() OVER () AS n, id FROM app_user
+    """,
+    """
+    INSERT INTO conversation_session (status, ice_room_key, created_at, started_at, last_activity, ended_at)
+    SELECT CASE WHEN i %% 20 = 0 THEN 'initiated' ELSE 'ended' END::session_status,
+           'plan_' || i,
+           now() - i * interval '1 minute',
+           now() - i * interval '1 minute',
+           now() - i * interval '1 minute',
+           CASE WHEN i %% 20 = 0 THEN NULL ELSE now() - i * interval '1 minute' + interval '10 minutes' END
+    FROM generate_series(1, %(sessions)s) AS i
+    """,
+    """
+    INSERT INTO session_participant (session_id, user_id, joined_at)
+    SELECT s.id, u.id, s.created_at
+    FROM conversation_session s
+    JOIN plan_user u ON u.n IN ((substr(s.ice_room_key, 6)::int * 2) %% %(users)s + 1,
+                                (substr(s.ice_room_key, 6)::int * 2 + 1) %% %(users)s + 1)
+    """,
+    """
+    INSERT INTO session_card_usage (session_id, card_id, position)
+    SELECT s.id, (substr(s.ice_room_key, 6)::int + p) %% 50 + 1, p
+    FROM conversation_session s, generate_series(1, 5) AS p
+    """,
+    """
+    INSERT INTO match_queue (user_id, mood, style, lang, enqueued_at)
+    SELECT id,
+           (ARRAY['neutral','calm','curious'])[n %% 3 + 1]::mood_type,
+           (ARRAY['deep','fun'])[n %% 2 + 1]::convo_style,
+           (ARRAY['de','en'])[n %% 2 + 1],
+           now() - n * interval '100 milliseconds'
+    FROM plan_user WHERE n <= %(queued)s
+    """,
+    """
+    INSERT INTO user_connection (user1_id, user2_id, session_id, last_activity)
+    SELECT LEAST(a.id, b.id), GREATEST(a.id, b.id), s.id, now() - a.n * interval '1 minute'
+    FROM plan_user a
+    JOIN plan_user b ON b.n = a.n %% %(users)s + 1
+    JOIN LATERAL (SELECT id FROM conversation_session LIMIT 1) s ON true
+    WHERE a.n <= %(connections)s
+    """,
+    """
+    INSERT INTO chat_message (connection_id, sender_id, message, sent_at, read_at)
+    SELECT uc.id, CASE WHEN i %% 2 = 0 THEN uc.user1_id ELSE uc.user2_id END, 'msg ' || i,
+           now() - i * interval '1 minute',
+           CASE WHEN i %% 10 = 0 THEN NULL ELSE now() END
+    FROM generate_series(1, %(messages)s) AS i
+    JOIN user_connection uc ON uc.id = (SELECT min(id) FROM user_connection) + i %% %(connections)s
+    """,
+    """
+    INSERT INTO conversation_summary (user_id, connection_id, other_user_id, connected_at, last_activity)
+    SELECT side.user_id, uc.id, side.other_user_id, uc.connected_at, uc.last_activity
+    FROM user_connection uc,
+         LATERAL (VALUES (uc.user1_id, uc.user2_id), (uc.user2_id, uc.user1_id)) AS side(user_id, other_user_id)
+    ON CONFLICT DO NOTHING
+    """,
+]
+
+
+def hot_queries(cur):
+    """``[(name, sql, params)]`` for the queries that run on every request."""
+    from app import ACTIVE_SESSION_SQL, CONNECTIONS_SQL, CHAT_MESSAGES_SINCE_SQL, SESSION_DECK_SQL
+    from matchmaking import CLAIM_SQL
+    from cards import SEEN_CARDS_SQL
+    from match_tick import SNAPSHOT_SQL, LOCK_PICKED_SQL
+    from reaper import CLOSE_STALE_SESSIONS_SQL, EXPIRE_QUEUE_SQL, OPEN_STATUSES
+    import write_behind
+    import chat
+
+    cur.execute("SELECT id FROM plan_user WHERE n = %s", (USERS // 2,))
+    user_id = cur.fetchone()["id"]
+    cur.execute("SELECT user_id, enqueued_at FROM match_queue ORDER BY enqueued_at DESC LIMIT 2")
+    picked = cur.fetchall()
+    queued_id = picked[0]["user_id"]
+    cur.execute("""
+        SELECT uc.id, uc.user1_id FROM user_connection uc
+        JOIN plan_user u ON u.id = uc.user1_id ORDER BY uc.id LIMIT 1
+    """)
+    connection = cur.fetchone()
+    cur.execute("SELECT max(id) AS id FROM chat_message WHERE connection_id = %s", (connection["id"],))
+    after_id = cur.fetchone()["id"]
+    cur.execute("SELECT now() AS now")
+    now = cur.fetchone()["now"]
+    cur.execute("SELECT session_id FROM session_participant WHERE user_id = %s LIMIT 1", (user_id,))
+    session_id = cur.fetchone()["session_id"]
+
+    return [
+        ("active session", ACTIVE_SESSION_SQL, (user_id, 300)),
+        ("in queue", "SELECT user_id FROM match_queue WHERE user_id = %s", (user_id,)),
+        ("session deck", SESSION_DECK_SQL, (session_id,)),
+        ("seen cards", SEEN_CARDS_SQL, ([user_id, queued_id], [session_id])),
+        ("claim match", CLAIM_SQL, {"user_id": queued_id, "partner": None, "room_key": "plan"}),
+        ("tick snapshot", SNAPSHOT_SQL, {"batch": 200}),
+        ("tick lock picked", LOCK_PICKED_SQL,
+         {"user_ids": [row["user_id"] for row in picked], "enqueued_at": [row["enqueued_at"] for row in picked]}),
+        ("connections", CONNECTIONS_SQL, (connection["user1_id"],)),
+        ("chat membership", chat.MEMBERSHIP_SQL, (connection["id"], connection["user1_id"], connection["user1_id"])),
+        ("chat messages since", CHAT_MESSAGES_SINCE_SQL,
+         {"user_id": connection["user1_id"], "connection_id": connection["id"],
+          "after_id": after_id, "since": None, "overlap": 10,
+          "have": [after_id], "have_given": True}),
+        ("chat history", chat.HISTORY_SQL,
+         {"user_id": connection["user1_id"], "connection_id": connection["id"],
+          "before_id": after_id, "limit": chat.CHAT_PAGE_SIZE + 1}),
+        ("mark read", write_behind.BATCH_MARK_READ_SQL,
+         {"connection_ids": [connection["id"]], "user_ids": [connection["user1_id"]], "max_ids": [after_id]}),
+        ("summary unread", write_behind.BATCH_SUMMARY_UNREAD_SQL,
+         {"connection_ids": [connection["id"]], "user_ids": [connection["user1_id"]]}),
+        ("touch connection", write_behind.BATCH_TOUCH_SQL, {"connection_ids": [connection["id"]], "at": [now]}),
+        ("summary touch", write_behind.BATCH_SUMMARY_TOUCH_SQL, {"connection_ids": [connection["id"]], "at": [now]}),
+        ("reaper sessions", CLOSE_STALE_SESSIONS_SQL,
+         {"statuses": list(OPEN_STATUSES), "max_age": 600, "batch": 200}),
+        ("reaper queue", EXPIRE_QUEUE_SQL, {"max_age": 900, "batch": 200}),
+    ]
+
+
+def seq_scans(plan):
+    """Yield the relation names of all Seq Scan nodes on seeded tables and their partitions."""
+    relation = plan.get("Relation Name", "")
+    if plan.get("Node Type") == "Seq Scan" and (
+            relation in SEEDED_TABLES
+            or any(relation.startswith(table + "_") for table in PARTITIONED_TABLES)):
+        yield relation
+    for child in plan.get("Plans", []):
+        yield from seq_scans(child)
+
+
+def test_query_plans():
+    """No hot query falls back to a sequential scan on the seeded tables."""
+
+    print("🧪 Checking query plans of the hot paths")
+    print("=" * 50)
+
+    try:
+        # Ohne commit: die Seed-Daten verschwinden mit dem Rollback
+        with get_cursor() as cur:
+            params = {"users": USERS, "sessions": SESSIONS, "queued": QUEUED,
+                      "connections": CONNECTIONS, "messages": MESSAGES}
+            for sql in SEED_SQL:
+                cur.execute(sql, params)
+            for table in sorted(SEEDED_TABLES):
+                cur.execute(f"ANALYZE {table}")
+            print(f"✅ Seeded {USERS} users, {SESSIONS} sessions, {MESSAGES} messages")
+
+            failures = []
+            for name, sql, args in hot_queries(cur):
+                cur.execute("EXPLAIN (FORMAT JSON) " + sql, args)
+                plan = cur.fetchone()["QUERY PLAN"][0]["Plan"]
+                scans = sorted(set(seq_scans(plan)))
+                if scans:
+                    failures.append((name, scans))
+                    print(f"❌ {name}: Seq Scan on {', '.join(scans)}")
+                else:
+                    print(f"✅ {name}")
+    except psycopg2.OperationalError as e:
+        print(f"❌ Database not available: {e}")
+        return False
+
+    assert not failures, f"sequential scans in hot queries: {failures}"
+    return True
+
+if __name__ == "__main__":
+    test_query_plans()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""Queue positions from QueueRanks match the FIFO order of a bucket."""
+
+import os
+import sys
+import random
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from matchmaking import QueueRanks
+
+def test_queue_ranks():
+    """Random joins and leaves (also from the middle) keep positions gap-free."""
+
+    print("🧪 Testing queue positions")
+    print("=" * 50)
+
+    rng = random.Random(23)
+    ranks = QueueRanks(capacity=4)
+    expected = []
+    for step in range(5000):
+        if expected and rng.random() < 0.45:
+            # Claims durch andere Worker oder Reaper treffen beliebige Wartende
+            user_id = expected.pop(rng.randrange(len(expected)))
+            ranks.remove(user_id)
+        else:
+            user_id = f"user-{step}"
+            expected.append(user_id)
+            ranks.add(user_id)
+        if step % 50 == 0:
+            positions = [ranks.position(u) for u in expected]
+            assert positions == list(range(1, len(expected) + 1)), step
+
+    assert len(ranks) == len(expected)
+    assert ranks.position("user-unknown") is None
+    print(f"✅ {len(expected)} waiting, positions match the FIFO order")
+    return True
+
+if __name__ == "__main__":
+    test_queue_ranks()
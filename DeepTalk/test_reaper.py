@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""The reaper ends sessions without heartbeat and frees their participants."""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import psycopg2
+from db import get_cursor
+
+def test_reaper():
+    """A reaped session clears the engine assignment; a live one keeps running."""
+
+    print("🧪 Testing the session reaper")
+    print("=" * 50)
+
+    try:
+        from app import app
+        from matchmaking import MatchEngine
+        from reaper import Reaper
+
+        with get_cursor(commit=True) as cur:
+            cur.execute("""
+                INSERT INTO app_user (onboarding_done)
+                SELECT TRUE FROM generate_series(1, 4)
+                RETURNING id
+            """)
+            a, b, c, d = sorted(str(row["id"]) for row in cur.fetchall())
+            # Gestartet vor zwei Stunden: die alte ohne, die lange mit frischem Heartbeat
+            cur.execute("""
+                INSERT INTO conversation_session (status, ice_room_key, created_at, started_at, last_activity)
+                VALUES ('connected', 'reaper_stale', now() - interval '2 hours', now() - interval '2 hours',
+                        now() - interval '20 minutes'),
+                       ('connected', 'reaper_live', now() - interval '2 hours', now() - interval '2 hours',
+                        now() - interval '1 minute')
+                RETURNING id, ice_room_key
+            """)
+            sessions = {row["ice_room_key"]: str(row["id"]) for row in cur.fetchall()}
+            stale, live = sessions["reaper_stale"], sessions["reaper_live"]
+            cur.execute("""
+                INSERT INTO session_participant (session_id, user_id)
+                VALUES (%s, %s), (%s, %s), (%s, %s), (%s, %s)
+            """, (stale, a, stale, b, live, c, live, d))
+
+        engine = MatchEngine()
+        engine.matched({"id": stale, "ice_room_key": "reaper_stale", "partner_id": b}, a, b)
+        engine.matched({"id": live, "ice_room_key": "reaper_live", "partner_id": d}, c, d)
+
+        report = Reaper(engine, session_max_age=600).run_once()
+        assert report["sessions_closed"] >= 1, report
+        assert engine.assignment(a) is None and engine.assignment(b) is None
+        assert engine.assignment(c) and engine.assignment(d)
+        with get_cursor() as cur:
+            cur.execute("SELECT id, status FROM conversation_session WHERE id IN (%s, %s)", (stale, live))
+            status = {str(row["id"]): row["status"] for row in cur.fetchall()}
+        assert status == {stale: "dropped", live: "connected"}, status
+        print("✅ Session without heartbeat dropped and its assignments released")
+
+        # Heartbeat hält die Session offen und zählt für die Weiterleitung
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess["uid"] = c
+        with get_cursor(commit=True) as cur:
+            cur.execute("UPDATE conversation_session SET last_activity = now() - interval '20 minutes' WHERE id = %s",
+                        (live,))
+        assert live not in client.get("/").get_data(as_text=True)
+        beat = client.post(f"/session/{live}/heartbeat")
+        assert beat.status_code == 200, beat.data
+        assert live in client.get("/").get_data(as_text=True)
+        Reaper(engine, session_max_age=600).run_once()
+        assert engine.assignment(c), "heartbeat keeps the session open"
+        print("✅ Heartbeat keeps a long session alive and offered again")
+
+        with get_cursor(commit=True) as cur:
+            cur.execute("DELETE FROM session_participant WHERE session_id IN (%s, %s)", (stale, live))
+            cur.execute("DELETE FROM conversation_session WHERE id IN (%s, %s)", (stale, live))
+            cur.execute("DELETE FROM app_user WHERE id IN (%s, %s, %s, %s)", (a, b, c, d))
+    except psycopg2.OperationalError as e:
+        print(f"❌ Database not available: {e}")
+        return False
+
+    return True
+
+if __name__ == "__main__":
+    test_reaper()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""Candidate scoring prefers compatible partners and relaxes its constraints while waiting."""
+
+import os
+import sys
+from datetime import datetime, timezone
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from scoring import CandidatePool
+
+NOW = datetime(2026, 6, 1, 12, 0, tzinfo=timezone.utc).timestamp()
+
+def profile(waited=0, **fields):
+    row = {"lang": "de", "style": "deep", "mood": "calm", "birth_year": 1990,
+           "enqueued_at": datetime.fromtimestamp(NOW - waited, timezone.utc)}
+    row.update(fields)
+    return row
+
+def best(pool, **seeker):
+    found = pool.best(profile=profile(**seeker), now=NOW)
+    return found and found[0]
+
+def test_scoring():
+    """Preferences, relaxation and the wait bonus decide the partner."""
+
+    print("🧪 Testing candidate scoring")
+    print("=" * 50)
+
+    pool = CandidatePool(capacity=2)
+    pool.add("other-style", profile(waited=5, style="fun"))
+    pool.add("same", profile(waited=5))
+    pool.add("other-mood", profile(waited=5, mood="stressed"))
+    assert best(pool) == "same"
+    pool.remove("same")
+    assert best(pool) is None, "style and mood are strict for new entries"
+    assert best(pool, waited=20) == "other-mood", "mood relaxes first"
+    assert best(pool, waited=40) in ("other-mood", "other-style")
+    print("✅ Exact matches first, mood and style relax with the wait")
+
+    pool = CandidatePool()
+    pool.add("english", profile(waited=10, lang="en"))
+    assert best(pool) is None
+    assert best(pool, waited=100) is None, "no shared language preference"
+    assert best(pool, waited=100, preferred_lang="en") == "english"
+    print("✅ Other languages only after LANG_STRICT_FOR and only towards the preferred one")
+
+    pool = CandidatePool()
+    pool.add("older", profile(birth_year=1976))     # 50 im Jahr 2026
+    assert best(pool, min_age=30, max_age=40) is None
+    assert best(pool, waited=4 * 60, min_age=30, max_age=40) is None
+    assert best(pool, waited=6 * 60, min_age=30, max_age=40) == "older"
+    pool.add("unknown age", profile(birth_year=None))
+    assert best(pool, min_age=30, max_age=40) == "unknown age"
+    print("✅ Age windows widen with the seeker's wait")
+
+    pool = CandidatePool()
+    pool.add("newer", profile(waited=10))
+    pool.add("longest", profile(waited=90))
+    pool.add("preferred", profile(waited=10, preferred_style="deep"))
+    assert best(pool) == "longest"
+    pool.remove("longest")
+    assert best(pool) == "preferred"
+    pool.add("member", profile(waited=30))
+    assert pool.best("member", now=NOW)[0] == "preferred"
+    assert pool.best("member", now=NOW, exclude={"preferred"})[0] == "newer"
+    assert "preferred" in pool, "exclude only skips"
+    print("✅ Long waiters and matching preferences win ties")
+    return True
+
+if __name__ == "__main__":
+    test_scoring()
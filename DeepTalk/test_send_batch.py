@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Batch-send chat messages, resend the same batch and check nothing is stored twice."""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import psycopg2
+from db import get_cursor
+import conversation_summary
+
+MESSAGES = 20
+
+def test_send_batch():
+    """A retried batch creates no duplicates and keeps the original order and ids."""
+
+    print("🧪 Testing batched message submission")
+    print("=" * 50)
+
+    try:
+        from app import app
+
+        with get_cursor(commit=True) as cur:
+            cur.execute("""
+                INSERT INTO app_user (onboarding_done)
+                SELECT TRUE FROM generate_series(1, 2)
+                RETURNING id
+            """)
+            a, b = sorted(str(row["id"]) for row in cur.fetchall())
+            cur.execute("""
+                INSERT INTO conversation_session (status, ice_room_key, ended_at)
+                VALUES ('ended', 'send_batch', now())
+                RETURNING id
+            """)
+            session_id = cur.fetchone()["id"]
+            cur.execute("""
+                INSERT INTO user_connection (user1_id, user2_id, session_id)
+                VALUES (%s, %s, %s)
+                RETURNING id
+            """, (a, b, session_id))
+            connection_id = cur.fetchone()["id"]
+            conversation_summary.create(cur, connection_id)
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess["uid"] = a
+
+        batch = [{"client_key": f"k{i}", "message": f"backlog {i}"} for i in range(MESSAGES)]
+        # Doppelter Schlüssel im selben Batch zählt einmal
+        batch.append({"client_key": "k0", "message": "backlog 0 again"})
+        first = client.post(f"/chat/{connection_id}/messages", json={"messages": batch})
+        assert first.status_code == 200, first.data
+        assert first.json["created"] == MESSAGES and first.json["duplicates"] == 0, first.json
+        print(f"✅ {MESSAGES} messages stored in one batch")
+
+        # Wiederholung nach "Netzabbruch": nichts Neues, gleiche ids
+        retry = client.post(f"/chat/{connection_id}/messages", json={"messages": batch})
+        assert retry.json["created"] == 0 and retry.json["duplicates"] == MESSAGES, retry.json
+        assert [m["id"] for m in retry.json["messages"]] == [m["id"] for m in first.json["messages"]]
+        print("✅ Resent batch was deduplicated and returned the original ids")
+
+        with get_cursor() as cur:
+            cur.execute("""
+                SELECT message FROM chat_message WHERE connection_id = %s ORDER BY sent_at, id
+            """, (connection_id,))
+            stored = [row["message"] for row in cur.fetchall()]
+            cur.execute("""
+                SELECT unread_count FROM conversation_summary WHERE connection_id = %s AND user_id = %s
+            """, (connection_id, b))
+            unread = cur.fetchone()["unread_count"]
+        assert stored == [f"backlog {i}" for i in range(MESSAGES)], stored
+        assert unread == MESSAGES, unread
+        print(f"✅ Order kept, recipient has {unread} unread")
+
+        bad = client.post(f"/chat/{connection_id}/messages", json={"messages": [{"message": "no key"}]})
+        assert bad.status_code == 400
+
+        with get_cursor(commit=True) as cur:
+            cur.execute("DELETE FROM chat_message WHERE connection_id = %s", (connection_id,))
+            cur.execute("DELETE FROM user_connection WHERE id = %s", (connection_id,))
+            cur.execute("DELETE FROM conversation_session WHERE id = %s", (session_id,))
+            cur.execute("DELETE FROM app_user WHERE id IN (%s, %s)", (a, b))
+    except psycopg2.OperationalError as e:
+        print(f"❌ Database not available: {e}")
+        return False
+
+    return True
+
+if __name__ == "__main__":
+    test_send_batch()
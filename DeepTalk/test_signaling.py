@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""Relay signaling and chat messages between two worker processes via LISTEN/NOTIFY."""
+
+import os
+import sys
+import time
+import json
+import socket
+import subprocess
+import urllib.parse
+import urllib.request
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import psycopg2
+import simple_websocket
+from db import get_cursor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PORTS = (5101, 5102)
+
+WORKER = """
+import sys
+sys.path.insert(0, {here!r})
+from werkzeug.serving import run_simple
+from wsgi import app
+run_simple('127.0.0.1', {port}, app, threaded=True)
+"""
+
+def _start_worker(port):
+    env = dict(os.environ, SIGNAL_BACKEND="postgres")
+    return subprocess.Popen([sys.executable, "-c", WORKER.format(here=HERE, port=port)],
+                            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def _wait_for_port(port, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+def _cookie(user_id):
+    from app import app
+    signed = app.session_interface.get_signing_serializer(app).dumps({"uid": user_id})
+    return f"{app.config['SESSION_COOKIE_NAME']}={signed}"
+
+def _chat_across_workers():
+    """A chat socket on worker A gets a message posted on worker B."""
+    with get_cursor(commit=True) as cur:
+        cur.execute("""
+            INSERT INTO app_user (onboarding_done)
+            SELECT TRUE FROM generate_series(1, 2)
+            RETURNING id
+        """)
+        a, b = sorted(str(row["id"]) for row in cur.fetchall())
+        cur.execute("""
+            INSERT INTO conversation_session (status, ice_room_key, ended_at)
+            VALUES ('ended', %s, now())
+            RETURNING id
+        """, ("chat_workers_" + os.urandom(4).hex(),))
+        session_id = cur.fetchone()["id"]
+        cur.execute("""
+            INSERT INTO user_connection (user1_id, user2_id, session_id)
+            VALUES (%s, %s, %s)
+            RETURNING id
+        """, (a, b, session_id))
+        connection_id = cur.fetchone()["id"]
+    try:
+        chat_a = simple_websocket.Client.connect(f"ws://127.0.0.1:{PORTS[0]}/ws/chat/{connection_id}",
+                                                 headers={"Cookie": _cookie(a)})
+        time.sleep(0.5)
+        request = urllib.request.Request(
+            f"http://127.0.0.1:{PORTS[1]}/chat/{connection_id}/send",
+            data=urllib.parse.urlencode({"message": "hallo von B"}).encode(),
+            headers={"Cookie": _cookie(b)})
+        urllib.request.urlopen(request, timeout=5)
+        pushed = json.loads(chat_a.receive(timeout=5))
+        assert pushed["type"] == "message" and "hallo von B" in pushed["html"], pushed
+        assert "other" in pushed["html"], "rendered for the receiving user"
+        chat_a.close()
+        print("✅ Chat message posted on worker B pushed to the socket on worker A")
+    finally:
+        with get_cursor(commit=True) as cur:
+            cur.execute("DELETE FROM chat_message WHERE connection_id = %s", (connection_id,))
+            cur.execute("DELETE FROM conversation_summary WHERE connection_id = %s", (connection_id,))
+            cur.execute("DELETE FROM user_connection WHERE id = %s", (connection_id,))
+            cur.execute("DELETE FROM conversation_session WHERE id = %s", (session_id,))
+            cur.execute("DELETE FROM app_user WHERE id IN (%s, %s)", (a, b))
+
+def test_signaling_across_workers():
+    """A peer on worker A receives small and oversized messages sent on worker B."""
+
+    print("🧪 Testing cross-process signaling (SIGNAL_BACKEND=postgres)")
+    print("=" * 50)
+
+    try:
+        with get_cursor() as cur:
+            cur.execute("SELECT to_regclass('signal_message') IS NOT NULL AS ready")
+            if not cur.fetchone()["ready"]:
+                print("❌ signal_message missing, apply signaling_schema_update.sql")
+                return False
+    except psycopg2.OperationalError as e:
+        print(f"❌ Database not available: {e}")
+        return False
+
+    workers = [_start_worker(port) for port in PORTS]
+    try:
+        assert all(_wait_for_port(port) for port in PORTS), "workers did not start"
+        print(f"✅ Started workers on ports {PORTS}")
+
+        room = "test_" + os.urandom(8).hex()
+        peer_a = simple_websocket.Client.connect(f"ws://127.0.0.1:{PORTS[0]}/ws/signal/{room}")
+        peer_b = simple_websocket.Client.connect(f"ws://127.0.0.1:{PORTS[1]}/ws/signal/{room}")
+        time.sleep(0.5)  # LISTEN auf beiden Workern aktiv
+
+        small = json.dumps({"type": "candidate", "candidate": "x" * 100})
+        big = json.dumps({"type": "offer", "sdp": "v=0\r\n" + "a" * 20000})
+
+        start = time.time()
+        peer_b.send(small)
+        assert peer_a.receive(timeout=5) == small, "small message not relayed"
+        print(f"✅ Small message relayed in {(time.time() - start) * 1000:.1f} ms")
+
+        start = time.time()
+        peer_b.send(big)
+        assert peer_a.receive(timeout=5) == big, "oversized message not relayed"
+        print(f"✅ {len(big)} byte message relayed via signal_message in {(time.time() - start) * 1000:.1f} ms")
+
+        peer_a.send(small)
+        assert peer_b.receive(timeout=5) == small, "reverse direction not relayed"
+        print("✅ Reverse direction works")
+
+        _chat_across_workers()
+
+        for peer in (peer_a, peer_b):
+            try:
+                peer.close()
+            except Exception:
+                pass
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.wait(timeout=5)
+    return True
+
+if __name__ == "__main__":
+    test_signaling_across_workers()
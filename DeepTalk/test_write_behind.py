@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Idle chat polls and repeated chat views coalesce into one batched flush."""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import psycopg2
+from db import get_cursor
+import conversation_summary
+from write_behind import WriteBehind
+
+VIEWS = 20
+
+def test_write_behind():
+    """Repeated reads/touches become one pending entry and one flush marks everything read."""
+
+    print("🧪 Testing write-behind for read receipts and last_activity")
+    print("=" * 50)
+
+    # Ohne Flush-Thread puffern, flush() ruft der Test selbst
+    buffer = WriteBehind(touch_resolution=60, write_through=False)
+
+    try:
+        with get_cursor(commit=True) as cur:
+            cur.execute("""
+                INSERT INTO app_user (onboarding_done)
+                SELECT TRUE FROM generate_series(1, 2)
+                RETURNING id
+            """)
+            a, b = sorted(str(row["id"]) for row in cur.fetchall())
+            cur.execute("""
+                INSERT INTO conversation_session (status, ice_room_key, ended_at)
+                VALUES ('ended', 'write_behind', now())
+                RETURNING id
+            """)
+            session_id = cur.fetchone()["id"]
+            cur.execute("""
+                INSERT INTO user_connection (user1_id, user2_id, session_id, last_activity)
+                VALUES (%s, %s, %s, now() - interval '1 hour')
+                RETURNING id
+            """, (a, b, session_id))
+            connection_id = cur.fetchone()["id"]
+            conversation_summary.create(cur, connection_id)
+            cur.execute("""
+                INSERT INTO chat_message (connection_id, sender_id, message)
+                SELECT %s, %s, 'write-behind ' || i FROM generate_series(1, 5) AS i
+                RETURNING id
+            """, (connection_id, b))
+            delivered = max(row["id"] for row in cur.fetchall())
+            cur.execute("UPDATE conversation_summary SET unread_count = 5 WHERE user_id = %s", (a,))
+
+        # Wie VIEWS Aufrufe von chat_view: alles landet in zwei Einträgen
+        for _ in range(VIEWS):
+            buffer.mark_read(connection_id, a, delivered)
+            buffer.touch(connection_id)
+        assert buffer.pending() == 2, buffer.pending()
+        print(f"✅ {VIEWS} views coalesced into {buffer.pending()} pending writes")
+
+        # Nach dem Ausliefern eingetroffen: bleibt ungelesen, egal wie die Uhren stehen
+        with get_cursor(commit=True) as cur:
+            cur.execute("""
+                INSERT INTO chat_message (connection_id, sender_id, message)
+                VALUES (%s, %s, 'write-behind late')
+            """, (connection_id, b))
+            cur.execute("UPDATE conversation_summary SET unread_count = 6 WHERE user_id = %s", (a,))
+
+        buffer.flush()
+        with get_cursor() as cur:
+            cur.execute("""
+                SELECT COUNT(*) FILTER (WHERE read_at IS NULL) AS unread,
+                       (SELECT last_activity > now() - interval '1 minute'
+                        FROM user_connection WHERE id = %(id)s) AS touched,
+                       (SELECT unread_count FROM conversation_summary
+                        WHERE connection_id = %(id)s AND user_id = %(user_id)s) AS badge
+                FROM chat_message WHERE connection_id = %(id)s
+            """, {"id": connection_id, "user_id": a})
+            row = cur.fetchone()
+        assert row["unread"] == 1 and row["badge"] == 1 and row["touched"], row
+        print("✅ One flush marked the delivered messages read and bumped last_activity")
+
+        # Innerhalb der Auflösung: Touch wird gar nicht erst vorgemerkt
+        buffer.touch(connection_id)
+        assert buffer.pending() == 0
+        stats = buffer.stats()
+        assert stats["statements"] == 4 and stats["writes_saved"] == VIEWS * 4 + 2 - 4, stats
+        print(f"✅ {stats['writes_saved']} statements saved, {stats['touches_skipped']} touches skipped")
+
+        # Ohne start(): nichts bleibt liegen (z.B. WSGI-Import ohne start_background)
+        direct = WriteBehind()
+        direct.mark_read(connection_id, a, delivered)
+        assert direct.pending() == 0 and direct.stats()["statements"] == 2, direct.stats()
+        print("✅ Not started: writes go through immediately")
+
+        with get_cursor(commit=True) as cur:
+            cur.execute("DELETE FROM chat_message WHERE connection_id = %s", (connection_id,))
+            cur.execute("DELETE FROM conversation_summary WHERE connection_id = %s", (connection_id,))
+            cur.execute("DELETE FROM user_connection WHERE id = %s", (connection_id,))
+            cur.execute("DELETE FROM conversation_session WHERE id = %s", (session_id,))
+            cur.execute("DELETE FROM app_user WHERE id IN (%s, %s)", (a, b))
+    except psycopg2.OperationalError as e:
+        print(f"❌ Database not available: {e}")
+        return False
+
+    return True
+
+if __name__ == "__main__":
+    test_write_behind()
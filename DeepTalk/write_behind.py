@@ -0,0 +1,245 @@
+# write_behind.py
+"""Coalescing write-behind buffer for read receipts and last_activity.
+
+Opening a chat and every poll used to run ``UPDATE chat_message SET
+read_at`` and ``UPDATE user_connection SET last_activity`` on the request
+thread, even for an idle tab where nothing changed. Requests now only note
+what they want written:
+
+* ``mark_read(connection_id, user_id, up_to_id)`` – the user has seen every
+  message up to that id (the newest one delivered to them)
+* ``touch(connection_id)`` – the chat was active now
+
+Repeated calls for the same connection merge into one pending entry; a
+touch within ``WRITE_BEHIND_TOUCH_RESOLUTION`` seconds of the last written
+one is skipped. A daemon thread flushes everything every
+``WRITE_BEHIND_INTERVAL`` seconds (and at exit) with one ``unnest`` batch
+statement per table. Until :meth:`WriteBehind.start` has run (and again
+after :meth:`WriteBehind.stop`, or with ``WRITE_BEHIND_INTERVAL=0``) every
+call writes through immediately, so nothing piles up in a process that
+never starts the flush thread.
+"""
+
+import os
+import time
+import atexit
+import logging
+import threading
+from datetime import datetime, timezone
+
+import psycopg2
+
+from db import get_cursor, PoolTimeout
+import events
+
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "1"))
+WRITE_BEHIND_TOUCH_RESOLUTION = float(os.getenv("WRITE_BEHIND_TOUCH_RESOLUTION", "30"))
+
+# Nur Nachrichten, die ausgeliefert wurden: bis zur größten gezeigten id, nicht
+# nach Uhrzeit (App-Uhr und sent_at der Datenbank laufen nicht gleich)
+BATCH_MARK_READ_SQL = """
+    UPDATE chat_message cm
+    SET read_at = now()
+    FROM unnest(%(connection_ids)s::bigint[], %(user_ids)s::uuid[], %(max_ids)s::bigint[])
+         AS r(connection_id, user_id, max_id)
+    WHERE cm.connection_id = r.connection_id
+    AND cm.sender_id <> r.user_id
+    AND cm.read_at IS NULL
+    AND cm.id <= r.max_id
+"""
+
+# Ungelesene neu zählen statt auf 0 setzen: später eingetroffene bleiben ungelesen
+BATCH_SUMMARY_UNREAD_SQL = """
+    UPDATE conversation_summary cs
+    SET unread_count = unread.n
+    FROM unnest(%(connection_ids)s::bigint[], %(user_ids)s::uuid[]) AS r(connection_id, user_id)
+    CROSS JOIN LATERAL (
+        SELECT COUNT(*) AS n FROM chat_message
+        WHERE connection_id = r.connection_id
+        AND sender_id <> r.user_id
+        AND read_at IS NULL
+    ) unread
+    WHERE cs.connection_id = r.connection_id
+    AND cs.user_id = r.user_id
+    AND cs.unread_count <> unread.n
+"""
+
+BATCH_TOUCH_SQL = """
+    UPDATE user_connection uc
+    SET last_activity = t.at
+    FROM unnest(%(connection_ids)s::bigint[], %(at)s::timestamptz[]) AS t(id, at)
+    WHERE uc.id = t.id
+    AND (uc.last_activity IS NULL OR uc.last_activity < t.at)
+"""
+
+BATCH_SUMMARY_TOUCH_SQL = """
+    UPDATE conversation_summary cs
+    SET last_activity = t.at
+    FROM unnest(%(connection_ids)s::bigint[], %(at)s::timestamptz[]) AS t(id, at)
+    WHERE cs.connection_id = t.id
+    AND (cs.last_activity IS NULL OR cs.last_activity < t.at)
+"""
+
+# Statements, die ein mark_read / touch früher direkt ausgeführt hat
+STATEMENTS_PER_READ = 2     # chat_message + conversation_summary
+STATEMENTS_PER_TOUCH = 2    # user_connection + conversation_summary
+
+
+class WriteBehind:
+    def __init__(self, touch_resolution=WRITE_BEHIND_TOUCH_RESOLUTION, write_through=True):
+        self.touch_resolution = touch_resolution
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._reads = {}        # (connection_id, user_id) -> gelesen bis Nachrichten-id
+        self._touches = {}      # connection_id -> Zeitpunkt (datetime)
+        self._touched = {}      # connection_id -> monotonic des letzten geschriebenen Touch
+        self._thread = None
+        self._stop = threading.Event()
+        # Bis start() den Flush-Thread hat: sofort schreiben statt unbegrenzt puffern
+        self._write_through = write_through
+
+        self.reads_requested = 0
+        self.touches_requested = 0
+        self.touches_skipped = 0
+        self.flushes = 0
+        self.failures = 0
+        self.statements = 0
+        self.rows_written = 0
+        self.last_flush_ms = 0.0
+
+    def mark_read(self, connection_id, user_id, up_to_id):
+        """Mark the messages up to ``up_to_id`` as read (deferred)."""
+        up_to_id = int(up_to_id)
+        with self._lock:
+            self.reads_requested += 1
+            key = (int(connection_id), str(user_id))
+            if self._reads.get(key, up_to_id) <= up_to_id:
+                self._reads[key] = up_to_id
+        if self._write_through:
+            self.flush()
+
+    def touch(self, connection_id):
+        """Bump last_activity of the connection (deferred, coalesced)."""
+        connection_id = int(connection_id)
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            self.touches_requested += 1
+            written = self._touched.get(connection_id)
+            if written is not None and time.monotonic() - written < self.touch_resolution:
+                self.touches_skipped += 1
+                return
+            self._touches[connection_id] = now
+        if self._write_through:
+            self.flush()
+
+    def pending(self):
+        with self._lock:
+            return len(self._reads) + len(self._touches)
+
+    def flush(self):
+        """Write all pending entries. Returns the number of rows changed."""
+        with self._flush_lock:
+            with self._lock:
+                reads, self._reads = self._reads, {}
+                touches, self._touches = self._touches, {}
+            if not reads and not touches:
+                return 0
+
+            start = time.perf_counter()
+            statements = rows = 0
+            try:
+                with get_cursor(commit=True) as cur:
+                    if reads:
+                        keys = sorted(reads)
+                        params = {"connection_ids": [c for c, _ in keys], "user_ids": [u for _, u in keys],
+                                  "max_ids": [reads[k] for k in keys]}
+                        cur.execute(BATCH_MARK_READ_SQL, params)
+                        rows += cur.rowcount
+                        cur.execute(BATCH_SUMMARY_UNREAD_SQL, params)
+                        rows += cur.rowcount
+                        statements += 2
+                    if touches:
+                        # Sortiert, damit parallele Flushes die Zeilen in gleicher Reihenfolge sperren
+                        ids = sorted(touches)
+                        params = {"connection_ids": ids, "at": [touches[i] for i in ids]}
+                        cur.execute(BATCH_TOUCH_SQL, params)
+                        rows += cur.rowcount
+                        cur.execute(BATCH_SUMMARY_TOUCH_SQL, params)
+                        rows += cur.rowcount
+                        statements += 2
+            except (psycopg2.Error, PoolTimeout) as e:
+                self._requeue(reads, touches)
+                with self._lock:
+                    self.failures += 1
+                events.log("write_behind_failed", level=logging.WARNING, error=str(e),
+                           reads=len(reads), touches=len(touches))
+                return 0
+
+            written = time.monotonic()
+            with self._lock:
+                for connection_id in touches:
+                    self._touched[connection_id] = written
+                # Alte Einträge vergessen, sonst wächst _touched mit jeder Verbindung
+                cutoff = written - self.touch_resolution
+                for connection_id in [c for c, t in self._touched.items() if t < cutoff]:
+                    del self._touched[connection_id]
+                self.flushes += 1
+                self.statements += statements
+                self.rows_written += rows
+                self.last_flush_ms = round((time.perf_counter() - start) * 1000, 2)
+            return rows
+
+    def _requeue(self, reads, touches):
+        # Neuere Einträge aus der Zwischenzeit gewinnen
+        with self._lock:
+            for key, max_id in reads.items():
+                if self._reads.get(key, max_id) <= max_id:
+                    self._reads[key] = max_id
+            for connection_id, at in touches.items():
+                if self._touches.get(connection_id, at) <= at:
+                    self._touches[connection_id] = at
+
+    # --- Thread ---
+
+    def start(self, interval=WRITE_BEHIND_INTERVAL):
+        if interval <= 0:
+            self._write_through = True
+            return
+        if self._thread is not None:
+            return
+        self._write_through = False
+        self._thread = threading.Thread(target=self._run, args=(interval,), daemon=True, name="write-behind")
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the flush thread and write what is still pending."""
+        self._stop.set()
+        self._write_through = True
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            self.flush()
+
+    def stats(self):
+        with self._lock:
+            requested = (self.reads_requested * STATEMENTS_PER_READ
+                         + self.touches_requested * STATEMENTS_PER_TOUCH)
+            # Vorgemerktes zählt erst nach dem Flush als gespart
+            pending = len(self._reads) * STATEMENTS_PER_READ + len(self._touches) * STATEMENTS_PER_TOUCH
+            return {
+                "reads_requested": self.reads_requested,
+                "touches_requested": self.touches_requested,
+                "touches_skipped": self.touches_skipped,
+                "pending": len(self._reads) + len(self._touches),
+                "flushes": self.flushes,
+                "failures": self.failures,
+                "statements": self.statements,
+                "rows_written": self.rows_written,
+                "writes_saved": max(requested - pending - self.statements, 0),
+                "last_flush_ms": self.last_flush_ms,
+            }
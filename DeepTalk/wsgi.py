@@ -0,0 +1,12 @@
+# wsgi.py
+"""WSGI entry point for servers other than ``python app.py``.
+
+Importing ``app`` alone starts no background threads; this module starts
+them once per worker process:
+
+    gunicorn --threads 16 wsgi:app
+"""
+
+from app import app, start_background
+
+start_background()
@@ -0,0 +1,35 @@
+# xp.py
+"""XP and level awards for finished sessions.
+
+1 XP per completed minute between ``started_at`` and ``ended_at`` (at
+least 1), a level-up every 30 XP. Everything is computed in one UPDATE so
+concurrent awards can't lose each other's increments.
+"""
+
+XP_PER_LEVEL = 30
+
+AWARD_XP_SQL = """
+    WITH s AS (
+        SELECT GREATEST(1, COALESCE(
+                   floor(extract(epoch FROM ended_at - started_at) / 60)::int, 1)) AS gained
+        FROM conversation_session
+        WHERE id = %(session_id)s
+    )
+    UPDATE app_user u
+    SET xp = COALESCE(u.xp, 0) + s.gained,
+        level = COALESCE(u.level, 1)
+                + (COALESCE(u.xp, 0) + s.gained) / %(per_level)s
+                - COALESCE(u.xp, 0) / %(per_level)s
+    FROM s
+    WHERE u.id = ANY(%(user_ids)s::uuid[])
+    RETURNING u.id AS user_id, s.gained AS xp_gained, u.xp, u.level
+"""
+
+def award_session_xp(cur, session_id, user_ids):
+    """Award the XP for ``session_id`` to all ``user_ids`` in one statement.
+
+    Returns ``{user_id: {"xp_gained", "xp", "level"}}`` with the new values.
+    """
+    cur.execute(AWARD_XP_SQL, {"session_id": str(session_id), "user_ids": [str(u) for u in user_ids],
+                               "per_level": XP_PER_LEVEL})
+    return {str(row["user_id"]): row for row in cur.fetchall()}